@@ -0,0 +1,174 @@
+"""
+Admission control: estimate what a document will cost before any page is rendered, keep heavy
+documents in their own lane, and turn away work beyond the configured budgets.
+
+The estimate only reads metadata: byte size, page count and page sizes from the PDF structure,
+pixel dimensions from the image header. Light documents never queue behind heavy ones; both lanes
+share an in-flight memory and page budget, so a burst of big scans waits (or gets a 503) instead
+of exhausting the worker.
+"""
+from app.services.pages import count_pages
+from app.services import settings
+from contextlib import asynccontextmanager
+from fastapi import HTTPException
+import asyncio
+import contextvars
+import os
+
+# Rendered page bytes per pixel (RGB) times the copies prepare_page / OCR hold at once
+BYTES_PER_PIXEL = 3
+WORKING_COPIES = 4
+
+
+def _pdf_page_pixels(file_path: str, dpi: int) -> list[int]:
+    from pypdf import PdfReader
+
+    scale = dpi / 72
+    return [
+        int(float(page.mediabox.width) * scale) * int(float(page.mediabox.height) * scale)
+        for page in PdfReader(file_path).pages
+    ]
+
+
+def estimate_cost(file_path: str) -> dict:
+    """
+    Cheap cost estimate: {'bytes', 'pages', 'megapixels', 'memory_mb', 'heavy'}.
+    memory_mb is the peak working set: the largest page, times the pages rendered concurrently.
+    """
+    size = os.path.getsize(file_path)
+    if file_path.lower().endswith(".pdf"):
+        pixels = _pdf_page_pixels(file_path, settings.PREPARE_DPI)
+        pages = len(pixels) or count_pages(file_path)
+    else:
+        from PIL import Image
+
+        # Only the header is read; the image is not decoded
+        with Image.open(file_path) as img:
+            pixels = [img.width * img.height]
+        pages = 1
+    largest = max(pixels, default=0)
+    memory_mb = round(largest * BYTES_PER_PIXEL * WORKING_COPIES * min(pages, settings.PAGES_IN_FLIGHT) / (1024 * 1024), 1)
+    heavy = (
+        pages > settings.ADMISSION_HEAVY_PAGES
+        or size > settings.ADMISSION_HEAVY_BYTES
+        or memory_mb > settings.ADMISSION_HEAVY_MEMORY_MB
+    )
+    return {
+        'bytes': size,
+        'pages': pages,
+        'megapixels': round(largest / 1e6, 1),
+        'memory_mb': memory_mb,
+        'heavy': heavy
+    }
+
+
+def check_admissible(cost: dict):
+    """Raise 413 for documents that exceed the hard limits, whatever the current load."""
+    problems = []
+    if cost['pages'] > settings.ADMISSION_MAX_PAGES:
+        problems.append(f"{cost['pages']} pages (limit {settings.ADMISSION_MAX_PAGES})")
+    if cost['bytes'] > settings.ADMISSION_MAX_BYTES:
+        problems.append(f"{cost['bytes'] // (1024 * 1024)} MB (limit {settings.ADMISSION_MAX_BYTES // (1024 * 1024)} MB)")
+    if cost['memory_mb'] > settings.ADMISSION_MAX_MEMORY_MB:
+        problems.append(f"{cost['megapixels']} megapixels per page")
+    if problems:
+        raise HTTPException(status_code=413, detail=f"Document too large to process: {', '.join(problems)}")
+
+
+class AdmissionController:
+    """Two lanes (light / heavy) with their own concurrency, sharing memory and page budgets."""
+
+    def __init__(self, light_concurrency: int, heavy_concurrency: int, memory_budget_mb: float,
+                 page_budget: int, queue_timeout: float):
+        self.lanes = {False: light_concurrency, True: heavy_concurrency}
+        self.memory_budget_mb = memory_budget_mb
+        self.page_budget = page_budget
+        self.queue_timeout = queue_timeout
+        self.running = {False: 0, True: 0}
+        self.memory_mb = 0.0
+        self.pages = 0
+        self.waiting = 0
+        self._changed = asyncio.Condition()
+
+    def _fits(self, cost: dict) -> bool:
+        if self.running[cost['heavy']] >= self.lanes[cost['heavy']]:
+            return False
+        # An idle controller always admits one document, so nothing waits forever on the budgets
+        if not any(self.running.values()):
+            return True
+        return (self.memory_mb + cost['memory_mb'] <= self.memory_budget_mb
+                and self.pages + cost['pages'] <= self.page_budget)
+
+    @asynccontextmanager
+    async def admit(self, cost: dict):
+        async with self._changed:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self._fits(cost)), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Too many large documents in progress, try again later",
+                    headers={"Retry-After": str(int(self.queue_timeout))}
+                )
+            finally:
+                self.waiting -= 1
+            self.running[cost['heavy']] += 1
+            self.memory_mb += cost['memory_mb']
+            self.pages += cost['pages']
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.running[cost['heavy']] -= 1
+                self.memory_mb -= cost['memory_mb']
+                self.pages -= cost['pages']
+                self._changed.notify_all()
+
+    def snapshot(self) -> dict:
+        return {
+            'light_running': self.running[False],
+            'heavy_running': self.running[True],
+            'waiting': self.waiting,
+            'memory_mb': round(self.memory_mb, 1),
+            'pages': self.pages
+        }
+
+
+_controller = None
+
+
+def controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController(
+            settings.ADMISSION_LIGHT_CONCURRENCY,
+            settings.ADMISSION_HEAVY_CONCURRENCY,
+            settings.ADMISSION_MEMORY_BUDGET_MB,
+            settings.ADMISSION_PAGE_BUDGET,
+            settings.ADMISSION_QUEUE_TIMEOUT_SECONDS
+        )
+    return _controller
+
+
+# Set while a document holds its admission; the parts of a bundle run inside the bundle's
+_admitted = contextvars.ContextVar("admitted", default=False)
+
+
+@asynccontextmanager
+async def admit(file_path: str):
+    """
+    Estimate, reject (413) or wait for a slot in the document's lane (503 after the queue timeout).
+    Nested calls (process_file on the parts of an admitted bundle) are already covered and pass through.
+    """
+    if _admitted.get():
+        yield None
+        return
+    cost = await asyncio.to_thread(estimate_cost, file_path)
+    check_admissible(cost)
+    async with controller().admit(cost):
+        token = _admitted.set(True)
+        try:
+            yield cost
+        finally:
+            _admitted.reset(token)
@@ -0,0 +1,412 @@
+"""
+Offline batch mode for backfills: the merge stage of thousands of documents is sent as provider
+batch jobs instead of one online call per document, at batch prices and outside the online
+rate limits. Jobs and their items are tracked in `batch_jobs` / `batch_items`, so submitting,
+polling and collecting can run from different processes and survive restarts.
+
+    python -m app.services.batch submit [--dataset NAME] [--ids ID ...] [--force]
+    python -m app.services.batch poll [--wait]
+    python -m app.services.batch run [--dataset NAME] [--local]
+
+--local swaps in the in-process stand-in as a dry run: prompts are built and answered with
+placeholders, but no document and no batch_jobs / batch_items row is written. It only works with `run` (submit and collect in one
+process), since the stand-in keeps its jobs in memory.
+
+OCR still runs online (it needs the original files); batches cover re-merging stored OCR text.
+Documents with stored printed fields whose local merge has no conflicts are merged on the spot
+(LOCAL_MERGE_VERSION) and never go into a batch.
+"""
+from app.core.db import get_db_connection
+from app.services.document_store import fetch_documents, save_documents
+from app.services.gpt_extraction import clean_llm_json
+from app.services.local_merge import merge_output, merge_pages
+from app.services.ocr_store import HANDWRITTEN, PRINTED, load_ocr_texts, load_printed_fields
+from app.services.process import (
+    MERGE_VERSION, apply_merge, build_merge_prompt, parse_handwritten_fields, validate_output
+)
+from app.services.reextract import select_documents
+from app.services.settings import BATCH_MAX_REQUESTS, BATCH_POLL_INTERVAL_SECONDS, BATCH_PRICE_FACTOR
+from app.services.usage import UsageTracker, record_usage, save_usage, track_usage
+from psycopg2.extras import execute_values
+import argparse
+import itertools
+import json
+import time
+
+RUNNING, SUCCEEDED, FAILED = "running", "succeeded", "failed"
+
+_schema_ready = False
+
+
+def ensure_batch_tables(cur):
+    global _schema_ready
+    if _schema_ready:
+        return
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            service TEXT NOT NULL,
+            provider_name TEXT NOT NULL,
+            model TEXT NOT NULL,
+            merge_version TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            item_count INTEGER NOT NULL,
+            error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finished_at TIMESTAMPTZ
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS batch_items (
+            batch_id BIGINT NOT NULL REFERENCES batch_jobs(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            document_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            error TEXT,
+            PRIMARY KEY (batch_id, position)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS batch_items_pending_idx ON batch_items (document_id) WHERE status = 'running'")
+    cur.execute("CREATE INDEX IF NOT EXISTS batch_jobs_running_idx ON batch_jobs (id) WHERE status = 'running'")
+    _schema_ready = True
+
+
+# -------------------- BATCH SERVICES --------------------
+class GeminiBatchService:
+    """Gemini Batch API with inlined requests; responses come back in request order."""
+
+    name = "gemini"
+    dry_run = False
+
+    def submit(self, model: str, prompts: list[str], display_name: str) -> str:
+        from app.services.clients import gemini_client
+
+        job = gemini_client().batches.create(
+            model=model,
+            src=[{'contents': [{'role': 'user', 'parts': [{'text': prompt}]}]} for prompt in prompts],
+            config={'display_name': display_name}
+        )
+        return job.name
+
+    def state(self, provider_name: str) -> str:
+        from app.services.clients import gemini_client
+
+        state = gemini_client().batches.get(name=provider_name).state.name
+        if state == "JOB_STATE_SUCCEEDED":
+            return SUCCEEDED
+        if state in ("JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"):
+            return FAILED
+        return RUNNING
+
+    def results(self, provider_name: str) -> list:
+        """One (response, error) pair per submitted prompt."""
+        from app.services.clients import gemini_client
+
+        job = gemini_client().batches.get(name=provider_name)
+        # A job that succeeded without inlined responses leaves every item as "no response returned"
+        responses = (job.dest.inlined_responses if job.dest else None) or []
+        return [(item.response, str(item.error) if item.error else None) for item in responses]
+
+
+class _LocalResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.usage_metadata = None
+
+
+class LocalBatchService:
+    """
+    In-process stand-in for GeminiBatchService (tests and dry runs). `responder(prompt) -> text`
+    produces each answer; jobs report running for `polls_until_done` polls before succeeding.
+    Without a responder the answers are empty placeholders, so it runs as a dry run: results are
+    decoded and counted but never written back, and the batch records live in `batches` instead of
+    the batch tables.
+    """
+
+    name = "local"
+
+    def __init__(self, responder=None, polls_until_done: int = 1, dry_run: bool = None):
+        self.responder = responder or (lambda prompt: json.dumps({'corrected_schema': {'shipment_document': {}}}))
+        self.polls_until_done = polls_until_done
+        self.dry_run = responder is None if dry_run is None else dry_run
+        self.jobs = {}
+        self.batches = {}
+        self._ids = itertools.count(1)
+
+    def submit(self, model: str, prompts: list[str], display_name: str) -> str:
+        name = f"local-batches/{next(self._ids)}"
+        self.jobs[name] = {'prompts': prompts, 'polls': 0}
+        return name
+
+    def state(self, provider_name: str) -> str:
+        job = self.jobs.get(provider_name)
+        if job is None:
+            return FAILED
+        job['polls'] += 1
+        return SUCCEEDED if job['polls'] >= self.polls_until_done else RUNNING
+
+    def results(self, provider_name: str) -> list:
+        results = []
+        for prompt in self.jobs[provider_name]['prompts']:
+            try:
+                results.append((_LocalResponse(self.responder(prompt)), None))
+            except Exception as e:
+                results.append((None, str(e)))
+        return results
+
+
+# -------------------- SUBMIT --------------------
+def pending_in_batches(service, document_ids: list[str]) -> set:
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_batch_tables(cur)
+            conn.commit()
+            cur.execute(
+                """
+                SELECT i.document_id FROM batch_items i JOIN batch_jobs j ON j.id = i.batch_id
+                WHERE i.status = 'running' AND i.document_id = ANY(%s) AND j.service = %s
+                """,
+                (list(document_ids), service.name)
+            )
+            return {row[0] for row in cur.fetchall()}
+
+
+def merge_locally(document_ids: list[str], handwritten: dict, printed_fields: dict) -> dict:
+    """{document_id: merge output} for the documents the local merge settles without a model call."""
+    merged = {}
+    for document_id in document_ids:
+        pages = printed_fields.get(document_id)
+        handwritten_fields = parse_handwritten_fields(handwritten.get(document_id)) if pages else None
+        if handwritten_fields is None or not any(pages):
+            continue
+        fields, extras, conflicts = merge_pages(pages, handwritten_fields)
+        if not conflicts:
+            merged[document_id] = merge_output(fields, extras)
+    return merged
+
+
+def save_local_merges(service, outputs: dict) -> int:
+    documents = fetch_documents(list(outputs))
+    updated = []
+    for document_id, gpt_output in outputs.items():
+        data = documents.get(document_id)
+        if data is None:
+            continue
+        gpt_output, validation_errors = validate_output(gpt_output)
+        apply_merge(
+            data, gpt_output, None, validation_errors, "local", UsageTracker().summary(),
+            merge_report={'conflicts': []}
+        )
+        updated.append(data)
+    if service.dry_run:
+        print(f"🧪 Dry run: {len(updated)} locally merged documents not written")
+    else:
+        save_documents(updated)
+        print(f"✅ {len(updated)} documents merged locally")
+    return len(updated)
+
+
+def submit_backlog(service, document_ids: list[str], model: str = "gemini-2.5-flash",
+                   batch_size: int = BATCH_MAX_REQUESTS) -> list[int]:
+    """Submit the merge stage of `document_ids` in batch jobs of `batch_size`. Returns batch ids."""
+    busy = pending_in_batches(service, document_ids)
+    document_ids = [d for d in document_ids if d not in busy]
+    batch_ids = []
+    for start in range(0, len(document_ids), batch_size):
+        chunk = document_ids[start:start + batch_size]
+        handwritten = load_ocr_texts(chunk, HANDWRITTEN)
+        printed = load_ocr_texts(chunk, PRINTED)
+        local = merge_locally(chunk, handwritten, load_printed_fields(chunk))
+        if local:
+            save_local_merges(service, local)
+        chunk = [d for d in chunk if d not in local and (d in handwritten or d in printed)]
+        if not chunk:
+            continue
+        prompts = [build_merge_prompt(printed.get(d) or "", handwritten.get(d) or "") for d in chunk]
+        provider_name = service.submit(model, prompts, f"merge-{MERGE_VERSION}-{start // batch_size}")
+
+        if service.dry_run:
+            batch_id = len(service.batches) + 1
+            service.batches[batch_id] = {
+                'batch': {'id': batch_id, 'provider_name': provider_name, 'model': model, 'merge_version': MERGE_VERSION},
+                'items': dict(enumerate(chunk)),
+                'status': RUNNING
+            }
+            batch_ids.append(batch_id)
+            print(f"🧪 Dry run: batch {batch_id} ({len(chunk)} documents) kept in memory")
+            continue
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                ensure_batch_tables(cur)
+                cur.execute(
+                    """
+                    INSERT INTO batch_jobs (service, provider_name, model, merge_version, item_count)
+                    VALUES (%s, %s, %s, %s, %s) RETURNING id
+                    """,
+                    (service.name, provider_name, model, MERGE_VERSION, len(chunk))
+                )
+                batch_id = cur.fetchone()[0]
+                execute_values(
+                    cur,
+                    "INSERT INTO batch_items (batch_id, position, document_id) VALUES %s",
+                    [(batch_id, position, document_id) for position, document_id in enumerate(chunk)]
+                )
+                conn.commit()
+        batch_ids.append(batch_id)
+        print(f"📦 Submitted batch {batch_id} ({len(chunk)} documents) as {provider_name}")
+    return batch_ids
+
+
+# -------------------- POLL AND COLLECT --------------------
+def running_batches(service) -> list[dict]:
+    if service.dry_run:
+        return [record['batch'] for record in service.batches.values() if record['status'] == RUNNING]
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_batch_tables(cur)
+            conn.commit()
+            cur.execute(
+                "SELECT id, provider_name, model, merge_version FROM batch_jobs WHERE status = 'running' AND service = %s ORDER BY id",
+                (service.name,)
+            )
+            keys = ('id', 'provider_name', 'model', 'merge_version')
+            return [dict(zip(keys, row)) for row in cur.fetchall()]
+
+
+def finish_batch(service, batch_id: int, status: str, error: str = None, item_errors: dict = None):
+    if service.dry_run:
+        service.batches[batch_id]['status'] = status
+        return
+    item_errors = item_errors or {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE batch_jobs SET status = %s, error = %s, finished_at = now() WHERE id = %s",
+                (status, error, batch_id)
+            )
+            if status == FAILED:
+                cur.execute("UPDATE batch_items SET status = 'failed', error = %s WHERE batch_id = %s", (error, batch_id))
+            else:
+                cur.execute("UPDATE batch_items SET status = 'done' WHERE batch_id = %s", (batch_id,))
+                if item_errors:
+                    execute_values(
+                        cur,
+                        f"""
+                        UPDATE batch_items SET status = 'failed', error = v.error
+                        FROM (VALUES %s) AS v(position, error)
+                        WHERE batch_items.batch_id = {int(batch_id)} AND batch_items.position = v.position
+                        """,
+                        list(item_errors.items())
+                    )
+            conn.commit()
+
+
+def apply_results(batch: dict, items: dict, results: list, documents: dict) -> tuple[list, dict, dict]:
+    """
+    Fold batch responses into the stored documents. `items` maps position -> document id.
+    Returns (updated documents, {position: error}, {document_id: usage summary}).
+    """
+    updated, item_errors, usages = [], {}, {}
+    for position, (response, error) in enumerate(results):
+        document_id = items.get(position)
+        data = documents.get(document_id)
+        if data is None or error or response is None:
+            item_errors[position] = error or "document or response missing"
+            continue
+
+        raw = response.text or ""
+        try:
+            gpt_output, parse_error = json.loads(clean_llm_json(raw)), None
+        except Exception as e:
+            gpt_output, parse_error = {"raw": raw}, str(e)
+        gpt_output, validation_errors = validate_output(gpt_output)
+
+        with track_usage() as usage:
+            record_usage("merge_batch", batch['model'], response, BATCH_PRICE_FACTOR)
+        usages[document_id] = usage.summary()
+
+        # An unparseable answer keeps the stored extraction; the row stays selectable for the next run
+        if apply_merge(data, gpt_output, parse_error, validation_errors, "llm", usages[document_id],
+                       merge_version=batch['merge_version']):
+            data['properties']['batch_id'] = batch['id']
+        else:
+            item_errors[position] = parse_error
+        updated.append(data)
+    for position in items.keys() - set(range(len(results))):
+        item_errors[position] = "no response returned"
+    return updated, item_errors, usages
+
+
+def collect_batch(service, batch: dict) -> tuple[int, int]:
+    """Write the results of a finished batch job to `documents` in bulk. Returns (done, failed)."""
+    if service.dry_run:
+        items = service.batches[batch['id']]['items']
+    else:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT position, document_id FROM batch_items WHERE batch_id = %s ORDER BY position", (batch['id'],))
+                items = dict(cur.fetchall())
+
+    results = service.results(batch['provider_name'])
+    documents = fetch_documents(list(items.values()))
+    updated, item_errors, usages = apply_results(batch, items, results, documents)
+    if service.dry_run:
+        print(f"🧪 Dry run: {len(updated)} documents of batch {batch['id']} not written")
+    else:
+        save_documents(updated)
+        for document_id, summary in usages.items():
+            save_usage(document_id, document_id.split('/', 1)[0], summary)
+    finish_batch(service, batch['id'], SUCCEEDED, item_errors=item_errors)
+    return len(updated), len(item_errors)
+
+
+def poll_batches(service) -> int:
+    """Check every running batch job once and collect the finished ones. Returns how many are still running."""
+    still_running = 0
+    for batch in running_batches(service):
+        try:
+            state = service.state(batch['provider_name'])
+        except Exception as e:
+            print(f"⚠️ Could not poll batch {batch['id']}: {e}")
+            still_running += 1
+            continue
+        if state == RUNNING:
+            still_running += 1
+        elif state == FAILED:
+            finish_batch(service, batch['id'], FAILED, error=f"provider reported {state}")
+            print(f"❌ Batch {batch['id']} failed")
+        else:
+            done, failed = collect_batch(service, batch)
+            print(f"✅ Batch {batch['id']} collected: {done} documents written, {failed} failed")
+    return still_running
+
+
+def wait_for_batches(service, interval: float = BATCH_POLL_INTERVAL_SECONDS):
+    while poll_batches(service):
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the merge stage over stored OCR as provider batch jobs.")
+    parser.add_argument("command", choices=("submit", "poll", "run"))
+    parser.add_argument("--dataset", help="Only documents of this dataset")
+    parser.add_argument("--ids", nargs="*", help="Only these document ids")
+    parser.add_argument("--force", action="store_true", help="Also include rows already at the current merge version")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--batch-size", type=int, default=BATCH_MAX_REQUESTS)
+    parser.add_argument("--wait", action="store_true", help="poll: keep polling until every batch has finished")
+    parser.add_argument("--local", action="store_true", help="run: dry run against the in-process stand-in, nothing is written")
+    args = parser.parse_args()
+    if args.local and args.command != "run":
+        # The stand-in keeps its jobs in memory; a later `poll` in another process would not find them
+        parser.error("--local only works with `run`")
+
+    service = LocalBatchService() if args.local else GeminiBatchService()
+    if args.command in ("submit", "run"):
+        document_ids = select_documents(args.dataset, args.ids, args.force)
+        print(f"📄 {len(document_ids)} documents to merge (merge version {MERGE_VERSION})")
+        submit_backlog(service, document_ids, args.model, args.batch_size)
+    if args.command == "run" or args.wait:
+        wait_for_batches(service)
+    elif args.command == "poll":
+        print(f"⏳ {poll_batches(service)} batch jobs still running")
@@ -0,0 +1,75 @@
+"""
+Import-time benchmark for worker cold start.
+
+    python -m app.services.bench_import [--module app.services.process] [--runs 5] [--max-seconds 1.0]
+
+Each run imports the module in a fresh interpreter with `-X importtime` and reports the wall time
+and the slowest imports. With --max-seconds the exit code is non-zero when the median exceeds the budget,
+so CI can catch a backend that starts importing its SDK eagerly again.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+def measure(module: str) -> tuple[float, list]:
+    """Return (wall_seconds, [(cumulative_us, module_name), ...]) for one cold import."""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    imports = []
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), name.rstrip()))
+    return wall, imports
+
+
+def direct_imports(imports: list, module: str) -> list:
+    """
+    [(cumulative_us, name), ...] of the imports `module` itself triggered (its direct children).
+    -X importtime lists a module after its children, each nesting level indented two more spaces.
+    """
+    pending = {}
+    children = []
+    for us, name in imports:
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        nested = pending.pop(depth + 1, [])
+        if name.strip() == module:
+            children = nested
+        pending.setdefault(depth, []).append((us, name.strip()))
+    return children
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold import time of a service module.")
+    parser.add_argument("--module", default="app.services.process")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--max-seconds", type=float, help="Fail if the median wall time exceeds this")
+    args = parser.parse_args()
+
+    walls, imports = [], []
+    for _ in range(args.runs):
+        wall, imports = measure(args.module)
+        walls.append(wall)
+
+    median = statistics.median(walls)
+    print(f"⏱️ import {args.module}: median {median:.3f}s, min {min(walls):.3f}s, max {max(walls):.3f}s over {args.runs} runs")
+    print(f"\nSlowest imports of {args.module} (cumulative, last run):")
+    for us, name in sorted(direct_imports(imports, args.module), reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"\n❌ Median import time {median:.3f}s exceeds budget {args.max_seconds:.3f}s")
+        sys.exit(1)
@@ -0,0 +1,36 @@
+"""
+Lazily created SDK clients. Nothing heavy is imported until a backend is actually used,
+and a missing Azure key only fails the Azure calls, not every import.
+"""
+from app.services import settings
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def gemini_client():
+    from google import genai
+    if settings.GEMINI_BASE_URL:
+        from google.genai import types
+        return genai.Client(api_key=settings.GEMINI_API_KEY, http_options=types.HttpOptions(base_url=settings.GEMINI_BASE_URL))
+    return genai.Client(api_key=settings.GEMINI_API_KEY)
+
+
+@lru_cache(maxsize=None)
+def generative_model(model_name: str):
+    import google.generativeai as legacy_genai
+    if settings.GEMINI_BASE_URL:
+        # REST transport so the endpoint override applies (gRPC would ignore the scheme)
+        legacy_genai.configure(
+            api_key=settings.GEMINI_API_KEY, transport="rest",
+            client_options={"api_endpoint": settings.GEMINI_BASE_URL}
+        )
+    return legacy_genai.GenerativeModel(model_name)
+
+
+@lru_cache(maxsize=None)
+def azure_client():
+    from azure.ai.documentintelligence import DocumentIntelligenceClient
+    from azure.core.credentials import AzureKeyCredential
+    if not settings.AZURE_ENDPOINT or not settings.AZURE_KEY:
+        raise RuntimeError("Azure Document Intelligence is not configured (set `endpoint` and `key`)")
+    return DocumentIntelligenceClient(endpoint=settings.AZURE_ENDPOINT, credential=AzureKeyCredential(settings.AZURE_KEY))
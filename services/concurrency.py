@@ -0,0 +1,178 @@
+from app.services.settings import MODEL_CONCURRENCY_INITIAL as INITIAL_LIMIT
+from app.services.settings import MODEL_CONCURRENCY_MAX as MAX_LIMIT
+from app.services.settings import MODEL_CONCURRENCY_MIN as MIN_LIMIT
+from app.services.settings import MODEL_ERROR_RATE_THRESHOLD as ERROR_RATE_THRESHOLD
+from app.services.settings import MODEL_LATENCY_SPIKE_FACTOR as LATENCY_SPIKE_FACTOR
+from app.services.settings import MODEL_THREADS
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+
+# Defaults for every limiter come from settings; per-backend overrides can be passed to limiter()
+
+# Exception classes for 429s that carry no usable status attribute
+THROTTLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "RateLimitError"}
+
+
+def _status_code(e: Exception):
+    # google-genai APIError and google.api_core errors: .code; Azure HttpResponseError: .status_code;
+    # httpx / requests errors: .response.status_code
+    for value in (getattr(e, "code", None), getattr(e, "status_code", None),
+                  getattr(getattr(e, "response", None), "status_code", None)):
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_throttle_error(e: Exception) -> bool:
+    """429 / quota errors from the Gemini (google-genai, google-generativeai) and Azure SDKs."""
+    return _status_code(e) == 429 or type(e).__name__ in THROTTLE_ERRORS
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit around a remote model call.
+    Healthy calls grow the limit by roughly one per limit's worth of completions (additive increase);
+    a 429, a latency spike or a high error rate halves it (multiplicative decrease).
+    """
+
+    def __init__(self, name: str, initial: float = INITIAL_LIMIT, min_limit: float = MIN_LIMIT,
+                 max_limit: float = MAX_LIMIT):
+        self.name = name
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.baseline_latency = None
+        self.latency_ewma = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.throttled = 0
+        self.errors = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency: float, outcome: str):
+        """outcome: 'ok', 'throttled' or 'error'."""
+        with self._cond:
+            self.in_flight -= 1
+            self.calls += 1
+            self.error_rate = 0.9 * self.error_rate + 0.1 * (outcome != "ok")
+
+            if outcome == "ok":
+                self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+                # Baseline follows the best sustained latency slowly, so a spike cannot drag it up quickly
+                if self.baseline_latency is None or latency < self.baseline_latency:
+                    self.baseline_latency = latency
+                else:
+                    self.baseline_latency = 0.98 * self.baseline_latency + 0.02 * latency
+
+            spike = outcome == "ok" and latency > LATENCY_SPIKE_FACTOR * self.baseline_latency
+            if outcome == "throttled":
+                self.throttled += 1
+            elif outcome == "error":
+                self.errors += 1
+
+            if outcome == "throttled" or spike or self.error_rate > ERROR_RATE_THRESHOLD:
+                self._decrease(latency)
+            elif outcome == "ok":
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def _decrease(self, latency: float):
+        # Calls already in flight when we backed off report the same congestion; count it once
+        now = time.monotonic()
+        if now - self._last_decrease < max(self.baseline_latency or 0.0, latency):
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(self.min_limit, self.limit / 2)
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        start = time.monotonic()
+        outcome = "ok"
+        try:
+            yield
+        except Exception as e:
+            outcome = "throttled" if is_throttle_error(e) else "error"
+            raise
+        finally:
+            self.release(time.monotonic() - start, outcome)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'latency_ewma_seconds': round(self.latency_ewma, 3) if self.latency_ewma else None,
+                'baseline_latency_seconds': round(self.baseline_latency, 3) if self.baseline_latency else None,
+                'error_rate': round(self.error_rate, 3),
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'errors': self.errors,
+                'decreases': self.decreases
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_executors = {}
+
+
+def limiter(name: str, **kwargs) -> AdaptiveLimiter:
+    """Shared limiter per backend/model, e.g. limiter("gemini:gemini-2.5-flash")."""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(name, **kwargs)
+        return _limiters[name]
+
+
+def limiter_metrics() -> dict:
+    """Current limits and health of every limiter, for a metrics endpoint or periodic logging."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {l.name: l.snapshot() for l in limiters}
+
+
+def _executor(name: str, max_workers: int) -> ThreadPoolExecutor:
+    with _limiters_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return _executors[name]
+
+
+def model_executor() -> ThreadPoolExecutor:
+    """
+    Shared threads for blocking model calls. A call waiting for a limiter slot parks one of these,
+    not a thread of the event loop's default executor, which database writes and job heartbeats need.
+    """
+    return _executor("model", MODEL_THREADS)
+
+
+def page_executor() -> ThreadPoolExecutor:
+    """
+    Shared threads for the per-page calls of one document (image_ocr). Kept apart from
+    model_executor(), where the document's own call waits for its pages.
+    """
+    return _executor("page", max(1, int(MAX_LIMIT)))
+
+
+async def to_model_thread(func, *args):
+    """asyncio.to_thread on model_executor(); the caller's context (usage tracking) is carried over."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        model_executor(), functools.partial(context.run, func, *args)
+    )
@@ -0,0 +1,183 @@
+from app.core.db import get_db_connection
+from app.services.document_store import ensure_documents_table
+from app.services.pages import iter_pages
+from app.services.settings import DUPLICATE_FINE_MAX_DISTANCE, DUPLICATE_MAX_DISTANCE, DUPLICATE_MODE
+import itertools
+
+HASH_DPI = 50
+# 16x16 = 256-bit hash, compared before an earlier extraction is reused
+FINE_HASH_SIZE = 16
+# The 64-bit first-page hash is also stored as four indexed 16-bit bands. Two hashes within
+# d bits differ in at most d // 4 bits on at least one band (pigeonhole), so candidates are
+# found by index lookups of that band's close values instead of comparing every first page.
+HASH_BANDS = 4
+BAND_BITS = 16
+
+
+def dhash(img, hash_size: int = 8) -> int:
+    """
+    Difference hash: compares neighbouring pixels of a tiny grayscale thumbnail.
+    Robust to re-compression, scaling and small framing changes.
+    """
+    from PIL import Image
+
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def _to_signed(value: int) -> int:
+    # Postgres BIGINT is signed; store the 64-bit hash as two's complement.
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def hamming(a: int, b: int, bits: int = 64) -> int:
+    return bin((a ^ b) & ((1 << bits) - 1)).count("1")
+
+
+def hash_bands(value: int) -> list[int]:
+    return [(value >> (BAND_BITS * band)) & ((1 << BAND_BITS) - 1) for band in range(HASH_BANDS)]
+
+
+def band_neighbours(value: int, radius: int) -> list[int]:
+    """Every band value within `radius` bits of `value` (itself included)."""
+    return [
+        value ^ sum(1 << bit for bit in bits)
+        for flipped in range(radius + 1)
+        for bits in itertools.combinations(range(BAND_BITS), flipped)
+    ]
+
+
+def page_hashes(file_path: str) -> tuple[list[int], list[int]]:
+    """
+    Perceptual hashes for every page of a PDF or image file: the 64-bit hash used to find
+    candidates and the 256-bit one used to confirm them, both from the same rendering.
+    """
+    hashes, fine_hashes = [], []
+    for page in iter_pages(file_path, HASH_DPI):
+        hashes.append(dhash(page))
+        fine_hashes.append(dhash(page, FINE_HASH_SIZE))
+    return hashes, fine_hashes
+
+
+_schema_ready = False
+
+
+def ensure_phash_table(cur):
+    global _schema_ready
+    if _schema_ready:
+        return
+    ensure_documents_table(cur)
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS document_phashes (
+            document_id TEXT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+            dataset TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            num_pages INTEGER NOT NULL,
+            phash BIGINT NOT NULL,
+            fine_hash TEXT,
+            {', '.join(f'band{band} INTEGER NOT NULL' for band in range(HASH_BANDS))},
+            PRIMARY KEY (document_id, page)
+        )
+    """)
+    for band in range(HASH_BANDS):
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS document_phashes_band{band}_idx
+            ON document_phashes (dataset, num_pages, band{band}) WHERE page = 0
+        """)
+    _schema_ready = True
+
+
+def find_near_duplicate(hashes: list[int], dataset: str, exclude_id: str = None,
+                        max_distance: int = DUPLICATE_MAX_DISTANCE):
+    """
+    Look up an earlier document of `dataset` whose pages are all within `max_distance` bits of
+    `hashes`. Returns (document_id, distance) for the closest match, or None.
+    """
+    if not hashes:
+        return None
+    radius = max_distance // HASH_BANDS
+    bands = hash_bands(hashes[0])
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_phash_table(cur)
+            conn.commit()
+
+            # Candidate filter on the first page: one index lookup per band, then the exact
+            # distance on the few rows found (bit_count() needs Postgres 14+).
+            cur.execute(
+                f"""
+                SELECT document_id
+                FROM document_phashes
+                WHERE page = 0 AND dataset = %s AND num_pages = %s AND document_id <> %s
+                  AND ({' OR '.join(f'band{band} = ANY(%s)' for band in range(HASH_BANDS))})
+                  AND bit_count((phash # %s)::bit(64)) <= %s
+                """,
+                (dataset, len(hashes), exclude_id or "", *(band_neighbours(b, radius) for b in bands),
+                 _to_signed(hashes[0]), max_distance)
+            )
+            candidates = [row[0] for row in cur.fetchall()]
+            if not candidates:
+                return None
+
+            cur.execute(
+                "SELECT document_id, page, phash FROM document_phashes WHERE document_id = ANY(%s)",
+                (candidates,)
+            )
+            stored = {}
+            for document_id, page, phash in cur.fetchall():
+                stored.setdefault(document_id, {})[page] = phash
+
+    best = None
+    for document_id, pages in stored.items():
+        # A document matches only if every page matches; its distance is the worst page.
+        distance = max(hamming(h, pages.get(i, ~h)) for i, h in enumerate(hashes))
+        if distance <= max_distance and (best is None or distance < best[1]):
+            best = (document_id, distance)
+    return best
+
+
+def confirm_duplicate(document_id: str, fine_hashes: list[int], max_distance: int = DUPLICATE_FINE_MAX_DISTANCE) -> bool:
+    """
+    Second check before reusing `document_id`'s extraction: every page must also be within
+    `max_distance` bits on the 256-bit hash. Documents indexed without fine hashes never confirm.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_phash_table(cur)
+            conn.commit()
+            cur.execute("SELECT page, fine_hash FROM document_phashes WHERE document_id = %s", (document_id,))
+            stored = dict(cur.fetchall())
+    if not fine_hashes or len(stored) != len(fine_hashes):
+        return False
+    bits = FINE_HASH_SIZE * FINE_HASH_SIZE
+    return all(
+        stored.get(page) is not None and hamming(h, int(stored[page], 16), bits) <= max_distance
+        for page, h in enumerate(fine_hashes)
+    )
+
+
+def index_document_hashes(document_id: str, dataset: str, hashes: list[int], fine_hashes: list[int] = None):
+    fine_hashes = fine_hashes or [None] * len(hashes)
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_phash_table(cur)
+            cur.execute("DELETE FROM document_phashes WHERE document_id = %s", (document_id,))
+            for page, (phash, fine_hash) in enumerate(zip(hashes, fine_hashes)):
+                cur.execute(
+                    f"""
+                    INSERT INTO document_phashes (document_id, dataset, page, num_pages, phash, fine_hash,
+                                                  {', '.join(f'band{band}' for band in range(HASH_BANDS))})
+                    VALUES (%s, %s, %s, %s, %s, %s, {', '.join(['%s'] * HASH_BANDS)})
+                    """,
+                    (document_id, dataset, page, len(hashes), _to_signed(phash),
+                     None if fine_hash is None else format(fine_hash, "x"), *hash_bands(phash))
+                )
+            conn.commit()
@@ -0,0 +1,281 @@
+from app.core.db import get_db_connection
+from app.services.shipment_models import encode
+from psycopg2.extras import Json, execute_values
+from datetime import date
+import re
+
+# Key shipment fields copied out of the JSONB blob into indexed columns on every write
+INDEXED_COLUMNS = ("dataset", "document_number", "order_number", "consignee_name", "date_of_issue", "parent_id")
+
+# Columns added after the table was first created, and the lookup indexes on them
+COLUMNS = (
+    "dataset TEXT",
+    "document_number TEXT",
+    "order_number TEXT",
+    "consignee_name TEXT",
+    "date_of_issue DATE",
+    "parent_id TEXT",
+    "created_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+)
+INDEXES = {
+    'documents_dataset_idx': "documents (dataset, id)",
+    'documents_document_number_idx': "documents (document_number)",
+    'documents_order_number_idx': "documents (order_number)",
+    'documents_consignee_idx': "documents (lower(consignee_name) text_pattern_ops)",
+    'documents_date_of_issue_idx': "documents (date_of_issue)",
+    'documents_parent_idx': "documents (parent_id) WHERE parent_id IS NOT NULL",
+    # Ad-hoc containment queries on any other field, e.g. data @> '{"properties": {...}}'
+    'documents_data_gin_idx': "documents USING GIN (data jsonb_path_ops)",
+}
+
+_schema_ready = False
+
+
+def ensure_documents_table(cur):
+    """
+    Create the table with its columns and indexes when the database is new (nothing to lock yet).
+    An existing table is only checked: adding columns and building indexes on it is left to
+    migrate_schema(), which does not block writers.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    cur.execute("SELECT to_regclass('documents') IS NULL")
+    if cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, data JSONB NOT NULL, {', '.join(COLUMNS)})")
+        for name, definition in INDEXES.items():
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    else:
+        cur.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = 'documents' AND column_name = ANY(%s)",
+            ([column.split()[0] for column in COLUMNS],)
+        )
+        missing = {column.split()[0] for column in COLUMNS} - {row[0] for row in cur.fetchall()}
+        if missing:
+            raise RuntimeError(
+                f"documents table is missing {', '.join(sorted(missing))}; run `python -m app.services.document_store` first"
+            )
+    _schema_ready = True
+
+
+def migrate_schema():
+    """
+    Add the indexed columns to an existing documents table and build their indexes with
+    CREATE INDEX CONCURRENTLY, so uploads keep writing while it runs. Needs autocommit:
+    concurrent index builds cannot run inside a transaction.
+    """
+    with get_db_connection() as conn:
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, data JSONB NOT NULL)")
+                # Constant and now() defaults are stored in the catalog, so no table rewrite
+                cur.execute(f"ALTER TABLE documents {', '.join(f'ADD COLUMN IF NOT EXISTS {column}' for column in COLUMNS)}")
+                for name, definition in INDEXES.items():
+                    create_index_concurrently(cur, name, definition)
+        finally:
+            conn.autocommit = autocommit
+
+
+def create_index_concurrently(cur, name: str, definition: str):
+    """Build an index without blocking writers (autocommit cursor), replacing an invalid leftover."""
+    # A failed concurrent build leaves an invalid index that IF NOT EXISTS would keep
+    cur.execute("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+    invalid = cur.fetchone()
+    if invalid and invalid[0]:
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}")
+    print(f"✅ Index {name}")
+
+
+def _parse_date(value):
+    if isinstance(value, str) and re.fullmatch(r"\d{4}-\d{2}-\d{2}", value.strip()):
+        try:
+            return date.fromisoformat(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def indexed_fields(data: dict) -> dict:
+    """Pull the indexed lookup columns out of a document's extraction output."""
+    output = data.get('extracted_data', {}).get('gpt_extraction_output') or {}
+    schema = output.get('corrected_schema', output) if isinstance(output, dict) else {}
+    shipment = schema.get('shipment_document') or {} if isinstance(schema, dict) else {}
+    delivery = shipment.get('delivery_information') or {}
+    consignee = shipment.get('consignee_recipient') or {}
+    return {
+        'dataset': data['id'].split('/', 1)[0] if '/' in data['id'] else None,
+        'document_number': _text(shipment.get('document_number')),
+        'order_number': _text(delivery.get('order_number')),
+        'consignee_name': _text(consignee.get('name')),
+        'date_of_issue': _parse_date(shipment.get('date_of_issue')),
+        # Documents split out of a multi-document bundle point at the bundle's row
+        'parent_id': data.get('properties', {}).get('parent_id'),
+    }
+
+
+def _stored_blob(data: dict) -> dict:
+    # Raw OCR text lives in ocr_results; keep it out of the JSONB row
+    extracted = {k: v for k, v in data.get('extracted_data', {}).items() if k != 'ocr_output'}
+    return {**data, 'extracted_data': extracted}
+
+
+def fetch_document(document_id: str):
+    """Return the stored `data` blob for a document, or None."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT data FROM documents WHERE id = %s", (document_id,))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+
+def save_document(data: dict):
+    save_documents([data])
+
+
+def save_documents(documents: list[dict]):
+    """Insert or update many documents in one statement."""
+    if not documents:
+        return
+    rows = []
+    for data in documents:
+        fields = indexed_fields(data)
+        rows.append((data['id'], Json(_stored_blob(data), dumps=encode), *(fields[column] for column in INDEXED_COLUMNS)))
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            # ✅ Ensure table exists
+            ensure_documents_table(cur)
+            conn.commit()
+
+            # ✅ Insert or update rows
+            execute_values(
+                cur,
+                f"""
+                INSERT INTO documents (id, data, {", ".join(INDEXED_COLUMNS)})
+                VALUES %s
+                ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data,
+                    {", ".join(f"{column} = EXCLUDED.{column}" for column in INDEXED_COLUMNS)}
+                """,
+                rows
+            )
+            conn.commit()
+
+
+def fetch_documents(document_ids: list[str]) -> dict:
+    """Return {id: data} for the given ids (missing ids are left out)."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, data FROM documents WHERE id = ANY(%s)", (list(document_ids),))
+            return dict(cur.fetchall())
+
+
+def mark_stage(document_id: str, flag: str, value: bool = True):
+    """Set one `state` flag (file_landed, ocr_completed, ...) on a stored document."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE documents SET data = jsonb_set(data, %s, %s, true) WHERE id = %s",
+                (['state', flag], Json(value), document_id)
+            )
+            conn.commit()
+
+
+def query_documents(document_number: str = None, order_number: str = None, consignee: str = None,
+                    date_from: date = None, date_to: date = None, dataset: str = None,
+                    limit: int = 50, after: str = None) -> dict:
+    """
+    Look up documents by indexed shipment fields. `consignee` is a case-insensitive prefix.
+    Keyset pagination: pass the returned `next_cursor` as `after` to fetch the next page.
+    """
+    limit = max(1, min(limit, 500))
+    clauses, params = [], []
+    if dataset:
+        clauses.append("dataset = %s")
+        params.append(dataset)
+    if document_number:
+        clauses.append("document_number = %s")
+        params.append(document_number)
+    if order_number:
+        clauses.append("order_number = %s")
+        params.append(order_number)
+    if consignee:
+        clauses.append("lower(consignee_name) LIKE %s")
+        params.append(consignee.lower().replace("%", r"\%").replace("_", r"\_") + "%")
+    if date_from:
+        clauses.append("date_of_issue >= %s")
+        params.append(date_from)
+    if date_to:
+        clauses.append("date_of_issue <= %s")
+        params.append(date_to)
+    if after:
+        clauses.append("id > %s")
+        params.append(after)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_documents_table(cur)
+            conn.commit()
+            cur.execute(
+                f"SELECT id, data FROM documents {where} ORDER BY id LIMIT %s",
+                (*params, limit + 1)
+            )
+            rows = cur.fetchall()
+
+    items = [data for _, data in rows[:limit]]
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+def migrate_documents(batch_size: int = 1000):
+    """
+    One-off migration for rows written before the indexed columns existed: fill the columns
+    and move `ocr_output` out of the JSONB blob into ocr_results. Those rows have no printed OCR,
+    so they are flagged `legacy_ocr` and left out of merge-stage re-extraction.
+    """
+    from app.services.ocr_store import HANDWRITTEN, save_ocr_pages
+
+    migrated, last_id = 0, ""
+    while True:
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                ensure_documents_table(cur)
+                conn.commit()
+                cur.execute(
+                    """
+                    SELECT id, data FROM documents
+                    WHERE id > %s AND (dataset IS NULL OR data->'extracted_data' ? 'ocr_output')
+                    ORDER BY id LIMIT %s
+                    """,
+                    (last_id, batch_size)
+                )
+                rows = cur.fetchall()
+        if not rows:
+            return migrated
+
+        for document_id, data in rows:
+            ocr_output = data.get('extracted_data', {}).get('ocr_output')
+            if ocr_output:
+                save_ocr_pages(document_id, HANDWRITTEN, "legacy", "documents.data", [ocr_output])
+                data.setdefault('properties', {})['legacy_ocr'] = True
+            save_document(data)
+            migrated += 1
+        last_id = rows[-1][0]
+        print(f"✅ Migrated {migrated} documents")
+
+
+if __name__ == "__main__":
+    from app.services.ocr_store import migrate_ocr_schema
+
+    migrate_schema()
+    migrate_ocr_schema()
+    migrate_documents()
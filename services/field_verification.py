@@ -0,0 +1,208 @@
+"""
+Targeted re-query of key fields the merge stage got invalid or inconsistent.
+
+Instead of re-running the whole document, the suspect fields are asked for in one small prompt
+with only the OCR lines around each field's labels (plus the matching template crops when the
+page was read through a layout template), and the answers are written back into the merge
+output before it is validated again. Empty fields are only asked again when every CMR carries
+them (document number, date of issue); most documents leave the others blank.
+"""
+from app.services.clients import gemini_client
+from app.services.concurrency import limiter, to_model_thread
+from app.services.gpt_extraction import clean_llm_json, extract_with_gemini
+from app.services.shipment_models import get_path, set_path
+from app.services.usage import record_usage
+import json
+import re
+
+# Paths are relative to shipment_document. `region` names the CMR box holding the handwritten value;
+# `labels` finds the OCR lines worth sending for the field (Dutch, English and German forms);
+# `required` fields are on every CMR, so an empty one is asked again.
+KEY_FIELDS = {
+    "document_number": {
+        "question": "Document number (CMR number or delivery note number, printed near the title)",
+        "region": None,
+        "labels": r"cmr|delivery\s*note|lieferschein|vrachtbrief|pakbon|document",
+        "required": True,
+    },
+    "date_of_issue": {
+        "question": "Date the document was issued, as YYYY-MM-DD",
+        "region": "box_21_established_in",
+        "labels": r"date|datum|established|ausgefertigt|opgemaakt|\d{1,4}[-/.]\d{1,2}[-/.]\d{2,4}",
+        "required": True,
+    },
+    "delivery_information.order_number": {
+        "question": "Order / PO number",
+        "region": None,
+        "labels": r"order|\bpo\b|bestel|auftrag|referen",
+    },
+    "reception_confirmation.pallets_in": {
+        "question": "Number of pallets received (pallets in), a number",
+        "region": "box_24_goods_received",
+        "labels": r"pallet|palet|received|ontvangen|empfangen",
+    },
+    "reception_confirmation.pallets_out": {
+        "question": "Number of pallets returned (pallets out), a number",
+        "region": "box_24_goods_received",
+        "labels": r"pallet|palet|retour|return|exchange|tausch",
+    },
+    "reception_confirmation.received_by_print_name": {
+        "question": "Printed name of the person who received the goods",
+        "region": "box_24_goods_received",
+        "labels": r"received|ontvangen|empfangen|name|naam|signature|handtekening|unterschrift",
+    },
+}
+# Lines of context kept around every matching line, and the cap on lines sent per text
+SNIPPET_CONTEXT = 1
+SNIPPET_MAX_LINES = 40
+
+VERIFY_PROMPT = """
+You are checking a few fields of a shipment document (CMR / delivery note) that an earlier extraction
+left empty or got wrong. Read them from the excerpts below (the lines of the document around each field's label).
+
+### FIELDS:
+{questions}
+
+### OUTPUT FORMAT:
+Return **only valid JSON** mapping each field key above to its value, or null if it is not on the document.
+
+### COMPUTERIZED TEXT (excerpts):
+{computerized_text}
+
+### HANDWRITTEN TEXT (excerpts):
+{handwritten_text}
+"""
+
+
+def _shipment(gpt_output) -> dict:
+    if not isinstance(gpt_output, dict):
+        return {}
+    schema = gpt_output.get('corrected_schema') or {}
+    return schema.get('shipment_document') or {} if isinstance(schema, dict) else {}
+
+
+def _letters(name) -> str:
+    return re.sub(r"[^a-z]", "", str(name).lower())
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def inconsistent_fields(shipment: dict) -> dict:
+    """Key fields contradicted by another field of the same document. Returns {path: reason}."""
+    found = {}
+    reception = shipment.get('reception_confirmation') or {}
+    delivery = shipment.get('delivery_information') or {}
+    goods = shipment.get('goods_description') or {}
+
+    # More pallets received or returned than the document ships is a misread count
+    stated = goods.get('total_pallets_stated')
+    for name in ('pallets_in', 'pallets_out'):
+        count = reception.get(name)
+        if _is_number(count) and _is_number(stated) and count > stated:
+            found[f"reception_confirmation.{name}"] = f"more than total_pallets_stated ({stated})"
+
+    printed, signed = reception.get('received_by_print_name'), reception.get('received_by_signature_name')
+    if printed and signed:
+        a, b = _letters(printed), _letters(signed)
+        if a and b and a not in b and b not in a:
+            found["reception_confirmation.received_by_print_name"] = f"does not match signature name ({signed})"
+
+    number = shipment.get('document_number')
+    if number and number == delivery.get('order_number'):
+        found["document_number"] = "same as order_number"
+    return found
+
+
+def find_suspect_fields(gpt_output, validation_errors: list) -> dict:
+    """Key fields that are required but empty, failed validation or are inconsistent. Returns {path: reason}."""
+    shipment = _shipment(gpt_output)
+    if not shipment:
+        return {}
+    suspects = {
+        path: "missing" for path, field in KEY_FIELDS.items()
+        if field.get("required") and get_path(shipment, path) in (None, "")
+    }
+    for error in validation_errors:
+        path = error.get('field', '').removeprefix('shipment_document.')
+        if path in KEY_FIELDS:
+            suspects[path] = f"invalid: {error.get('error')}"
+    suspects.update(inconsistent_fields(shipment))
+    return suspects
+
+
+def relevant_lines(text: str, patterns: list[str]) -> str:
+    """The lines of `text` matching any pattern, with SNIPPET_CONTEXT lines around each, in order."""
+    lines = [line for line in (text or "").splitlines() if line.strip()]
+    matcher = re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE) if patterns else None
+    keep = set()
+    for index, line in enumerate(lines):
+        if matcher and matcher.search(line):
+            keep.update(range(max(0, index - SNIPPET_CONTEXT), min(len(lines), index + SNIPPET_CONTEXT + 1)))
+    return "\n".join(lines[index] for index in sorted(keep)[:SNIPPET_MAX_LINES])
+
+
+def build_verify_prompt(suspects: dict, computerized_text: str, handwritten_text: str, shipment: dict = None) -> str:
+    questions = "\n".join(f'- "{path}": {KEY_FIELDS[path]["question"]}' for path in suspects)
+    patterns = [KEY_FIELDS[path]["labels"] for path in suspects]
+    # Lines holding the suspect value itself, wherever it was read from
+    for path in suspects:
+        value = get_path(shipment or {}, path)
+        if value not in (None, "") and len(str(value)) >= 3:
+            patterns.append(re.escape(str(value)))
+    return VERIFY_PROMPT.format(
+        questions=questions,
+        computerized_text=relevant_lines(computerized_text, patterns) or "(none)",
+        handwritten_text=relevant_lines(handwritten_text, patterns) or "(none)"
+    )
+
+
+def _ask_with_crops(prompt: str, crops: dict, model_name: str) -> str:
+    from google.genai import types
+
+    contents = []
+    for name, png in crops.items():
+        contents.append(f"Region: {name}")
+        contents.append(types.Part.from_bytes(data=png, mime_type="image/png"))
+    contents.append(prompt)
+
+    with limiter(f"gemini:{model_name}").slot():
+        response = gemini_client().models.generate_content(model=model_name, contents=contents)
+    record_usage("field_verification", model_name, response)
+    return response.text.strip() if getattr(response, "text", None) else ""
+
+
+async def verify_fields(gpt_output, validation_errors: list, computerized_text: str, handwritten_text: str,
+                        crops: dict = None, model_name: str = "gemini-2.5-flash"):
+    """
+    Re-query suspect key fields and write the answers into `gpt_output` (in place).
+    Returns a list of {'field', 'reason', 'before', 'after'} for every field that was asked.
+    """
+    suspects = find_suspect_fields(gpt_output, validation_errors)
+    if not suspects:
+        return []
+
+    prompt = build_verify_prompt(suspects, computerized_text, handwritten_text, _shipment(gpt_output))
+    regions = {KEY_FIELDS[path]["region"] for path in suspects} - {None}
+    relevant_crops = {name: png for name, png in (crops or {}).items() if name in regions}
+    if relevant_crops:
+        raw = await to_model_thread(_ask_with_crops, prompt, relevant_crops, model_name)
+    else:
+        raw = await extract_with_gemini(prompt, model_name, stage="field_verification")
+
+    try:
+        answers = json.loads(clean_llm_json(raw))
+    except ValueError:
+        answers = {}
+    if not isinstance(answers, dict):
+        answers = {}
+
+    shipment = gpt_output['corrected_schema']['shipment_document']
+    checked = []
+    for path, reason in suspects.items():
+        before, after = get_path(shipment, path), answers.get(path)
+        if after is not None:
+            set_path(shipment, path, after)
+        checked.append({'field': path, 'reason': reason, 'before': before, 'after': after})
+    return checked
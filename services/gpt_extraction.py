@@ -1,9 +1,25 @@
-from google.generativeai import GenerativeModel
-import asyncio
-import json
+from app.services.clients import generative_model
+from app.services.concurrency import limiter, to_model_thread
+from app.services.usage import record_usage
+import re
 
-async def extract_with_gemini(prompt: str):
-    model = GenerativeModel("gemini-2.5-flash")
-    # model = GenerativeModel("gemini-2.5-flash-lite")
-    response = await asyncio.to_thread(model.generate_content, prompt)
+def clean_llm_json(raw_text: str):
+    # Remove markdown fences and language hints
+    cleaned = re.sub(r"^```(?:json)?", "", raw_text.strip(), flags=re.IGNORECASE | re.MULTILINE)
+    cleaned = re.sub(r"```$", "", cleaned, flags=re.MULTILINE).strip()
+    # Trim to first and last curly brace pair (handles extra commentary)
+    if cleaned.count("{") > 0 and cleaned.count("}") > 0:
+        start = cleaned.find("{")
+        end = cleaned.rfind("}") + 1
+        cleaned = cleaned[start:end]
+    return cleaned
+
+async def extract_with_gemini(prompt: str, model_name: str = "gemini-2.5-flash", stage: str = "merge"):
+    model = generative_model(model_name)
+    response = await to_model_thread(_generate, model, prompt)
+    record_usage(stage, model_name, response)
     return response.text
+
+def _generate(model, prompt: str):
+    with limiter(f"gemini:{model.model_name.split('/')[-1]}").slot():
+        return model.generate_content(prompt)
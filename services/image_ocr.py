@@ -1,15 +1,31 @@
-from google import genai
-from google.genai import types
 import pathlib
-from dotenv import load_dotenv
-import os
-from pdf2image import convert_from_path
-from PIL import Image
+from concurrent.futures import FIRST_COMPLETED, wait
+import contextvars
+import json
+from app.services.clients import gemini_client
+from app.services.concurrency import limiter, page_executor
+from app.services.pages import count_pages, render_page
+from app.services.settings import PAGES_IN_FLIGHT
+from app.services.usage import record_usage
 
-# -------------------- CONFIG --------------------
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
+# Stored alongside persisted OCR text so re-extraction knows which backend produced it
+BACKEND = "gemini-2.5-flash"
+BACKEND_VERSION = "plain-text-v1"
+# Same plain text plus the printed fields in the shipment schema, for the local merge
+STRUCTURED_BACKEND_VERSION = "plain-text+schema-v1"
+
+PLAIN_TEXT_PROMPT = "Extract all visible text from this image as plain text. Return only the text."
+
+STRUCTURED_PROMPT = """
+Read this page of a shipment document (CMR / delivery note).
+Return only valid JSON with two keys:
+- "text": all visible text on the page as plain text
+- "shipment_document": the **printed** (typed, not handwritten) values of the page, filled into the
+  schema below; use null for missing values and do not change key names or structure
+
+Schema:
+{schema}
+"""
 
 
 def extract_text_llms(file_path: str) -> tuple[str, int]:
@@ -18,28 +34,80 @@ def extract_text_llms(file_path: str) -> tuple[str, int]:
     Approach: PDF -> images -> Gemini per page.
     Returns: (extracted_text, num_pages)
     """
-    filepath = pathlib.Path(file_path)
+    pages = extract_text_llms_pages(file_path)
+    return "\n\n".join(text for text in pages if text), len(pages)
 
-    # If input is PDF -> convert to images
+
+def extract_text_llms_pages(file_path: str) -> list[str]:
+    """
+    Same as extract_text_llms but keeps one entry per page (empty string if nothing was read).
+    """
+    return _run_pages(file_path, _extract_page)
+
+
+def extract_structured_llms_pages(file_path: str, schema: str) -> list[dict]:
+    """
+    Plain text and printed schema fields per page: [{'text': str, 'fields': dict or None}].
+    Pages whose JSON cannot be parsed keep their text with fields None.
+    """
+    prompt = STRUCTURED_PROMPT.format(schema=schema)
+    return _run_pages(file_path, lambda img: _extract_page_structured(img, prompt))
+
+
+def _run_pages(file_path: str, extract_page) -> list:
+    from PIL import Image
+
+    # If input is PDF -> each task renders its own page, so only pages in flight are held in memory
     if file_path.lower().endswith(".pdf"):
-        images = convert_from_path(file_path,poppler_path=r"C:\Program Files\Poppler\poppler-24.08.0\Library\bin")
-        num_pages = len(images)
+        num_pages = count_pages(file_path)
+        load = lambda index: render_page(file_path, index)
     else:
         # Single image file
-        images = [Image.open(filepath).convert("RGB")]
         num_pages = 1
+        load = lambda index: Image.open(pathlib.Path(file_path)).convert("RGB")
 
-    all_text = []
+    # At most PAGES_IN_FLIGHT pages of a document are rendered or waiting on the model at once (what
+    # admission control budgets for); the adaptive limiter decides how many calls are really in flight.
+    # Each task runs in a copy of the caller's context so token usage reaches the document's tracker
+    pool = page_executor()
+    futures, results = {}, [None] * num_pages
+    for index in range(num_pages):
+        if len(futures) >= PAGES_IN_FLIGHT:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[futures.pop(future)] = future.result()
+        futures[pool.submit(contextvars.copy_context().run, lambda index=index: extract_page(load(index)))] = index
+    for future, index in futures.items():
+        results[index] = future.result()
+    return results
 
-    for img in images:
-        prompt = "Extract all visible text from this image as plain text. Return only the text."
-        response = client.models.generate_content(
+
+def _extract_page(img) -> str:
+    prompt = PLAIN_TEXT_PROMPT
+    with limiter("gemini:gemini-2.5-flash").slot():
+        response = gemini_client().models.generate_content(
             model="gemini-2.5-flash",
             contents=[prompt, img]
         )
-        if response.text:
-            all_text.append(response.text.strip())
+    record_usage("printed_ocr", "gemini-2.5-flash", response)
+    return response.text.strip() if response.text else ""
+
 
-    extracted_text = "\n\n".join(all_text)
+def _extract_page_structured(img, prompt: str) -> dict:
+    from google.genai import types
 
-    return extracted_text, num_pages
+    with limiter("gemini:gemini-2.5-flash").slot():
+        response = gemini_client().models.generate_content(
+            model="gemini-2.5-flash",
+            contents=[prompt, img],
+            config=types.GenerateContentConfig(response_mime_type="application/json")
+        )
+    record_usage("printed_ocr", "gemini-2.5-flash", response)
+    try:
+        page = json.loads(response.text or "")
+    except ValueError:
+        return {'text': (response.text or "").strip(), 'fields': None}
+    if not isinstance(page, dict):
+        return {'text': "", 'fields': None}
+    fields = page.get('shipment_document')
+    return {'text': str(page.get('text') or "").strip(), 'fields': fields if isinstance(fields, dict) else None}
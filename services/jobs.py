@@ -0,0 +1,189 @@
+from app.core.db import get_db_connection
+from app.services.admission import check_admissible, estimate_cost
+from app.services.document_store import save_document
+from app.services.settings import JOB_MAX_ATTEMPTS as MAX_ATTEMPTS
+from app.services.settings import JOB_RETRY_BACKOFF_SECONDS as RETRY_BACKOFF_SECONDS
+from app.services.settings import JOB_STALE_AFTER_SECONDS as STALE_AFTER_SECONDS
+from datetime import datetime
+import os
+
+_schema_ready = False
+
+
+def ensure_jobs_table(cur):
+    global _schema_ready
+    if _schema_ready:
+        return
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id BIGSERIAL PRIMARY KEY,
+            document_id TEXT NOT NULL,
+            dataset_name TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            original_filename TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+            locked_by TEXT,
+            heartbeat_at TIMESTAMPTZ,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finished_at TIMESTAMPTZ
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS jobs_ready_idx ON jobs (run_after, id) WHERE status = 'queued'")
+    cur.execute("CREATE INDEX IF NOT EXISTS jobs_running_idx ON jobs (heartbeat_at) WHERE status = 'running'")
+    _schema_ready = True
+
+
+def enqueue_job(file_path: str, dataset_name: str, original_filename: str) -> dict:
+    """
+    Queue a file for processing and return immediately.
+    `file_path` must be on storage every worker node can read.
+    Files over the admission limits are rejected here (413) rather than failing in a worker.
+    """
+    check_admissible(estimate_cost(file_path))
+    document_id = f"{dataset_name}/{original_filename}"
+
+    # Placeholder row so clients can poll the state flags while the job waits
+    save_document({
+        'id': document_id,
+        'properties': {
+            'blob_name': f"{dataset_name}/{os.path.basename(file_path)}",
+            'request_timestamp': datetime.utcnow().isoformat(),
+            'blob_size': os.path.getsize(file_path)
+        },
+        'state': {
+            'file_landed': True,
+            'ocr_completed': False,
+            'gpt_extraction_completed': False,
+            'processing_completed': False
+        },
+        'extracted_data': {}
+    })
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_jobs_table(cur)
+            cur.execute(
+                """
+                INSERT INTO jobs (document_id, dataset_name, file_path, original_filename, max_attempts)
+                VALUES (%s, %s, %s, %s, %s) RETURNING id
+                """,
+                (document_id, dataset_name, file_path, original_filename, MAX_ATTEMPTS)
+            )
+            job_id = cur.fetchone()[0]
+            conn.commit()
+
+    return {'job_id': job_id, 'document_id': document_id, 'status': 'queued'}
+
+
+def claim_job(worker_id: str):
+    """Atomically claim the next ready job. Returns a job dict or None."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_jobs_table(cur)
+            cur.execute(
+                """
+                UPDATE jobs
+                SET status = 'running', locked_by = %s, heartbeat_at = now(), attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = 'queued' AND run_after <= now()
+                    ORDER BY run_after, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, document_id, dataset_name, file_path, original_filename, attempts, max_attempts
+                """,
+                (worker_id,)
+            )
+            row = cur.fetchone()
+            conn.commit()
+
+    if not row:
+        return None
+    keys = ('id', 'document_id', 'dataset_name', 'file_path', 'original_filename', 'attempts', 'max_attempts')
+    return dict(zip(keys, row))
+
+
+def heartbeat(job_id: int, worker_id: str) -> bool:
+    """Extend the lease on a running job. False means the job was taken over by another worker."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE jobs SET heartbeat_at = now() WHERE id = %s AND locked_by = %s AND status = 'running'",
+                (job_id, worker_id)
+            )
+            conn.commit()
+            return cur.rowcount == 1
+
+
+def complete_job(job_id: int, worker_id: str):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE jobs SET status = 'done', finished_at = now(), last_error = NULL
+                WHERE id = %s AND locked_by = %s
+                """,
+                (job_id, worker_id)
+            )
+            conn.commit()
+
+
+def fail_job(job_id: int, worker_id: str, error: str, permanent: bool = False):
+    """
+    Requeue with exponential backoff, or mark failed once attempts are used up.
+    `permanent` failures (e.g. a document over the admission limits) are never retried.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE jobs
+                SET status = CASE WHEN attempts < max_attempts AND NOT %s THEN 'queued' ELSE 'failed' END,
+                    run_after = now() + make_interval(secs => %s * power(2, attempts - 1)),
+                    finished_at = CASE WHEN attempts < max_attempts AND NOT %s THEN NULL ELSE now() END,
+                    locked_by = NULL,
+                    last_error = %s
+                WHERE id = %s AND locked_by = %s
+                """,
+                (permanent, RETRY_BACKOFF_SECONDS, permanent, error, job_id, worker_id)
+            )
+            conn.commit()
+
+
+def requeue_stale_jobs() -> int:
+    """Return jobs of crashed workers (no heartbeat within STALE_AFTER_SECONDS) to the queue."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_jobs_table(cur)
+            cur.execute(
+                """
+                UPDATE jobs
+                SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                    finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE now() END,
+                    locked_by = NULL,
+                    last_error = 'worker heartbeat lost'
+                WHERE status = 'running' AND heartbeat_at < now() - make_interval(secs => %s)
+                """,
+                (STALE_AFTER_SECONDS,)
+            )
+            conn.commit()
+            return cur.rowcount
+
+
+def job_status(job_id: int):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, document_id, status, attempts, last_error, created_at, finished_at FROM jobs WHERE id = %s",
+                (job_id,)
+            )
+            row = cur.fetchone()
+    if not row:
+        return None
+    keys = ('job_id', 'document_id', 'status', 'attempts', 'last_error', 'created_at', 'finished_at')
+    return dict(zip(keys, row))
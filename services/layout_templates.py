@@ -0,0 +1,239 @@
+from app.services.pages import count_pages, render_page
+from app.services.settings import CMR_TEMPLATE_IMAGE
+from app.services.settings import TEMPLATE_MIN_INLIERS as MIN_INLIERS
+import os
+
+TEMPLATE_DPI = 300
+# A ruled cell snaps a region only if their union covers this share range of the nominal box
+SNAP_COVERAGE = (0.6, 1.6)
+
+# -------------------- TEMPLATES --------------------
+# Regions are nominal normalized (x0, y0, x1, y1) boxes of the form. The reference image is the
+# blank (or cleanly filled) form scanned flat and cropped to the paper edge, portrait, 150-300 DPI,
+# PNG or JPEG. Its margins and scale differ per print run, so when it is loaded every region is
+# snapped to the ruled cells of the reference that it covers (see snap_regions); regions without
+# matching ruling (unruled delivery notes) keep their nominal box.
+# `handwritten` regions are cropped and sent to the model; the rest are read with tesseract.
+CMR_AVC_2009 = {
+    "name": "cmr_avc_2009",
+    "reference_image": CMR_TEMPLATE_IMAGE,
+    "regions": [
+        {"name": "box_1_sender", "box": (0.05, 0.04, 0.50, 0.13), "handwritten": False},
+        {"name": "box_2_consignee", "box": (0.05, 0.13, 0.50, 0.21), "handwritten": False},
+        {"name": "box_3_place_of_delivery", "box": (0.05, 0.21, 0.50, 0.26), "handwritten": False},
+        {"name": "box_4_place_date_taking_over", "box": (0.05, 0.26, 0.50, 0.31), "handwritten": True},
+        {"name": "box_5_documents_attached", "box": (0.05, 0.31, 0.50, 0.36), "handwritten": False},
+        {"name": "box_16_carrier", "box": (0.50, 0.13, 0.95, 0.21), "handwritten": False},
+        {"name": "box_17_successive_carriers", "box": (0.50, 0.21, 0.95, 0.26), "handwritten": False},
+        {"name": "box_18_carrier_reservations", "box": (0.50, 0.26, 0.95, 0.36), "handwritten": True},
+        {"name": "box_6_12_goods", "box": (0.05, 0.36, 0.95, 0.60), "handwritten": False},
+        {"name": "box_13_sender_instructions", "box": (0.05, 0.60, 0.50, 0.70), "handwritten": False},
+        {"name": "box_19_special_agreements", "box": (0.50, 0.60, 0.95, 0.70), "handwritten": True},
+        {"name": "box_14_payment", "box": (0.05, 0.70, 0.50, 0.76), "handwritten": False},
+        {"name": "box_20_to_be_paid_by", "box": (0.50, 0.70, 0.95, 0.80), "handwritten": False},
+        {"name": "box_21_established_in", "box": (0.05, 0.80, 0.50, 0.84), "handwritten": True},
+        {"name": "box_15_cash_on_delivery", "box": (0.50, 0.80, 0.95, 0.84), "handwritten": False},
+        {"name": "box_22_sender_signature", "box": (0.05, 0.84, 0.35, 0.96), "handwritten": True},
+        {"name": "box_23_carrier_signature", "box": (0.35, 0.84, 0.65, 0.96), "handwritten": True},
+        {"name": "box_24_goods_received", "box": (0.65, 0.84, 0.95, 0.96), "handwritten": True},
+    ],
+}
+
+TEMPLATES = {}
+_reference_features = {}
+
+
+def register_template(template: dict):
+    """
+    Register a form layout. Recurring delivery-note formats can be added from the
+    `layout_templates` list in the configuration row using the same structure as CMR_AVC_2009.
+    """
+    if TEMPLATES.get(template["name"]) != template:
+        TEMPLATES[template["name"]] = template
+        _reference_features.pop(template["name"], None)
+
+
+register_template(CMR_AVC_2009)
+
+
+# -------------------- ALIGNMENT --------------------
+def _orb():
+    import cv2
+    return cv2.ORB_create(nfeatures=4000)
+
+
+def _features(gray):
+    return _orb().detectAndCompute(gray, None)
+
+
+def ruled_cells(gray) -> list[tuple]:
+    """Normalized (x0, y0, x1, y1) boxes of the cells enclosed by the ruled lines of a form image."""
+    import cv2
+    import numpy as np
+
+    h, w = gray.shape[:2]
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # Long horizontal and vertical strokes only: printed text and handwriting drop out
+    horizontal = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((1, max(w // 30, 1)), np.uint8))
+    vertical = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((max(h // 30, 1), 1), np.uint8))
+    ruling = cv2.dilate(horizontal | vertical, np.ones((3, 3), np.uint8))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(255 - ruling, connectivity=4)
+    cells = []
+    for x, y, cw, ch, area in stats[1:count]:
+        # Skip slivers between double lines and the background around the form
+        if cw < w * 0.02 or ch < h * 0.01 or (cw > w * 0.98 and ch > h * 0.98):
+            continue
+        cells.append((x / w, y / h, (x + cw) / w, (y + ch) / h))
+    return cells
+
+
+def snap_regions(regions: list[dict], cells: list[tuple]) -> list[dict]:
+    """Move each region onto the union of the ruled cells whose centre lies inside its nominal box."""
+    snapped = []
+    for region in regions:
+        x0, y0, x1, y1 = region["box"]
+        inside = [c for c in cells if x0 <= (c[0] + c[2]) / 2 <= x1 and y0 <= (c[1] + c[3]) / 2 <= y1]
+        box = region["box"]
+        if inside:
+            union = (min(c[0] for c in inside), min(c[1] for c in inside),
+                     max(c[2] for c in inside), max(c[3] for c in inside))
+            coverage = (union[2] - union[0]) * (union[3] - union[1]) / ((x1 - x0) * (y1 - y0))
+            if SNAP_COVERAGE[0] <= coverage <= SNAP_COVERAGE[1]:
+                box = union
+        snapped.append({**region, "box": box})
+    return snapped
+
+
+def _reference(template: dict):
+    """(shape, keypoints, descriptors, snapped regions) of the template's reference image, or None."""
+    name = template["name"]
+    if name not in _reference_features:
+        path = template.get("reference_image")
+        if not path or not os.path.exists(path):
+            _reference_features[name] = None
+            return None
+        import cv2
+        ref = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        _reference_features[name] = (
+            (ref.shape, *_features(ref), snap_regions(template["regions"], ruled_cells(ref)))
+            if ref is not None else None
+        )
+    return _reference_features[name]
+
+
+def align_to_template(page_bgr, template: dict):
+    """
+    Warp a page onto the template's reference image using ORB features and a RANSAC homography.
+    Returns (aligned_page, inliers) or (None, 0) if the page does not match.
+    """
+    import cv2
+    import numpy as np
+
+    reference = _reference(template)
+    if reference is None:
+        return None, 0
+    (ref_h, ref_w), ref_kp, ref_des, _ = reference
+
+    gray = cv2.cvtColor(page_bgr, cv2.COLOR_BGR2GRAY)
+    kp, des = _features(gray)
+    if des is None or ref_des is None:
+        return None, 0
+
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    matches = sorted(matcher.match(des, ref_des), key=lambda m: m.distance)[:1000]
+    if len(matches) < MIN_INLIERS:
+        return None, 0
+
+    src = np.float32([kp[m.queryIdx].pt for m in matches]).reshape(-1, 1, 2)
+    dst = np.float32([ref_kp[m.trainIdx].pt for m in matches]).reshape(-1, 1, 2)
+    homography, mask = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+    inliers = int(mask.sum()) if mask is not None else 0
+    if homography is None or inliers < MIN_INLIERS:
+        return None, 0
+
+    # Warp at the page's own resolution so handwriting crops keep their detail
+    scale = max(page_bgr.shape[1] / ref_w, 1.0)
+    size = (int(ref_w * scale), int(ref_h * scale))
+    homography = np.diag([scale, scale, 1.0]) @ homography
+    return cv2.warpPerspective(page_bgr, homography, size), inliers
+
+
+def match_template(page_bgr):
+    """Return (template, aligned_page) for the best-matching registered template, or (None, None)."""
+    best = (None, None, 0)
+    for template in TEMPLATES.values():
+        aligned, inliers = align_to_template(page_bgr, template)
+        if aligned is not None and inliers > best[2]:
+            best = (template, aligned, inliers)
+    return best[0], best[1]
+
+
+def crop_regions(aligned_bgr, template: dict, handwritten: bool):
+    """
+    Crop the template regions (snapped to the reference image's ruling) with the given
+    handwritten flag. Returns {region_name: image}.
+    """
+    reference = _reference(template)
+    h, w = aligned_bgr.shape[:2]
+    crops = {}
+    for region in reference[3] if reference else template["regions"]:
+        if region["handwritten"] != handwritten:
+            continue
+        x0, y0, x1, y1 = region["box"]
+        crops[region["name"]] = aligned_bgr[int(y0 * h):int(y1 * h), int(x0 * w):int(x1 * w)]
+    return crops
+
+
+def load_page(file_path: str):
+    """Load a single-page document as a BGR array, or None for multi-page files."""
+    import cv2
+    import numpy as np
+
+    if file_path.lower().endswith(".pdf"):
+        if count_pages(file_path) != 1:
+            return None
+        page = render_page(file_path, 0, TEMPLATE_DPI)
+        return cv2.cvtColor(np.array(page.convert("RGB")), cv2.COLOR_RGB2BGR)
+    return cv2.imread(file_path)
+
+
+def read_printed_regions(crops: dict) -> str:
+    """Read printed boxes locally with tesseract."""
+    import cv2
+    import pytesseract
+    from app.core.config import TESSERACT_PATH
+
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
+    parts = []
+    for name, crop in crops.items():
+        text = pytesseract.image_to_string(cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)).strip()
+        if text:
+            parts.append(f"[{name}]\n{text}")
+    return "\n\n".join(parts)
+
+
+def extract_with_template(file_path: str):
+    """
+    Region-cropped extraction for pages that match a registered layout.
+    Returns (template_name, {region_name: png_bytes}, printed_text) or None when no template applies.
+    """
+    # Skip rasterizing entirely when no template has a reference image to align against
+    if not any(_reference(template) for template in TEMPLATES.values()):
+        return None
+
+    import cv2
+
+    page = load_page(file_path)
+    if page is None:
+        return None
+
+    template, aligned = match_template(page)
+    if template is None:
+        return None
+
+    handwritten_crops = {
+        name: cv2.imencode(".png", crop)[1].tobytes()
+        for name, crop in crop_regions(aligned, template, handwritten=True).items()
+    }
+    printed_text = read_printed_regions(crop_regions(aligned, template, handwritten=False))
+    return template["name"], handwritten_crops, printed_text
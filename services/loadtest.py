@@ -0,0 +1,229 @@
+"""
+End-to-end load test: runs the API service against the stand-in model server and drives
+concurrent uploads of the sample documents.
+
+    python -m app.services.loadtest --concurrency 8 --duration 120 --samples app/services
+
+The service process gets GEMINI_BASE_URL / endpoint / key pointed at stub_model_server, so no real
+model is called. The report covers sustained throughput, latency percentiles and, sampled from
+/proc once a second, the service's thread count and resident memory (a thread count that keeps
+climbing under steady load usually means an executor is created per request and never shut down).
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SAMPLE_PATTERNS = ("*.pdf", "*.jpg", "*.jpeg", "*.png")
+
+
+def percentile(values: list, share: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def process_stats(pid: int):
+    """(threads, rss_mb) of a process and its children, from /proc. None if the process is gone."""
+    threads, rss_kb = 0, 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        threads += int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss_kb += int(line.split()[1])
+        except OSError:
+            if p == pid:
+                return None
+    return threads, round(rss_kb / 1024, 1)
+
+
+async def wait_until_up(client, url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get(url, timeout=2)
+            return
+        except Exception:
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start(command: list[str], env: dict, log_path: str = None) -> subprocess.Popen:
+    """Start a child process. Its output goes to `log_path` (or is discarded), never to an unread pipe."""
+    if not log_path:
+        return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(log_path, "ab") as log:
+        return subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def drive(client, args, samples: list[str], results: list, deadline: float):
+    """One virtual user: upload samples back to back until the deadline."""
+    index = 0
+    while time.monotonic() < deadline:
+        path = samples[index % len(samples)]
+        index += 1
+        with open(path, "rb") as f:
+            content = f.read()
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                args.upload_url,
+                files={args.file_field: (os.path.basename(path), content)},
+                data={"dataset_name": args.dataset},
+                timeout=args.request_timeout
+            )
+            status = response.status_code
+        except Exception as e:
+            status = type(e).__name__
+        results.append({'status': status, 'latency': time.perf_counter() - started, 'finished': time.monotonic()})
+
+
+async def sample_resources(pid: int, timeline: list, stop: asyncio.Event, start_time: float):
+    while not stop.is_set():
+        stats = process_stats(pid)
+        if stats:
+            timeline.append({'t': round(time.monotonic() - start_time, 1), 'threads': stats[0], 'rss_mb': stats[1]})
+        try:
+            await asyncio.wait_for(stop.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+
+def summarize(results: list, timeline: list, duration: float, stub_stats: dict) -> dict:
+    ok = [r for r in results if r['status'] == 200]
+    latencies = [r['latency'] for r in ok]
+    statuses = {}
+    for r in results:
+        statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+    threads = [point['threads'] for point in timeline]
+    rss = [point['rss_mb'] for point in timeline]
+    return {
+        'requests': len(results),
+        'succeeded': len(ok),
+        'statuses': statuses,
+        'throughput_per_min': round(len(ok) / duration * 60, 2) if duration else 0,
+        'latency_seconds': {
+            'p50': percentile(latencies, 0.50),
+            'p90': percentile(latencies, 0.90),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else None,
+            'mean': statistics.fmean(latencies) if latencies else None
+        },
+        'threads': {'start': threads[0], 'peak': max(threads), 'end': threads[-1]} if threads else None,
+        'rss_mb': {'start': rss[0], 'peak': max(rss), 'end': rss[-1]} if rss else None,
+        'stub': stub_stats,
+        'timeline': timeline
+    }
+
+
+def print_report(report: dict):
+    print(f"\n📊 {report['succeeded']}/{report['requests']} uploads succeeded, {report['throughput_per_min']} documents/min")
+    print(f"   statuses: {report['statuses']}")
+    latency = report['latency_seconds']
+    if latency['p50'] is not None:
+        print(f"   latency s: p50 {latency['p50']:.2f}  p90 {latency['p90']:.2f}  p99 {latency['p99']:.2f}  max {latency['max']:.2f}")
+    if report['threads']:
+        print(f"   threads: start {report['threads']['start']}  peak {report['threads']['peak']}  end {report['threads']['end']}")
+        print(f"   rss MB:  start {report['rss_mb']['start']}  peak {report['rss_mb']['peak']}  end {report['rss_mb']['end']}")
+    if report['stub']:
+        print(f"   model stand-in: {report['stub']}")
+    print(f"\n{'t':>7} {'threads':>8} {'rss MB':>9}")
+    step = max(1, len(report['timeline']) // 30)
+    for point in report['timeline'][::step]:
+        print(f"{point['t']:>7} {point['threads']:>8} {point['rss_mb']:>9}")
+
+
+async def run(args) -> dict:
+    import httpx
+
+    samples = sorted(p for pattern in SAMPLE_PATTERNS for p in glob.glob(os.path.join(args.samples, pattern)))
+    if not samples:
+        raise SystemExit(f"No sample documents in {args.samples}")
+
+    stub_url = f"http://127.0.0.1:{args.stub_port}"
+    service_url = f"http://127.0.0.1:{args.service_port}"
+    env = {
+        **os.environ,
+        "GEMINI_BASE_URL": stub_url,
+        "GEMINI_API_KEY": "load-test",
+        "endpoint": f"{stub_url}/",
+        "key": "load-test",
+    }
+    stub = start([
+        sys.executable, "-m", "app.services.stub_model_server", "--port", str(args.stub_port),
+        "--latency-ms", str(args.latency_ms), "--rate-429", str(args.rate_429),
+        "--rate-timeout", str(args.rate_timeout), "--max-concurrency", str(args.model_max_concurrency)
+    ], env, args.log_dir and os.path.join(args.log_dir, "stub_model_server.log"))
+    service = start([
+        sys.executable, "-m", "uvicorn", args.app, "--port", str(args.service_port), "--log-level", "warning"
+    ], env, args.log_dir and os.path.join(args.log_dir, "service.log"))
+
+    try:
+        async with httpx.AsyncClient(base_url=service_url) as client:
+            await wait_until_up(client, f"{stub_url}/stats")
+            await wait_until_up(client, f"{service_url}/docs")
+            print(f"🚀 {args.concurrency} concurrent uploaders for {args.duration}s, {len(samples)} sample documents")
+
+            results, timeline = [], []
+            stop = asyncio.Event()
+            start_time = time.monotonic()
+            sampler = asyncio.create_task(sample_resources(service.pid, timeline, stop, start_time))
+            deadline = start_time + args.duration
+            await asyncio.gather(*(drive(client, args, samples, results, deadline) for _ in range(args.concurrency)))
+            # Let the service settle so leaked threads show up in the final samples
+            await asyncio.sleep(args.settle)
+            stop.set()
+            await sampler
+
+            stub_stats = (await client.get(f"{stub_url}/stats")).json()
+        return summarize(results, timeline, time.monotonic() - start_time - args.settle, stub_stats)
+    finally:
+        for process in (service, stub):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the upload API against a stand-in model server.")
+    parser.add_argument("--app", default="app.main:app", help="ASGI app of the service (uvicorn import string)")
+    parser.add_argument("--upload-url", default="/upload", help="Upload endpoint path")
+    parser.add_argument("--file-field", default="file", help="Multipart field holding the document")
+    parser.add_argument("--dataset", default="loadtest")
+    parser.add_argument("--samples", default=os.path.dirname(os.path.abspath(__file__)), help="Directory with sample PDFs / images")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=120, help="Seconds of sustained load")
+    parser.add_argument("--settle", type=float, default=10, help="Seconds to keep sampling after the load stops")
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--service-port", type=int, default=8000)
+    parser.add_argument("--stub-port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=1500, help="Mean simulated model latency")
+    parser.add_argument("--rate-429", type=float, default=0.02)
+    parser.add_argument("--rate-timeout", type=float, default=0.005)
+    parser.add_argument("--model-max-concurrency", type=int, default=16, help="Simulated provider concurrency cap")
+    parser.add_argument("--log-dir", help="Write the service and stand-in output here (discarded otherwise)")
+    parser.add_argument("--json", help="Also write the full report (including the timeline) to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
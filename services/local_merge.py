@@ -0,0 +1,193 @@
+"""
+Deterministic merge of the two OCR stages, replacing the merge LLM call for most documents.
+
+Input is structured on both sides: the printed schema fields per page from
+image_ocr.extract_structured_llms_pages and the handwritten schema JSON from ocr_llm.extract_text_llm.
+Fields are merged one by one after normalizing dates, numbers, booleans and text:
+- a value present on one side only is taken as is;
+- equal values (after normalization) keep the printed spelling;
+- differing values follow the confidence rules below, and only what those rules cannot
+  decide is sent to the model, in one small prompt listing just the conflicting fields.
+"""
+from app.services.gpt_extraction import clean_llm_json, extract_with_gemini
+from app.services.shipment_models import (
+    FieldError, ShipmentDocument, coerce_bool, coerce_date, coerce_number, coerce_number_or_text, coerce_text,
+    get_path, set_path
+)
+from dataclasses import fields, is_dataclass
+from typing import Union, get_args, get_origin, get_type_hints
+from datetime import date
+import json
+import re
+
+# Sections filled in by hand at delivery: a handwritten value replaces the printed one
+HANDWRITTEN_WINS = ("reception_confirmation.", "remarks_observations.", "transport_details.")
+# Pre-printed parties and form data: handwriting there is kept as an extra, never an override
+PRINTED_WINS = (
+    "document_type", "document_number", "consignor_sender.", "consignee_recipient.",
+    "carrier.", "issuing_party_details.",
+)
+
+CONFLICT_PROMPT = """
+A shipment document (CMR / delivery note) was read twice: once for the printed text and once for
+handwriting. For each field below the two readings disagree. Decide the correct value: handwriting
+usually corrects or completes the printed form, but OCR of handwriting can be wrong.
+
+### FIELDS:
+{conflicts}
+
+### OUTPUT FORMAT:
+Return **only valid JSON** mapping each field key above to the correct value (or null).
+"""
+
+# Bump when merge_fields / combine_pages change behaviour; with the tables above and the conflict
+# prompt it versions locally merged rows (process.LOCAL_MERGE_VERSION), apart from LLM merges
+RULES_REVISION = 1
+MERGE_RULES = json.dumps([RULES_REVISION, HANDWRITTEN_WINS, PRINTED_WINS, CONFLICT_PROMPT])
+
+
+# -------------------- FIELD TYPES --------------------
+def _leaf_coercer(hint):
+    if get_origin(hint) is Union:
+        args = [a for a in get_args(hint) if a is not type(None)]
+        if set(args) == {int, float, str}:
+            return coerce_number_or_text
+        if set(args) == {int, float}:
+            return coerce_number
+        hint = args[0]
+    if hint is date:
+        return coerce_date
+    if hint is bool:
+        return coerce_bool
+    return coerce_text
+
+
+def _scalar_fields(cls, prefix: str = "") -> dict:
+    """{dotted path: coercer} for every scalar field of the schema (lists are merged as a whole)."""
+    paths = {}
+    hints = get_type_hints(cls)
+    for f in fields(cls):
+        hint = hints[f.name]
+        args = [a for a in get_args(hint) if a is not type(None)]
+        nested = args[0] if get_origin(hint) is Union and len(args) == 1 else hint
+        if is_dataclass(nested):
+            paths.update(_scalar_fields(nested, f"{prefix}{f.name}."))
+        elif get_origin(nested) is not list:
+            paths[f"{prefix}{f.name}"] = _leaf_coercer(hint)
+    return paths
+
+
+SCALAR_FIELDS = _scalar_fields(ShipmentDocument)
+
+
+def normalize(path: str, value):
+    """Comparable form of a value: parsed dates/numbers/booleans, casefolded text without punctuation."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    coerce = SCALAR_FIELDS.get(path, coerce_text)
+    try:
+        value = coerce(value)
+    except (FieldError, ValueError):
+        value = coerce_text(value)
+    if isinstance(value, str):
+        value = re.sub(r"[\W_]+", " ", value.casefold()).strip()
+        return value or None
+    return value
+
+
+# -------------------- MERGE --------------------
+def combine_pages(pages: list) -> dict:
+    """Printed fields of all pages in one shipment_document: first non-null value wins, items are appended."""
+    combined = {}
+    for page in pages:
+        if not isinstance(page, dict):
+            continue
+        for path in SCALAR_FIELDS:
+            value = get_path(page, path)
+            if value is not None and get_path(combined, path) is None:
+                set_path(combined, path, value)
+        items = get_path(page, "goods_description.items")
+        if isinstance(items, list) and items:
+            set_path(combined, "goods_description.items", (get_path(combined, "goods_description.items") or []) + items)
+    return combined
+
+
+def merge_fields(printed: dict, handwritten: dict):
+    """
+    Merge printed and handwritten shipment_document dicts.
+    Returns (merged, handwritten_extras, conflicts) where conflicts is {path: (printed, handwritten)}.
+    """
+    merged, extras, conflicts = {}, [], {}
+    for path in SCALAR_FIELDS:
+        printed_value, handwritten_value = get_path(printed, path), get_path(handwritten, path)
+        printed_norm, handwritten_norm = normalize(path, printed_value), normalize(path, handwritten_value)
+        if handwritten_norm is None or printed_norm == handwritten_norm:
+            value = printed_value if printed_norm is not None else None
+        elif printed_norm is None or path.startswith(HANDWRITTEN_WINS):
+            value = handwritten_value
+        elif path.startswith(PRINTED_WINS):
+            value = printed_value
+            extras.append({'field': path, 'handwritten': handwritten_value})
+        elif isinstance(printed_norm, str) and (handwritten_norm in printed_norm or printed_norm in handwritten_norm):
+            # One reading is a truncation of the other: keep the longer one
+            value = printed_value if len(printed_norm) >= len(handwritten_norm) else handwritten_value
+        else:
+            conflicts[path] = (printed_value, handwritten_value)
+            value = printed_value
+        set_path(merged, path, value)
+
+    items = get_path(printed, "goods_description.items") or get_path(handwritten, "goods_description.items") or []
+    set_path(merged, "goods_description.items", items)
+    extras.extend(handwritten.get('handwritten_extras') or [])
+    return merged, extras, conflicts
+
+
+def build_conflict_prompt(conflicts: dict) -> str:
+    lines = "\n".join(
+        f'- "{path}": printed {json.dumps(printed, ensure_ascii=False, default=str)}, '
+        f'handwritten {json.dumps(handwritten, ensure_ascii=False, default=str)}'
+        for path, (printed, handwritten) in conflicts.items()
+    )
+    return CONFLICT_PROMPT.format(conflicts=lines)
+
+
+def merge_pages(printed_pages: list, handwritten: dict):
+    """merge_fields over the per-page printed schema dicts and the parsed handwritten OCR JSON."""
+    handwritten_shipment = handwritten.get('shipment_document', handwritten) if isinstance(handwritten, dict) else {}
+    return merge_fields(combine_pages(printed_pages), handwritten_shipment or {})
+
+
+def merge_output(merged: dict, extras: list) -> dict:
+    return {'corrected_schema': {'shipment_document': {**merged, 'handwritten_extras': extras}}}
+
+
+async def merge_structured(printed_pages: list, handwritten: dict, model_name: str = "gemini-2.5-flash"):
+    """
+    Local merge stage. `printed_pages` are the per-page printed schema dicts, `handwritten`
+    the parsed handwritten OCR JSON. Returns (gpt_output, report) where report lists what was
+    decided locally and which conflicts went to the model.
+    """
+    merged, extras, conflicts = merge_pages(printed_pages, handwritten)
+
+    resolved = {}
+    if conflicts:
+        raw = await extract_with_gemini(build_conflict_prompt(conflicts), model_name, stage="merge_conflicts")
+        try:
+            resolved = json.loads(clean_llm_json(raw))
+        except ValueError:
+            resolved = {}
+        if not isinstance(resolved, dict):
+            resolved = {}
+        for path in conflicts:
+            if resolved.get(path) is not None:
+                set_path(merged, path, resolved[path])
+
+    gpt_output = merge_output(merged, extras)
+    report = {
+        'conflicts': [
+            {'field': path, 'printed': printed, 'handwritten': hand, 'resolved': resolved.get(path)}
+            for path, (printed, hand) in conflicts.items()
+        ],
+        'model_call': bool(conflicts)
+    }
+    return gpt_output, report
@@ -1,21 +1,20 @@
-from google import genai
-from google.genai import types
 import pathlib
-from dotenv import load_dotenv
-import os
+from app.services.clients import gemini_client
+from app.services.concurrency import limiter
+from app.services.pages import count_pages
+from app.services.usage import record_usage
 
-# Load environment variables
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-
-# Initialize Gemini client
-client = genai.Client(api_key=api_key)
+# Stored alongside persisted OCR text so re-extraction knows which backend produced it
+BACKEND = "gemini-2.0-flash"
+BACKEND_VERSION = "handwritten-schema-v1"
+REGIONS_BACKEND_VERSION = "handwritten-regions-v1"
 
 def extract_text_llm(file_path: str) -> tuple[str, int]:
     """
     Extract text (including handwritten) from PDF or image using Gemini 2.5 model.
     Returns: (extracted_text, num_pages)
     """
+    from google.genai import types
 
     filepath = pathlib.Path(file_path)
     if not filepath.exists():
@@ -148,16 +147,18 @@ Schema:
 """
 
     # Send file + prompt to Gemini
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[
-            types.Part.from_bytes(
-                data=filepath.read_bytes(),
-                mime_type=mime_type
-            ),
-            prompt
-        ]
-    )
+    with limiter("gemini:gemini-2.0-flash").slot():
+        response = gemini_client().models.generate_content(
+            model="gemini-2.0-flash",
+            contents=[
+                types.Part.from_bytes(
+                    data=filepath.read_bytes(),
+                    mime_type=mime_type
+                ),
+                prompt
+            ]
+        )
+    record_usage("handwritten_ocr", "gemini-2.0-flash", response)
 
     # Extract text safely
     extracted_text = ""
@@ -169,9 +170,38 @@ Schema:
     except Exception as e:
         print("⚠️ Error extracting text:", e)
 
-    # Default page count (Gemini doesn’t expose PDF page info)
-    num_pages = 1
+    # Gemini doesn’t expose PDF page info; read it from the file
+    return extracted_text, count_pages(file_path)
+
+
+
+def extract_regions_llm(crops: dict) -> str:
+    """
+    Transcribe handwriting from template-cropped form boxes in a single Gemini call.
+    crops: {region_name: png_bytes}. Returns JSON text mapping each region to its handwritten text.
+    """
+    from google.genai import types
 
-    return extracted_text, num_pages
+    contents = []
+    for name, png in crops.items():
+        contents.append(f"Region: {name}")
+        contents.append(types.Part.from_bytes(data=png, mime_type="image/png"))
 
+    prompt = f"""
+You are an OCR extraction assistant.
+
+Task:
+- Each image above is one box cropped from a CMR consignment note, labelled with its region name.
+- Transcribe only the **handwritten** text, stamps and signatures' printed names in each box.
+- Return JSON mapping each region name to its text (use null when a box has no handwriting).
+- Region names: {", ".join(crops)}
+"""
+    contents.append(prompt)
 
+    with limiter("gemini:gemini-2.0-flash").slot():
+        response = gemini_client().models.generate_content(
+            model="gemini-2.0-flash",
+            contents=contents
+        )
+    record_usage("handwritten_regions", "gemini-2.0-flash", response)
+    return response.text.strip() if getattr(response, "text", None) else ""
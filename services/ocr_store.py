@@ -0,0 +1,312 @@
+from app.core.db import get_db_connection
+from app.services.document_store import create_index_concurrently, ensure_documents_table
+import argparse
+import json
+
+HANDWRITTEN = "handwritten"
+PRINTED = "printed"
+# Printed schema fields per page (JSON text), for re-running the local merge without OCR
+PRINTED_FIELDS = "printed_fields"
+
+
+# Search: `search_text` is what gets indexed (the extracted values for handwritten schema JSON, the
+# text itself for printed OCR) and `tsv` its word vector, both written with the row. Trigrams find
+# partial numbers and misspelt names. 'simple' config: no stemming or stop words, the text mixes
+# Dutch, English and German with codes and names.
+INDEXES = {
+    'ocr_results_tsv_idx': "ocr_results USING GIN (tsv)",
+    'ocr_results_search_trgm_idx': "ocr_results USING GIN (search_text gin_trgm_ops)",
+}
+# Only these kinds are searched; printed_fields duplicates the printed text as schema JSON
+SEARCHED_KINDS = (HANDWRITTEN, PRINTED)
+
+_schema_ready = False
+
+
+def ensure_ocr_table(cur):
+    """
+    Create the table with its search columns and indexes when the database is new (nothing to
+    lock yet). Index builds on an existing table are left to migrate_ocr_schema().
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    ensure_documents_table(cur)
+    cur.execute("SELECT to_regclass('ocr_results') IS NULL")
+    if cur.fetchone()[0]:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ocr_results (
+                document_id TEXT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+                kind TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                backend_version TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                search_text TEXT NOT NULL DEFAULT '',
+                tsv tsvector NOT NULL DEFAULT ''::tsvector,
+                PRIMARY KEY (document_id, kind, backend, backend_version, page)
+            )
+        """)
+        for name, definition in INDEXES.items():
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    _schema_ready = True
+
+
+def _json_values(value) -> list[str]:
+    if isinstance(value, dict):
+        return [text for item in value.values() for text in _json_values(item)]
+    if isinstance(value, list):
+        return [text for item in value for text in _json_values(item)]
+    if value is None or isinstance(value, bool):
+        return []
+    text = str(value).strip()
+    return [text] if text and text.lower() != "null" else []
+
+
+def search_text(kind: str, text: str) -> str:
+    """
+    The part of an OCR row worth indexing. Handwritten OCR is schema JSON: only its values are
+    kept, one per line, so key names and nulls do not match every document.
+    """
+    if kind not in SEARCHED_KINDS:
+        return ""
+    text = text or ""
+    if kind == HANDWRITTEN:
+        start, end = text.find("{"), text.rfind("}")
+        if start != -1 and end > start:
+            try:
+                return "\n".join(_json_values(json.loads(text[start:end + 1])))
+            except ValueError:
+                pass
+    return text
+
+
+def save_ocr_pages(document_id: str, kind: str, backend: str, backend_version: str, pages: list[str]):
+    """
+    Persist OCR text per page for one backend version. Backends that read the whole
+    document in one call store a single page 0.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_ocr_table(cur)
+            cur.execute(
+                "DELETE FROM ocr_results WHERE document_id = %s AND kind = %s AND backend = %s AND backend_version = %s",
+                (document_id, kind, backend, backend_version)
+            )
+            for page, text in enumerate(pages):
+                searchable = search_text(kind, text)
+                cur.execute(
+                    """
+                    INSERT INTO ocr_results (document_id, kind, backend, backend_version, page, text, search_text, tsv)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, to_tsvector('simple', %s))
+                    """,
+                    (document_id, kind, backend, backend_version, page, text or "", searchable, searchable)
+                )
+            conn.commit()
+
+
+def copy_ocr_results(source_id: str, document_id: str):
+    """Give `document_id` the OCR rows of `source_id` (a near-duplicate served from its extraction)."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_ocr_table(cur)
+            cur.execute("DELETE FROM ocr_results WHERE document_id = %s", (document_id,))
+            cur.execute(
+                """
+                INSERT INTO ocr_results (document_id, kind, backend, backend_version, page, text, search_text, tsv, created_at)
+                SELECT %s, kind, backend, backend_version, page, text, search_text, tsv, created_at
+                FROM ocr_results WHERE document_id = %s
+                """,
+                (document_id, source_id)
+            )
+            conn.commit()
+
+
+def migrate_ocr_schema():
+    """
+    Create the table if needed and (re)build the search indexes with CREATE INDEX CONCURRENTLY,
+    so uploads keep writing while it runs. Needs autocommit, like document_store.migrate_schema().
+    """
+    with get_db_connection() as conn:
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                ensure_ocr_table(cur)
+                for name, definition in INDEXES.items():
+                    create_index_concurrently(cur, name, definition)
+        finally:
+            conn.autocommit = autocommit
+
+
+def load_ocr_text(document_id: str, kind: str):
+    """Return the most recently stored OCR text of `kind` for a document (pages joined), or None."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT page, text FROM ocr_results
+                WHERE document_id = %s AND kind = %s AND (backend, backend_version) = (
+                    SELECT backend, backend_version FROM ocr_results
+                    WHERE document_id = %s AND kind = %s
+                    ORDER BY created_at DESC LIMIT 1
+                )
+                ORDER BY page
+                """,
+                (document_id, kind, document_id, kind)
+            )
+            rows = cur.fetchall()
+    if not rows:
+        return None
+    return "\n\n".join(text for _, text in rows)
+
+
+def load_ocr_texts(document_ids: list[str], kind: str) -> dict:
+    """Bulk version of load_ocr_text: {document_id: text} for every id with stored OCR of `kind`."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT r.document_id, string_agg(r.text, E'\\n\\n' ORDER BY r.page)
+                FROM ocr_results r
+                JOIN (
+                    SELECT DISTINCT ON (document_id) document_id, backend, backend_version
+                    FROM ocr_results
+                    WHERE document_id = ANY(%s) AND kind = %s
+                    ORDER BY document_id, created_at DESC
+                ) latest USING (document_id, backend, backend_version)
+                WHERE r.kind = %s
+                GROUP BY r.document_id
+                """,
+                (list(document_ids), kind, kind)
+            )
+            return dict(cur.fetchall())
+
+
+def load_ocr_pages(document_ids: list[str], kind: str) -> dict:
+    """Like load_ocr_texts, but {document_id: [text per page]} instead of the joined text."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT r.document_id, array_agg(r.text ORDER BY r.page)
+                FROM ocr_results r
+                JOIN (
+                    SELECT DISTINCT ON (document_id) document_id, backend, backend_version
+                    FROM ocr_results
+                    WHERE document_id = ANY(%s) AND kind = %s
+                    ORDER BY document_id, created_at DESC
+                ) latest USING (document_id, backend, backend_version)
+                WHERE r.kind = %s
+                GROUP BY r.document_id
+                """,
+                (list(document_ids), kind, kind)
+            )
+            return dict(cur.fetchall())
+
+
+def load_printed_fields(document_ids: list[str]) -> dict:
+    """{document_id: [printed schema dict or None per page]} for documents read by the structured printed stage."""
+    found = {}
+    for document_id, pages in load_ocr_pages(document_ids, PRINTED_FIELDS).items():
+        parsed = []
+        for text in pages:
+            try:
+                page = json.loads(text) if text else None
+            except ValueError:
+                page = None
+            parsed.append(page if isinstance(page, dict) else None)
+        found[document_id] = parsed
+    return found
+
+
+SNIPPET_OPTIONS = "StartSel=**, StopSel=**, MaxWords=18, MinWords=6, MaxFragments=2, FragmentDelimiter= … "
+
+
+def _hit(row) -> dict:
+    keys = ('document_id', 'kind', 'page', 'rank', 'snippet', 'document_number', 'consignee_name')
+    return dict(zip(keys, row))
+
+
+def search_documents(query: str, dataset: str = None, limit: int = 20) -> list[dict]:
+    """
+    Ranked search over handwritten and printed OCR text. Word search first (web-style syntax:
+    "trailer 3815803", "witczak -damaged", quoted phrases); when nothing matches, a trigram
+    search finds partial numbers and misspelt names. One hit per document, best page first.
+    Only the latest backend version of each kind is searched, like load_ocr_text reads.
+    """
+    limit = max(1, min(limit, 200))
+    # Rows superseded by a newer backend version of the same kind are skipped (primary key lookup)
+    current = f"""
+        r.kind IN ({', '.join(['%s'] * len(SEARCHED_KINDS))})
+        AND NOT EXISTS (
+            SELECT 1 FROM ocr_results n
+            WHERE n.document_id = r.document_id AND n.kind = r.kind AND n.created_at > r.created_at
+              AND (n.backend, n.backend_version) <> (r.backend, r.backend_version)
+        )
+    """
+    if dataset:
+        current += " AND EXISTS (SELECT 1 FROM documents d WHERE d.id = r.document_id AND d.dataset = %s)"
+    current_params = [*SEARCHED_KINDS, *([dataset] if dataset else [])]
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_ocr_table(cur)
+            conn.commit()
+            cur.execute(
+                f"""
+                WITH q AS (SELECT websearch_to_tsquery('simple', %s) AS query),
+                hits AS (
+                    SELECT DISTINCT ON (r.document_id) r.document_id, r.kind, r.page, r.search_text,
+                           ts_rank(r.tsv, q.query) AS rank
+                    FROM ocr_results r, q
+                    WHERE r.tsv @@ q.query AND {current}
+                    ORDER BY r.document_id, rank DESC
+                ),
+                top AS (SELECT * FROM hits ORDER BY rank DESC, document_id LIMIT %s)
+                SELECT top.document_id, top.kind, top.page, top.rank,
+                       ts_headline('simple', top.search_text, q.query, %s), d.document_number, d.consignee_name
+                FROM top CROSS JOIN q LEFT JOIN documents d ON d.id = top.document_id
+                ORDER BY top.rank DESC, top.document_id
+                """,
+                (query, *current_params, limit, SNIPPET_OPTIONS)
+            )
+            rows = cur.fetchall()
+            if rows or len(query.strip()) < 3:
+                return [_hit(row) for row in rows]
+
+            pattern = "%" + query.strip().replace("%", r"\%").replace("_", r"\_") + "%"
+            cur.execute(
+                f"""
+                WITH hits AS (
+                    SELECT DISTINCT ON (r.document_id) r.document_id, r.kind, r.page, r.search_text,
+                           word_similarity(%s, r.search_text) AS rank
+                    FROM ocr_results r
+                    WHERE (r.search_text ILIKE %s OR %s <%% r.search_text) AND {current}
+                    ORDER BY r.document_id, rank DESC
+                ),
+                top AS (SELECT * FROM hits ORDER BY rank DESC, document_id LIMIT %s)
+                SELECT top.document_id, top.kind, top.page, top.rank,
+                       substring(top.search_text FROM greatest(1, strpos(lower(top.search_text), lower(%s)) - 60) FOR 160),
+                       d.document_number, d.consignee_name
+                FROM top LEFT JOIN documents d ON d.id = top.document_id
+                ORDER BY top.rank DESC, top.document_id
+                """,
+                (query, pattern, query, *current_params, limit, query.strip())
+            )
+            return [_hit(row) for row in cur.fetchall()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search stored OCR text.")
+    parser.add_argument("query")
+    parser.add_argument("--dataset")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    for hit in search_documents(args.query, args.dataset, args.limit):
+        print(f"{hit['rank']:.3f}  {hit['document_id']}  [{hit['kind']} p{hit['page']}]  {hit['document_number'] or ''}")
+        print(f"        {' '.join((hit['snippet'] or '').split())}")
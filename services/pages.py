@@ -0,0 +1,37 @@
+"""
+Page counting and one-page-at-a-time PDF rendering.
+
+convert_from_path() without a page range rasterizes the whole document into memory at once;
+a 60-page scan at 200 DPI is several GB of pixels. Every stage renders through render_page /
+iter_pages instead, so at most one page per worker is held as an image.
+"""
+from app.services.settings import POPPLER_PATH
+
+
+def count_pages(file_path: str) -> int:
+    """Page count from the PDF structure (no rendering); images are one page."""
+    if not file_path.lower().endswith(".pdf"):
+        return 1
+    from pypdf import PdfReader
+
+    return len(PdfReader(file_path).pages)
+
+
+def render_page(file_path: str, index: int, dpi: int = 200, **kwargs):
+    """Render page `index` (0-based) of a PDF as a PIL image."""
+    from pdf2image import convert_from_path
+
+    return convert_from_path(
+        file_path, dpi=dpi, first_page=index + 1, last_page=index + 1, poppler_path=POPPLER_PATH, **kwargs
+    )[0]
+
+
+def iter_pages(file_path: str, dpi: int = 200, **kwargs):
+    """Yield the pages of a PDF (rendered one by one) or the single image of a photo, as PIL images."""
+    if not file_path.lower().endswith(".pdf"):
+        from PIL import Image
+
+        yield Image.open(file_path)
+        return
+    for index in range(count_pages(file_path)):
+        yield render_page(file_path, index, dpi, **kwargs)
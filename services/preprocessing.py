@@ -11,8 +11,17 @@ def enhance_handwriting_visibility(image_path: str, output_path: str):
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"Could not load image: {image_path}")
-    
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    final = enhance_handwriting(img)
+
+    cv2.imwrite(output_path, final)
+    print(f"✅ Enhanced image saved: {output_path}")
+
+def enhance_handwriting(img):
+    """
+    In-memory version of enhance_handwriting_visibility: BGR or grayscale array in, grayscale array out.
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
 
     # Step 1: More aggressive denoising for pencil marks
     gray = cv2.fastNlMeansDenoising(gray, h=12, templateWindowSize=7, searchWindowSize=21)
@@ -46,10 +55,152 @@ def enhance_handwriting_visibility(image_path: str, output_path: str):
     gamma_corrected = np.uint8(gamma_corrected)
 
     # Step 6: Final noise reduction
-    final = cv2.medianBlur(gamma_corrected, 3)
+    return cv2.medianBlur(gamma_corrected, 3)
 
-    cv2.imwrite(output_path, final)
-    print(f"✅ Enhanced image saved: {output_path}")
+# -------------------- DOCUMENT CROPPING --------------------
+# Long side of the downscaled copy used to find the paper outline
+DETECT_SIDE = 1000
+# The paper must cover at least this share of the photo, otherwise we keep the full frame
+MIN_DOCUMENT_AREA = 0.5
+# A page outline covering this much already fills the image (scans, tight photos): no warp
+FULL_FRAME_AREA = 0.9
+
+def order_corners(pts):
+    """Order four points as top-left, top-right, bottom-right, bottom-left."""
+    pts = np.asarray(pts, dtype=np.float32).reshape(4, 2)
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.float32([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]])
+
+def detect_document_quad(img):
+    """
+    Find the paper outline in a photo (table, floor and hands around it).
+    Returns the four corners in full-resolution coordinates, or None when no four-cornered
+    outline covers at least MIN_DOCUMENT_AREA of the photo or the page already fills it.
+    """
+    h, w = img.shape[:2]
+    scale = DETECT_SIDE / max(h, w) if max(h, w) > DETECT_SIDE else 1.0
+    small = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else img
+
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    gray = cv2.GaussianBlur(gray, (5, 5), 0)
+    edges = cv2.Canny(gray, 50, 150)
+    edges = cv2.dilate(edges, np.ones((5, 5), np.uint8), iterations=2)
+
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    frame_area = small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < MIN_DOCUMENT_AREA * frame_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        # Anything but a clean four-cornered outline (a stamp, folded paper, the table edge) is not warped
+        if len(approx) != 4 or not cv2.isContourConvex(approx):
+            continue
+        if cv2.contourArea(approx) >= FULL_FRAME_AREA * frame_area:
+            return None
+        return order_corners(approx / scale)
+    return None
+
+def four_point_transform(img, quad):
+    """Warp the quadrilateral to a flat, upright rectangle."""
+    tl, tr, br, bl = quad
+    width = int(max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl)))
+    height = int(max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl)))
+    dst = np.float32([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]])
+    matrix = cv2.getPerspectiveTransform(quad, dst)
+    return cv2.warpPerspective(img, matrix, (width, height))
+
+def deskew(img, max_angle: float = 10.0):
+    """Rotate small residual skew out of a page using the orientation of its dark (text) pixels."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    coords = cv2.findNonZero(ink)
+    if coords is None:
+        return img
+    angle = cv2.minAreaRect(coords)[-1]
+    # OpenCV releases report the rectangle angle in (0, 90] or in [-90, 0); either way the
+    # rectangle is the same for angle ± 90, so fold it into (-45, 45] (the nearest small rotation)
+    if angle > 45:
+        angle -= 90
+    elif angle <= -45:
+        angle += 90
+    if abs(angle) < 0.5 or abs(angle) > max_angle:
+        return img
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+def is_clean_page(img) -> bool:
+    """
+    Histogram check for pages that need no enhancement: bright background, dark ink,
+    and a wide gap between them (typical of scans and good photos).
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    cdf = np.cumsum(hist) / hist.sum()
+    p5, p50, p95 = (int(np.searchsorted(cdf, q)) for q in (0.05, 0.5, 0.95))
+    return p50 >= 180 and (p95 - p5) >= 120
+
+def prepare_page(img, max_side: int, enhance: bool = False):
+    """
+    Pre-OCR stage for one page: crop to the paper, correct perspective and skew and cap the
+    resolution. With `enhance` (PREPARE_ENHANCE), pages that are not already clean also get
+    the handwriting enhancement.
+    """
+    quad = detect_document_quad(img)
+    page = four_point_transform(img, quad) if quad is not None else img
+    page = deskew(page)
+
+    h, w = page.shape[:2]
+    if max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        page = cv2.resize(page, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+
+    if enhance and not is_clean_page(page):
+        page = enhance_handwriting(page)
+    return page
+
+def _has_text_layer(pdf_path: str) -> bool:
+    from pypdf import PdfReader
+    try:
+        return any((page.extract_text() or "").strip() for page in PdfReader(pdf_path).pages)
+    except Exception:
+        return False
+
+def prepare_document(file_path: str, output_dir: str) -> str:
+    """
+    Run prepare_page over every page of a photo or scanned PDF and write the result to output_dir.
+    Returns the path to use for OCR. Born-digital PDFs (with a text layer) are returned unchanged.
+    """
+    from app.services.pages import iter_pages
+    from app.services.settings import PREPARE_DPI, PREPARE_ENHANCE, PREPARE_MAX_SIDE
+    from PIL import Image
+    from pypdf import PdfWriter
+
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    if file_path.lower().endswith(".pdf"):
+        if _has_text_layer(file_path):
+            return file_path
+        # One page in memory at a time: each prepared page is written as its own PDF, then concatenated
+        writer = PdfWriter()
+        for index, page in enumerate(iter_pages(file_path, PREPARE_DPI)):
+            out = prepare_page(cv2.cvtColor(np.array(page.convert("RGB")), cv2.COLOR_RGB2BGR), PREPARE_MAX_SIDE, PREPARE_ENHANCE)
+            page_path = os.path.join(output_dir, f"{stem}_prepared_{index}.pdf")
+            Image.fromarray(out if out.ndim == 2 else cv2.cvtColor(out, cv2.COLOR_BGR2RGB)).save(
+                page_path, "PDF", resolution=PREPARE_DPI
+            )
+            writer.append(page_path)
+        output_path = os.path.join(output_dir, f"{stem}_prepared.pdf")
+        with open(output_path, "wb") as f:
+            writer.write(f)
+        return output_path
+
+    img = cv2.imread(file_path)
+    if img is None:
+        raise ValueError(f"Could not load image: {file_path}")
+    output_path = os.path.join(output_dir, f"{stem}_prepared.jpg")
+    cv2.imwrite(output_path, prepare_page(img, PREPARE_MAX_SIDE, PREPARE_ENHANCE), [cv2.IMWRITE_JPEG_QUALITY, 92])
+    return output_path
 
 def preprocess_pdf_for_handwriting(pdf_path: str, output_dir: str):
     """
@@ -81,8 +232,12 @@ def preprocess_pdf_for_handwriting(pdf_path: str, output_dir: str):
                 # Save page as image
                 page.save(img_path, "PNG", quality=95)
 
-                # Enhance handwriting visibility
-                enhance_handwriting_visibility(img_path, output_path)
+                # Enhance handwriting visibility (clean scans are kept as they are)
+                page_img = cv2.imread(img_path)
+                if is_clean_page(page_img):
+                    cv2.imwrite(output_path, page_img)
+                else:
+                    enhance_handwriting_visibility(img_path, output_path)
                 processed_images.append(output_path)
 
             print(f"\n✅ All pages processed and saved in: {output_dir}")
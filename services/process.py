@@ -1,17 +1,29 @@
 from app.core.db import get_db_connection
-from app.services.ocr import extract_text
-from app.services.ocr_llm import extract_text_llm
-from app.services.image_ocr import extract_text_llms
+from app.services.ocr import extract_text_pages
+from app.services import ocr_llm, image_ocr
+from app.services.ocr_llm import extract_text_llm, extract_regions_llm
+from app.services.image_ocr import extract_structured_llms_pages, extract_text_llms_pages
+from app.services.local_merge import MERGE_RULES, merge_structured
 from app.services.azure_ocr import extract_text_azure
-from app.services.gpt_extraction import extract_with_gemini
-from psycopg2.extras import Json
-from fastapi import HTTPException
+from app.services.gpt_extraction import clean_llm_json, extract_with_gemini
+from app.services.field_verification import verify_fields
+from app.services.layout_templates import register_template, extract_with_template
+from app.services.dedup import DUPLICATE_MODE, page_hashes, find_near_duplicate, confirm_duplicate, index_document_hashes
+from app.services.document_store import fetch_document, fetch_documents, save_document
+from app.services.segmentation import segment_document
+from app.services.admission import admit
+from app.services.concurrency import to_model_thread
+from app.services.ocr_store import HANDWRITTEN, PRINTED, PRINTED_FIELDS, copy_ocr_results, save_ocr_pages
+from app.services.settings import FIELD_VERIFICATION, LOCAL_MERGE
+from app.services.shipment_models import decode_shipment, to_dict
+from app.services.usage import CHEAP_MERGE_MODEL, over_budget, save_usage, track_usage
 from datetime import datetime
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 import os
-import re
+import tempfile
+import threading
 import time
 
 def fetch_configuration():
@@ -22,40 +34,7 @@ def fetch_configuration():
             return result[0] if result else {"id": "configuration"}
             
 
-def clean_llm_json(raw_text: str):
-    # Remove markdown fences and language hints
-    cleaned = re.sub(r"^```(?:json)?", "", raw_text.strip(), flags=re.IGNORECASE | re.MULTILINE)
-    cleaned = re.sub(r"```$", "", cleaned, flags=re.MULTILINE).strip()
-    # Trim to first and last curly brace pair (handles extra commentary)
-    if cleaned.count("{") > 0 and cleaned.count("}") > 0:
-        start = cleaned.find("{")
-        end = cleaned.rfind("}") + 1
-        cleaned = cleaned[start:end]
-    return cleaned
-
-async def process_file(file_path, dataset_name, original_filename: str):
-    config = fetch_configuration()
-    #prompt_template = config.get(dataset_name, {}).get("model_prompt", "Extract all data.")
-    #example_schema = config.get(dataset_name, {}).get("example_schema", {})
-
-  
-    loop = asyncio.get_event_loop()
-    executor = ThreadPoolExecutor(max_workers=2)  # 2 threads for parallel execution
-
-    # Schedule both functions to run in parallel
-    handwritten_future = loop.run_in_executor(executor, extract_text_llm, file_path)
-    computerized_future = loop.run_in_executor(executor, extract_text_llms, file_path)
-
-    # ✅ Run both in true parallel
-    handwritten_result, computerized_result = await asyncio.gather(
-        handwritten_future, computerized_future
-    )
-
-    handwritten_text, num_pages_handwritten = handwritten_result
-    computerized_text, num_pages_computerized = computerized_result
-    num_pages = max(num_pages_handwritten, num_pages_computerized)
-
-    schema = """
+SCHEMA = """
 {
   "shipment_document": {
     "document_type": "string (e.g., 'CMR', 'Delivery Note')",
@@ -168,36 +147,8 @@ async def process_file(file_path, dataset_name, original_filename: str):
   }
 }
 """
-    prompts = f"""
-You are an OCR document parser specialized for invoices and packing lists.
-
-Step 1: Extract all possible text directly from the provided PDF file (computerized/digital text layer only).  
-       Fill the schema below to create the **initial_schema**. Use null for any missing fields.
-
-Step 2: Use the additional OCR output provided below (from Gemini) which contains only handwritten text.  
-       Update only those fields in the initial_schema that are clearly corrected or overwritten by handwritten text, producing the **corrected_schema**.
-
-Step 3: Any handwritten text that cannot be confidently mapped to a schema field should be added under a special key `"handwritten_extras"` inside corrected_schema.
-
-Step 4: Output the result as valid JSON containing two main objects:
-       1. "initial_schema" — filled using only PDF/computerized text
-       2. "corrected_schema" — strictly updated using handwritten text from Gemini, with unstructured data in "handwritten_extras"
 
-Rules:
-- Do not add, remove, or rename any keys in the original schema.
-- Preserve the same structure and field order.
-- Replace "string"/"number" placeholders with extracted values.
-- If a field is missing or cannot be determined, write null.
-- Only update fields in corrected_schema if the Gemini OCR shows a clear, unambiguous correction.
-- Always return valid JSON only (no explanations, no extra text).
-
-Schema:
-{schema}
-
-Additional OCR Output (from Gemini, contains only handwritten text):
-{handwritten_text}
-"""
-    prompt = f"""
+MERGE_PROMPT = """
 You are an OCR document parser specialized in structured extraction and correction for shipment documents (e.g., CMR, Delivery Notes).
 
 ### TASK:
@@ -240,12 +191,28 @@ Return **only valid JSON**:
 {handwritten_text}
 """
 
+# Stored in properties; re-extraction refreshes every row whose merge_version differs
+MERGE_VERSION = hashlib.sha1((SCHEMA + MERGE_PROMPT).encode("utf-8")).hexdigest()[:12]
+# Rows merged locally (merge_mode "local" / "local+llm") carry the version of the local merge rules
+LOCAL_MERGE_VERSION = hashlib.sha1((SCHEMA + MERGE_RULES).encode("utf-8")).hexdigest()[:12]
+CURRENT_MERGE_VERSIONS = (MERGE_VERSION, LOCAL_MERGE_VERSION)
+
+def build_merge_prompt(computerized_text: str, handwritten_text: str) -> str:
+    return MERGE_PROMPT.format(
+        schema=SCHEMA,
+        computerized_text=computerized_text,
+        handwritten_text=handwritten_text
+    )
 
-
+async def merge_ocr(computerized_text: str, handwritten_text: str, model_name: str = "gemini-2.5-flash"):
+    """
+    Merge stage: one LLM call reconciling printed and handwritten OCR into the schema.
+    Returns (gpt_output, parse_error, total_time_seconds).
+    """
     start_time = time.time()
-    
-    gpt_output_raw = await extract_with_gemini(prompt)
-    
+
+    gpt_output_raw = await extract_with_gemini(build_merge_prompt(computerized_text, handwritten_text), model_name)
+
     cleaned = clean_llm_json(gpt_output_raw)
     try:
         gpt_output = json.loads(cleaned)
@@ -253,17 +220,335 @@ Return **only valid JSON**:
     except Exception as e:
         gpt_output = {"raw": gpt_output_raw}
         parse_error = str(e)
-    
+
     end_time = time.time()
-    total_time = round(end_time - start_time, 2)
+    return gpt_output, parse_error, round(end_time - start_time, 2)
 
+def parse_handwritten_fields(handwritten_text: str):
+    """The handwritten OCR stage answers in the schema; return it as a dict, or None if it is not JSON."""
+    try:
+        fields = json.loads(clean_llm_json(handwritten_text or ""))
+    except ValueError:
+        return None
+    return fields if isinstance(fields, dict) else None
+
+def merge_version_for(merge_mode: str) -> str:
+    return LOCAL_MERGE_VERSION if merge_mode.startswith("local") else MERGE_VERSION
+
+async def merge_stage(computerized_text: str, handwritten_text: str, printed_fields: list = None,
+                      model_name: str = "gemini-2.5-flash"):
+    """
+    Structured output on both sides (printed fields per page, handwritten schema JSON): merge
+    locally and send only real conflicts to the model; otherwise one merge_ocr call.
+    Returns (gpt_output, parse_error, total_time_seconds, merge_report, merge_mode).
+    """
+    handwritten_fields = parse_handwritten_fields(handwritten_text) if printed_fields else None
+    if handwritten_fields is not None and any(printed_fields):
+        start_time = time.time()
+        gpt_output, merge_report = await merge_structured(printed_fields, handwritten_fields, model_name)
+        merge_mode = "local+llm" if merge_report['model_call'] else "local"
+        return gpt_output, None, round(time.time() - start_time, 2), merge_report, merge_mode
+    gpt_output, parse_error, total_time = await merge_ocr(computerized_text, handwritten_text, model_name)
+    return gpt_output, parse_error, total_time, None, "llm"
+
+def validate_output(gpt_output):
+    """
+    Coerce merge output into the typed shipment schema (numbers, dates, booleans).
+    Returns (normalized_output, field_errors); unparseable output is returned unchanged.
+    Values the decoder drops (invalid or unexpected fields) survive in 'raw_schema', the model's
+    schema as it first came back, which is kept next to the typed one whenever there are errors.
+    """
+    if not isinstance(gpt_output, dict) or set(gpt_output) == {"raw"}:
+        return gpt_output, []
+    shipment, errors = decode_shipment(gpt_output)
+    if shipment is None:
+        return gpt_output, errors
+    normalized = {**gpt_output, 'corrected_schema': {'shipment_document': to_dict(shipment)}}
+    if errors and 'raw_schema' not in gpt_output:
+        normalized['raw_schema'] = gpt_output.get('corrected_schema', gpt_output)
+    return normalized, errors
+
+async def verify_stage(gpt_output, validation_errors: list, parse_error, computerized_text: str, handwritten_text: str,
+                       handwritten_crops: dict = None, model_name: str = "gemini-2.5-flash"):
+    """
+    Ask again for just the key fields the merge left invalid or inconsistent.
+    Returns (gpt_output, validation_errors, verified_fields).
+    """
+    verified_fields = []
+    if FIELD_VERIFICATION and parse_error is None:
+        verified_fields = await verify_fields(
+            gpt_output, validation_errors, computerized_text, handwritten_text, handwritten_crops, model_name
+        )
+        if any(f['after'] is not None for f in verified_fields):
+            gpt_output, validation_errors = validate_output(gpt_output)
+    return gpt_output, validation_errors, verified_fields
+
+
+def apply_merge(data: dict, gpt_output, parse_error, validation_errors: list, merge_mode: str, token_usage: dict,
+                merge_version: str = None, merge_report: dict = None, verified_fields: list = None,
+                total_time: float = None) -> bool:
+    """
+    Write the result of a repeated merge (re-extraction, local merge, batch answer) into a stored row.
+    Unparseable output is only recorded as properties.reextract_error: the earlier extraction and its
+    merge version stay, so the next run picks the row up again. Returns whether the output was taken.
+    """
+    if parse_error is not None:
+        data['properties']['reextract_error'] = parse_error
+        return False
+    data['properties'].pop('reextract_error', None)
+    data['properties']['merge_version'] = merge_version or merge_version_for(merge_mode)
+    data['properties']['merge_mode'] = merge_mode
+    data['properties']['reextracted_at'] = datetime.utcnow().isoformat()
+    data['properties']['token_usage'] = token_usage
+    if total_time is not None:
+        data['properties']['total_time_seconds'] = total_time
+    data['state']['gpt_extraction_completed'] = bool(gpt_output)
+    data['state']['processing_completed'] = bool(data['state'].get('ocr_completed') and gpt_output)
+    data['extracted_data']['gpt_extraction_output'] = gpt_output
+    data['extracted_data']['validation_errors'] = validation_errors
+    data['extracted_data']['merge_conflicts'] = merge_report['conflicts'] if merge_report else None
+    data['extracted_data']['verified_fields'] = verified_fields or []
+    data['extracted_data']['error'] = None
+    return True
+
+def serve_duplicate(earlier: dict, document_id: str, dataset_name: str, file_path: str, hashes: list,
+                    fine_hashes: list, match: tuple, parent: dict = None):
+    """Store a near-duplicate upload by reusing the extraction of the earlier document."""
+    properties = {
+        key: value for key, value in earlier.get('properties', {}).items()
+        if key not in ('parent_id', 'page_range', 'bundle_sha1')
+    }
     data = {
-        'id': f"{dataset_name}/{original_filename}",
+        **earlier,
+        'id': document_id,
+        'properties': {
+            **properties,
+            'blob_name': f"{dataset_name}/{os.path.basename(file_path)}",
+            'request_timestamp': datetime.utcnow().isoformat(),
+            'blob_size': os.path.getsize(file_path),
+            'total_time_seconds': 0,
+            'duplicate_of': match[0],
+            'duplicate_distance': match[1]
+        }
+    }
+    if parent:
+        data['properties']['parent_id'] = parent['id']
+        data['properties']['page_range'] = [parent['first_page'], parent['last_page']]
+        data['properties']['bundle_sha1'] = parent['bundle_sha1']
+    save_document(data)
+    index_document_hashes(document_id, dataset_name, hashes, fine_hashes)
+    # The new row needs its own OCR text for re-extraction and search
+    copy_ocr_results(match[0], document_id)
+    return data
+
+async def report_stage(on_stage, flag: str):
+    # on_stage is a blocking callback (e.g. a DB update from the job worker)
+    if on_stage:
+        await asyncio.to_thread(on_stage, flag)
+
+async def process_bundle(file_path, dataset_name, original_filename: str, on_stage=None):
+    """
+    Entry point for uploads that may contain several documents. A single document goes straight
+    to process_file; a bundle is split and its parts are processed concurrently, each as its own
+    row ("<dataset>/<filename>#<n>") pointing at the bundle's row through properties.parent_id.
+    Admission control runs first: oversized files are rejected and heavy ones take the heavy lane.
+    """
+    async with admit(file_path):
+        return await split_and_process(file_path, dataset_name, original_filename, on_stage)
+
+def bundle_stages(on_stage, num_parts: int):
+    """Stage callback for the parts of a bundle: reports a flag once every part has reached it."""
+    seen = {}
+    lock = threading.Lock()
+
+    def report(flag: str):
+        with lock:
+            seen[flag] = seen.get(flag, 0) + 1
+            complete = seen[flag] == num_parts
+        if complete:
+            on_stage(flag)
+    return report
+
+def file_sha1(file_path: str) -> str:
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def finished_part(stored: dict, parent: dict) -> bool:
+    """A part row left complete by an earlier attempt on the same bundle file and page range."""
+    properties = (stored or {}).get('properties', {})
+    return (
+        (stored or {}).get('state', {}).get('processing_completed') is True
+        and properties.get('bundle_sha1') == parent['bundle_sha1']
+        and properties.get('page_range') == [parent['first_page'], parent['last_page']]
+    )
+
+async def split_and_process(file_path, dataset_name, original_filename: str, on_stage=None):
+    start_time = time.time()
+    with tempfile.TemporaryDirectory() as parts_dir:
+        parts = await asyncio.to_thread(segment_document, file_path, parts_dir)
+        if len(parts) == 1:
+            return await process_file(file_path, dataset_name, original_filename, on_stage)
+
+        parent_id = f"{dataset_name}/{original_filename}"
+        bundle_sha1 = await asyncio.to_thread(file_sha1, file_path)
+        specs = [
+            {'id': parent_id, 'first_page': part['first_page'], 'last_page': part['last_page'], 'bundle_sha1': bundle_sha1}
+            for part in parts
+        ]
+        # A retried bundle only reprocesses the parts that did not finish last time
+        stored = await asyncio.to_thread(fetch_documents, [f"{parent_id}#{n}" for n in range(1, len(parts) + 1)])
+        part_stages = bundle_stages(on_stage, len(parts)) if on_stage else None
+
+        async def run_part(number: int, part: dict, spec: dict):
+            earlier = stored.get(f"{parent_id}#{number}")
+            if finished_part(earlier, spec):
+                for flag in ('ocr_completed', 'gpt_extraction_completed'):
+                    await report_stage(part_stages, flag)
+                return earlier
+            return await process_file(part['path'], dataset_name, f"{original_filename}#{number}", part_stages, parent=spec)
+
+        results = await asyncio.gather(*(
+            run_part(number, part, spec) for number, (part, spec) in enumerate(zip(parts, specs), start=1)
+        ), return_exceptions=True)
+
+    failures = [r for r in results if isinstance(r, BaseException)]
+    children = [r for r in results if not isinstance(r, BaseException)]
+    done = len(children) == len(parts)
+    data = {
+        'id': parent_id,
+        'properties': {
+            'blob_name': f"{dataset_name}/{os.path.basename(file_path)}",
+            'request_timestamp': datetime.utcnow().isoformat(),
+            'blob_size': os.path.getsize(file_path),
+            'num_pages': parts[-1]['last_page'] + 1,
+            'parts': [
+                {'id': f"{parent_id}#{number}", 'first_page': part['first_page'], 'last_page': part['last_page']}
+                for number, part in enumerate(parts, start=1)
+            ],
+            'total_time_seconds': round(time.time() - start_time, 2)
+        },
+        'state': {
+            'file_landed': True,
+            'ocr_completed': done and all(c['state']['ocr_completed'] for c in children),
+            'gpt_extraction_completed': done and all(c['state']['gpt_extraction_completed'] for c in children),
+            'processing_completed': done and all(c['state']['processing_completed'] for c in children)
+        },
+        'extracted_data': {
+            'error': "; ".join(str(e) for e in failures) or None
+        }
+    }
+    save_document(data)
+    if failures:
+        # Let the job queue retry the bundle; finished parts are skipped on the next attempt
+        raise failures[0]
+    return data
+
+async def process_file(file_path, dataset_name, original_filename: str, on_stage=None, parent=None):
+    from app.services.preprocessing import prepare_document
+
+    # Parts of a bundle are already admitted with the bundle; direct callers are admitted here
+    async with admit(file_path):
+        with tempfile.TemporaryDirectory() as work_dir, track_usage() as usage:
+            # Crop photos to the paper and fix perspective once; every later stage reads the prepared file
+            ocr_path = await asyncio.to_thread(prepare_document, file_path, work_dir)
+            return await run_pipeline(file_path, ocr_path, dataset_name, original_filename, usage, on_stage, parent)
+
+def local_printed_pages(file_path: str) -> list[str]:
+    return extract_text_pages(file_path)
+
+async def run_pipeline(file_path, ocr_path, dataset_name, original_filename: str, usage, on_stage=None, parent=None):
+    config = fetch_configuration()
+    #prompt_template = config.get(dataset_name, {}).get("model_prompt", "Extract all data.")
+    #example_schema = config.get(dataset_name, {}).get("example_schema", {})
+    document_id = f"{dataset_name}/{original_filename}"
+
+    # Drivers often photograph the same CMR twice; check for a near-duplicate before any model call
+    hashes, fine_hashes = await asyncio.to_thread(page_hashes, ocr_path)
+    match = await asyncio.to_thread(find_near_duplicate, hashes, dataset_name, document_id)
+    # Reuse only when the finer hash agrees; a coarse match alone is just recorded on the new row
+    if match and DUPLICATE_MODE == "reuse" and await asyncio.to_thread(confirm_duplicate, match[0], fine_hashes):
+        earlier = await asyncio.to_thread(fetch_document, match[0])
+        if earlier:
+            return await asyncio.to_thread(
+                serve_duplicate, earlier, document_id, dataset_name, file_path, hashes, fine_hashes, match, parent
+            )
+
+    # Over its monthly budget a dataset falls back to local printed OCR and a cheaper merge model
+    downgraded = await asyncio.to_thread(over_budget, dataset_name, config)
+    merge_model = CHEAP_MERGE_MODEL if downgraded else "gemini-2.5-flash"
+
+    for template in config.get("layout_templates", []):
+        register_template(template)
+
+    # Known form layouts: only the handwritten boxes go to the model, printed boxes are read locally
+    layout = await asyncio.to_thread(extract_with_template, ocr_path)
+    printed_fields = None
+    if layout:
+        layout_template, handwritten_crops, computerized_text = layout
+        handwritten_text = await to_model_thread(extract_regions_llm, handwritten_crops)
+        num_pages_handwritten = num_pages_computerized = 1
+        handwritten_backend = (ocr_llm.BACKEND, ocr_llm.REGIONS_BACKEND_VERSION)
+        printed_backend = ("tesseract", f"layout:{layout_template}")
+        printed_pages = [computerized_text]
+    else:
+        layout_template = handwritten_crops = None
+        # The printed stage also returns its fields in the schema when the local merge is enabled
+        structured = LOCAL_MERGE and not downgraded
+        if downgraded:
+            printed_stage, printed_args = local_printed_pages, (ocr_path,)
+            printed_backend = ("tesseract", "full-page-v1")
+        elif structured:
+            printed_stage, printed_args = extract_structured_llms_pages, (ocr_path, SCHEMA)
+            printed_backend = (image_ocr.BACKEND, image_ocr.STRUCTURED_BACKEND_VERSION)
+        else:
+            printed_stage, printed_args = extract_text_llms_pages, (ocr_path,)
+            printed_backend = (image_ocr.BACKEND, image_ocr.BACKEND_VERSION)
+
+        # ✅ Run both in true parallel; the model calls themselves are gated by the adaptive limiters
+        handwritten_result, computerized_result = await asyncio.gather(
+            to_model_thread(extract_text_llm, ocr_path),
+            to_model_thread(printed_stage, *printed_args)
+        )
+
+        handwritten_text, num_pages_handwritten = handwritten_result
+        if structured:
+            printed_fields = [page['fields'] for page in computerized_result]
+            printed_pages = [page['text'] for page in computerized_result]
+        else:
+            printed_pages = computerized_result
+        computerized_text = "\n\n".join(text for text in printed_pages if text)
+        num_pages_computerized = len(printed_pages)
+        handwritten_backend = (ocr_llm.BACKEND, ocr_llm.BACKEND_VERSION)
+    num_pages = max(num_pages_handwritten, num_pages_computerized)
+    if handwritten_text:
+        await report_stage(on_stage, 'ocr_completed')
+
+    gpt_output, parse_error, total_time, merge_report, merge_mode = await merge_stage(
+        computerized_text, handwritten_text, printed_fields, merge_model
+    )
+    gpt_output, validation_errors = validate_output(gpt_output)
+
+    gpt_output, validation_errors, verified_fields = await verify_stage(
+        gpt_output, validation_errors, parse_error, computerized_text, handwritten_text, handwritten_crops, merge_model
+    )
+    if gpt_output:
+        await report_stage(on_stage, 'gpt_extraction_completed')
+
+    data = {
+        'id': document_id,
         'properties': {
             'blob_name': f"{dataset_name}/{os.path.basename(file_path)}",
             'request_timestamp': datetime.utcnow().isoformat(),
             'blob_size': os.path.getsize(file_path),
             'num_pages': num_pages,
+            'layout_template': layout_template,
+            'merge_version': merge_version_for(merge_mode),
+            'merge_mode': merge_mode,
+            'budget_downgraded': downgraded,
+            'token_usage': usage.summary(),
             'total_time_seconds': total_time
 
         },
@@ -276,30 +561,36 @@ Return **only valid JSON**:
         'extracted_data': {
             'ocr_output': handwritten_text,
             'gpt_extraction_output': gpt_output,
+            'validation_errors': validation_errors,
+            'merge_conflicts': merge_report['conflicts'] if merge_report else None,
+            'verified_fields': verified_fields,
             'error': parse_error
         }
     }
 
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            # ✅ Ensure table exists
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS documents (
-                    id TEXT PRIMARY KEY,
-                    data JSONB NOT NULL
-                )
-            """)
-            conn.commit()
-
-            # ✅ Insert or update row
-            cur.execute(
-                """
-                INSERT INTO documents (id, data) VALUES (%s, %s)
-                ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data
-                """,
-                (data['id'], Json(data))
+    if parent:
+        data['properties']['parent_id'] = parent['id']
+        data['properties']['page_range'] = [parent['first_page'], parent['last_page']]
+        data['properties']['bundle_sha1'] = parent['bundle_sha1']
+
+    if match:
+        data['properties']['duplicate_of'] = match[0]
+        data['properties']['duplicate_distance'] = match[1]
+
+    def persist():
+        save_document(data)
+        index_document_hashes(document_id, dataset_name, hashes, fine_hashes)
+        # Keep both OCR outputs so the merge stage can be re-run without repeating OCR
+        save_ocr_pages(document_id, HANDWRITTEN, *handwritten_backend, [handwritten_text])
+        save_ocr_pages(document_id, PRINTED, *printed_backend, printed_pages)
+        if printed_fields is not None:
+            save_ocr_pages(
+                document_id, PRINTED_FIELDS, *printed_backend,
+                [json.dumps(fields, ensure_ascii=False) if fields is not None else "" for fields in printed_fields]
             )
-            conn.commit()
-
+        save_usage(document_id, dataset_name, data['properties']['token_usage'])
 
+    # Every write opens its own connection; one worker thread keeps them all off the event loop
+    # that the other jobs and their heartbeats share
+    await asyncio.to_thread(persist)
     return data
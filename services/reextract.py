@@ -0,0 +1,112 @@
+"""
+Bulk re-extraction: re-run only the merge stage over stored OCR text.
+
+    python -m app.services.reextract --dataset <name> [--ids ID ...] [--concurrency 8] [--force]
+
+Rows already at the current merge version (MERGE_VERSION, or LOCAL_MERGE_VERSION for rows merged
+locally from stored printed fields) are skipped, so an interrupted run can simply be restarted.
+A merge whose output cannot be parsed keeps the stored extraction and version, so it is retried.
+"""
+from app.core.db import get_db_connection
+from app.services.document_store import fetch_document, save_document
+from app.services.ocr_store import HANDWRITTEN, PRINTED, ensure_ocr_table, load_ocr_text, load_printed_fields
+from app.services.process import (
+    CURRENT_MERGE_VERSIONS, LOCAL_MERGE_VERSION, MERGE_VERSION, apply_merge, merge_stage, validate_output, verify_stage
+)
+from app.services.usage import save_usage, track_usage
+import argparse
+import asyncio
+
+
+def select_documents(dataset_name: str = None, ids: list = None, force: bool = False) -> list[str]:
+    """Ids of documents with stored OCR whose merge output is not at a current merge version."""
+    clauses = [
+        "EXISTS (SELECT 1 FROM ocr_results o WHERE o.document_id = d.id)",
+        # Migrated rows only have the old handwritten OCR; re-merging them would drop the printed fields
+        "(d.data->'properties'->>'legacy_ocr') IS DISTINCT FROM 'true'"
+    ]
+    params = []
+    if dataset_name:
+        clauses.append("d.dataset = %s")
+        params.append(dataset_name)
+    if ids:
+        clauses.append("d.id = ANY(%s)")
+        params.append(list(ids))
+    if not force:
+        clauses.append("coalesce(d.data->'properties'->>'merge_version', '') <> ALL(%s)")
+        params.append(list(CURRENT_MERGE_VERSIONS))
+
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_ocr_table(cur)
+            conn.commit()
+            cur.execute(
+                f"SELECT d.id FROM documents d WHERE {' AND '.join(clauses)} ORDER BY d.id",
+                params
+            )
+            return [row[0] for row in cur.fetchall()]
+
+
+async def reextract_document(document_id: str):
+    handwritten_text = await asyncio.to_thread(load_ocr_text, document_id, HANDWRITTEN)
+    computerized_text = await asyncio.to_thread(load_ocr_text, document_id, PRINTED)
+    if handwritten_text is None and computerized_text is None:
+        return None
+
+    printed_fields = (await asyncio.to_thread(load_printed_fields, [document_id])).get(document_id)
+
+    with track_usage() as usage:
+        gpt_output, parse_error, total_time, merge_report, merge_mode = await merge_stage(
+            computerized_text or "", handwritten_text or "", printed_fields
+        )
+        gpt_output, validation_errors = validate_output(gpt_output)
+        gpt_output, validation_errors, verified_fields = await verify_stage(
+            gpt_output, validation_errors, parse_error, computerized_text or "", handwritten_text or ""
+        )
+
+    data = await asyncio.to_thread(fetch_document, document_id)
+    apply_merge(
+        data, gpt_output, parse_error, validation_errors, merge_mode, usage.summary(),
+        merge_report=merge_report, verified_fields=verified_fields, total_time=total_time
+    )
+    await asyncio.to_thread(save_document, data)
+    await asyncio.to_thread(save_usage, document_id, document_id.split('/', 1)[0], usage.summary())
+    return data
+
+
+async def reextract(document_ids: list[str], concurrency: int = 8):
+    """Re-run the merge stage for the given documents, `concurrency` at a time. Returns (done, failed)."""
+    semaphore = asyncio.Semaphore(concurrency)
+    done, failed = 0, 0
+
+    async def run(document_id):
+        nonlocal done, failed
+        async with semaphore:
+            try:
+                data = await reextract_document(document_id)
+                if data and data['properties'].get('reextract_error'):
+                    failed += 1
+                    print(f"❌ Unparseable merge output for {document_id}, stored extraction kept")
+                    return
+                done += 1
+                print(f"✅ Re-extracted {document_id} ({done}/{len(document_ids)})")
+            except Exception as e:
+                failed += 1
+                print(f"❌ Re-extraction failed for {document_id}: {e}")
+
+    await asyncio.gather(*(run(document_id) for document_id in document_ids))
+    return done, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-run the merge stage over stored OCR text.")
+    parser.add_argument("--dataset", help="Only documents of this dataset")
+    parser.add_argument("--ids", nargs="*", help="Only these document ids")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--force", action="store_true", help="Also re-extract rows already at the current merge version")
+    args = parser.parse_args()
+
+    document_ids = select_documents(args.dataset, args.ids, args.force)
+    print(f"📄 {len(document_ids)} documents to re-extract (merge version {MERGE_VERSION}, local merge {LOCAL_MERGE_VERSION})")
+    done, failed = asyncio.run(reextract(document_ids, args.concurrency))
+    print(f"\n✅ Done: {done} re-extracted, {failed} failed")
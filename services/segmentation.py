@@ -0,0 +1,105 @@
+"""
+Split scanned bundles (several CMRs / delivery notes in one PDF) into one file per document.
+
+Two page-level signals decide where a new document starts:
+- the form number printed next to the form title (CMR / delivery note / vrachtbrief number),
+  read with tesseract;
+- the perceptual hash of the header band: first pages of the same form type look alike.
+A differing form number always starts a new document and a repeated one never does. A number
+appearing on a page whose header matches the current document's first page (which had no
+readable number) also starts one. Without a form number a page is never split off, so
+continuation pages that repeat the letterhead stay with their document.
+"""
+from app.services.dedup import dhash, hamming
+from app.services.pages import count_pages, iter_pages
+from app.services.settings import SEGMENT_DPI, SEGMENT_HEADER_DISTANCE
+import os
+import re
+
+# Top share of the page holding the form title and number
+HEADER_FRACTION = 0.2
+
+# "CMR #237029", "CMR No: 5201019", "Delivery Note Nr. 1006", "Lieferschein-Nr. 88812", "Vrachtbrief 4410".
+# A bare "No" / "Nr" is not enough: "Tel. No 0031 113 123456" is not a form number.
+FORM_NUMBER = re.compile(
+    r"\b(?:CMR|Delivery\s+Note|Lieferschein|Vrachtbrief)\b[\s.:#-]*(?:No|Nr|Nummer|Number)?\b[\s.:#-]*(\d[\d-]{3,})",
+    re.IGNORECASE
+)
+
+
+def form_number(text: str):
+    found = FORM_NUMBER.search(text or "")
+    return found.group(1).strip("-") if found else None
+
+
+def page_signals(file_path: str) -> list[dict]:
+    """Header hash and form number for every page of a PDF, rendered at low resolution."""
+    import pytesseract
+    from app.core.config import TESSERACT_PATH
+
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_PATH
+    signals = []
+    for page in iter_pages(file_path, SEGMENT_DPI, grayscale=True):
+        header = page.crop((0, 0, page.width, int(page.height * HEADER_FRACTION)))
+        signals.append({
+            'header_hash': dhash(header),
+            'form_number': form_number(pytesseract.image_to_string(header))
+        })
+    return signals
+
+
+def find_boundaries(signals: list[dict]) -> list[int]:
+    """Indexes of the pages that start a new document (always includes 0)."""
+    if not signals:
+        return []
+    starts = [0]
+    first = signals[0]
+    number = first['form_number']
+    for index, page in enumerate(signals[1:], start=1):
+        if page['form_number'] and number:
+            new_document = page['form_number'] != number
+        elif page['form_number']:
+            # A number appears on another first page of the same form type
+            new_document = hamming(page['header_hash'], first['header_hash']) <= SEGMENT_HEADER_DISTANCE
+        else:
+            new_document = False
+        if new_document:
+            starts.append(index)
+            first = page
+            number = page['form_number']
+        elif page['form_number'] and not number:
+            number = page['form_number']
+    return starts
+
+
+def split_pdf(file_path: str, starts: list[int], num_pages: int, output_dir: str) -> list[dict]:
+    """Write one PDF per segment. Returns [{'path', 'first_page', 'last_page'}] (pages 0-based)."""
+    from pypdf import PdfReader, PdfWriter
+
+    reader = PdfReader(file_path)
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    parts = []
+    for number, (first, end) in enumerate(zip(starts, starts[1:] + [num_pages]), start=1):
+        writer = PdfWriter()
+        for index in range(first, end):
+            writer.add_page(reader.pages[index])
+        path = os.path.join(output_dir, f"{stem}_part{number}.pdf")
+        with open(path, "wb") as f:
+            writer.write(f)
+        parts.append({'path': path, 'first_page': first, 'last_page': end - 1})
+    return parts
+
+
+def segment_document(file_path: str, output_dir: str) -> list[dict]:
+    """
+    Split a bundle into its documents. Images, single pages and files with one detected
+    document come back as a single part pointing at the original file.
+    """
+    num_pages = count_pages(file_path)
+    whole = [{'path': file_path, 'first_page': 0, 'last_page': num_pages - 1}]
+    if num_pages < 2:
+        return whole
+    starts = find_boundaries(page_signals(file_path))
+    if len(starts) < 2:
+        return whole
+    return split_pdf(file_path, starts, num_pages, output_dir)
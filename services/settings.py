@@ -0,0 +1,103 @@
+"""
+Service configuration, read once from the environment (and .env) on first import.
+Every backend imports its settings from here instead of calling load_dotenv() itself.
+"""
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# -------------------- CREDENTIALS --------------------
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+AZURE_ENDPOINT = os.getenv("endpoint")
+AZURE_KEY = os.getenv("key")
+# Point the Gemini clients at another endpoint, e.g. the load-test stand-in (stub_model_server.py)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+# -------------------- LOCAL TOOLS --------------------
+POPPLER_PATH = os.getenv("POPPLER_PATH", r"C:\Program Files\Poppler\poppler-24.08.0\Library\bin")
+
+# -------------------- PRE-OCR PAGE PREPARATION --------------------
+# Pages are cropped to the paper and capped at this many pixels on the long side before OCR
+PREPARE_MAX_SIDE = int(os.getenv("PREPARE_MAX_SIDE", "2400"))
+PREPARE_DPI = int(os.getenv("PREPARE_DPI", "200"))
+# Denoise / contrast / sharpen pages that are not clean scans before OCR (slow: non-local-means
+# denoising takes seconds per page). Off by default; the OCR models read unenhanced photos well.
+PREPARE_ENHANCE = os.getenv("PREPARE_ENHANCE", "0") == "1"
+
+# -------------------- ADMISSION CONTROL --------------------
+# Uploads above any of these are rejected outright (413)
+ADMISSION_MAX_PAGES = int(os.getenv("ADMISSION_MAX_PAGES", "60"))
+ADMISSION_MAX_BYTES = int(os.getenv("ADMISSION_MAX_BYTES", str(40 * 1024 * 1024)))
+ADMISSION_MAX_MEMORY_MB = int(os.getenv("ADMISSION_MAX_MEMORY_MB", "1500"))
+# Above any of these a document goes to the heavy lane
+ADMISSION_HEAVY_PAGES = int(os.getenv("ADMISSION_HEAVY_PAGES", "6"))
+ADMISSION_HEAVY_BYTES = int(os.getenv("ADMISSION_HEAVY_BYTES", str(8 * 1024 * 1024)))
+ADMISSION_HEAVY_MEMORY_MB = int(os.getenv("ADMISSION_HEAVY_MEMORY_MB", "250"))
+# Documents processed at once per lane, and the in-flight budgets shared by both lanes
+ADMISSION_LIGHT_CONCURRENCY = int(os.getenv("ADMISSION_LIGHT_CONCURRENCY", "8"))
+ADMISSION_HEAVY_CONCURRENCY = int(os.getenv("ADMISSION_HEAVY_CONCURRENCY", "1"))
+ADMISSION_MEMORY_BUDGET_MB = int(os.getenv("ADMISSION_MEMORY_BUDGET_MB", "3000"))
+ADMISSION_PAGE_BUDGET = int(os.getenv("ADMISSION_PAGE_BUDGET", "120"))
+# How long a document may wait for a slot before it is turned away (503)
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "120"))
+# Pages of one document rendered at the same time (page-parallel OCR, bundle parts); the
+# admission memory estimate assumes this many
+PAGES_IN_FLIGHT = int(os.getenv("PAGES_IN_FLIGHT", "4"))
+
+# -------------------- NEAR-DUPLICATES --------------------
+# Maximum Hamming distance (out of 64 bits) for two pages to count as the same photo.
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", "8"))
+# Maximum distance (out of 256 bits) on the finer hash that confirms a match before it is reused.
+DUPLICATE_FINE_MAX_DISTANCE = int(os.getenv("DUPLICATE_FINE_MAX_DISTANCE", "16"))
+# "flag" only records the match and processes anyway; "reuse" serves the earlier extraction
+# when the finer hash confirms the match.
+DUPLICATE_MODE = os.getenv("DUPLICATE_MODE", "flag")
+
+# -------------------- BUNDLE SEGMENTATION --------------------
+# Pages are rendered at this DPI to read the header; a page whose header hash is within this
+# distance of the current document's first page starts a new document of the same form type
+SEGMENT_DPI = int(os.getenv("SEGMENT_DPI", "100"))
+SEGMENT_HEADER_DISTANCE = int(os.getenv("SEGMENT_HEADER_DISTANCE", "10"))
+
+# -------------------- LAYOUT TEMPLATES --------------------
+# Minimum RANSAC inliers before we trust that a page really is an instance of a template.
+TEMPLATE_MIN_INLIERS = int(os.getenv("TEMPLATE_MIN_INLIERS", "40"))
+# Blank CMR (AVC 2009 layout) scanned flat and cropped to the paper edge, portrait, 150-300 DPI;
+# the template's boxes are snapped to its ruled cells. Without it no page is read by template.
+CMR_TEMPLATE_IMAGE = os.getenv("CMR_TEMPLATE_IMAGE")
+
+# -------------------- MERGE --------------------
+# Merge printed and handwritten fields locally and only send conflicts to the model (0: always use the merge LLM call)
+LOCAL_MERGE = os.getenv("LOCAL_MERGE", "1") == "1"
+
+# -------------------- FIELD VERIFICATION --------------------
+# Re-query missing / invalid / inconsistent key fields after the merge (set to 0 to disable)
+FIELD_VERIFICATION = os.getenv("FIELD_VERIFICATION", "1") == "1"
+
+# -------------------- JOB QUEUE --------------------
+# A running job whose worker has not heartbeated for this long is handed to another worker
+JOB_STALE_AFTER_SECONDS = int(os.getenv("JOB_STALE_AFTER_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF_SECONDS = int(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "30"))
+WORKER_POLL_INTERVAL_SECONDS = float(os.getenv("WORKER_POLL_INTERVAL_SECONDS", "2"))
+WORKER_HEARTBEAT_SECONDS = float(os.getenv("WORKER_HEARTBEAT_SECONDS", "15"))
+WORKER_REAP_INTERVAL_SECONDS = float(os.getenv("WORKER_REAP_INTERVAL_SECONDS", "60"))
+
+# -------------------- BATCH MODE --------------------
+# Merge requests per provider batch job, and how often pending batch jobs are polled
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "1000"))
+BATCH_POLL_INTERVAL_SECONDS = float(os.getenv("BATCH_POLL_INTERVAL_SECONDS", "60"))
+# Batch API requests are billed at this share of the online price
+BATCH_PRICE_FACTOR = float(os.getenv("BATCH_PRICE_FACTOR", "0.5"))
+
+# -------------------- MODEL CONCURRENCY --------------------
+MODEL_CONCURRENCY_INITIAL = float(os.getenv("MODEL_CONCURRENCY_INITIAL", "4"))
+MODEL_CONCURRENCY_MIN = float(os.getenv("MODEL_CONCURRENCY_MIN", "1"))
+MODEL_CONCURRENCY_MAX = float(os.getenv("MODEL_CONCURRENCY_MAX", "32"))
+# A call slower than this multiple of the baseline latency counts as a latency spike
+MODEL_LATENCY_SPIKE_FACTOR = float(os.getenv("MODEL_LATENCY_SPIKE_FACTOR", "2.5"))
+# Error rate (EWMA) above which the limit is backed off even without 429s
+MODEL_ERROR_RATE_THRESHOLD = float(os.getenv("MODEL_ERROR_RATE_THRESHOLD", "0.2"))
+# Threads for blocking model calls, including calls waiting for a limiter slot
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", "64"))
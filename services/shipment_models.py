@@ -0,0 +1,396 @@
+"""
+Typed models for the `shipment_document` schema used by the merge stage in process.py.
+
+decode_shipment() coerces the model's JSON (numbers, dates, booleans given as strings) into
+slotted dataclasses and collects field-level errors instead of raising; to_dict() / encode()
+turn the result back into plain JSON for the documents table. The per-class decoders are
+built once from the type hints, so validating a document is a flat walk with no introspection.
+"""
+from dataclasses import dataclass, field, fields
+from datetime import date
+from typing import Any, Optional, Union, get_args, get_origin, get_type_hints
+import json
+import re
+
+Number = Union[int, float]
+# "number or string" fields such as quantity ('1,00 Europallet')
+NumberOrText = Union[int, float, str]
+# Alias for classes with a field literally called `date`, which would shadow the type in its own annotation
+Date = date
+
+
+@dataclass(slots=True)
+class ContactInfo:
+    telephone: Optional[str] = None
+    email: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ConsignorSender:
+    name: Optional[str] = None
+    address: Optional[str] = None
+    city_region: Optional[str] = None
+    postcode: Optional[str] = None
+    country: Optional[str] = None
+    contact_info: Optional[ContactInfo] = None
+
+
+@dataclass(slots=True)
+class ConsigneeRecipient:
+    name: Optional[str] = None
+    address: Optional[str] = None
+    city_region: Optional[str] = None
+    postcode: Optional[str] = None
+    country: Optional[str] = None
+    place_of_delivery: Optional[str] = None
+
+
+@dataclass(slots=True)
+class Carrier:
+    name: Optional[str] = None
+    address: Optional[str] = None
+    city_region: Optional[str] = None
+    postcode: Optional[str] = None
+    country: Optional[str] = None
+
+
+@dataclass(slots=True)
+class DeliveryInformation:
+    place_of_taking_over_goods: Optional[str] = None
+    date_of_taking_over_goods: Optional[date] = None
+    expected_delivery_date: Optional[date] = None
+    order_number: Optional[str] = None
+    customer_reference: Optional[str] = None
+
+
+@dataclass(slots=True)
+class GoodsItem:
+    quantity: Optional[NumberOrText] = None
+    unit: Optional[str] = None
+    size: Optional[str] = None
+    mark_or_product_identifier: Optional[str] = None
+    description: Optional[str] = None
+    product_code: Optional[str] = None
+    origin_country_code: Optional[str] = None
+    gross_weight_kg: Optional[Number] = None
+    statistical_number: Optional[str] = None
+    product_dimensions_or_count_per_unit: Optional[str] = None
+
+
+@dataclass(slots=True)
+class GoodsDescription:
+    items: list[GoodsItem] = field(default_factory=list)
+    total_gross_weight_kg: Optional[Number] = None
+    total_pallets_stated: Optional[Number] = None
+    total_crates_stated: Optional[str] = None
+
+
+@dataclass(slots=True)
+class TransportDetails:
+    trailer_wagon_number: Optional[str] = None
+    vehicle_registration_number: Optional[str] = None
+    pallets_delivered_count: Optional[Number] = None
+
+
+@dataclass(slots=True)
+class PaymentInstructions:
+    terms: Optional[str] = None
+    location: Optional[str] = None
+    date: Optional[Date] = None
+
+
+@dataclass(slots=True)
+class SpecialAgreements:
+    reference: Optional[str] = None
+    status_changed: Optional[str] = None
+    currency: Optional[str] = None
+    document_type_code: Optional[str] = None
+    agreement_date: Optional[date] = None
+    bol_number: Optional[str] = None
+    quality_and_quantity_correct_by: Optional[str] = None
+    damaged_status: Optional[bool] = None
+    goods_received_under_discrepancy: Optional[bool] = None
+
+
+@dataclass(slots=True)
+class RemarksObservations:
+    general_remarks: Optional[str] = None
+    special_agreements_or_notes: Optional[SpecialAgreements] = None
+
+
+@dataclass(slots=True)
+class ReceptionConfirmation:
+    date_received: Optional[date] = None
+    temperature_celsius: Optional[Number] = None
+    total_cases_accepted: Optional[Number] = None
+    pallets_in: Optional[Number] = None
+    pallets_out: Optional[Number] = None
+    over_short_rejected_status: Optional[str] = None
+    scanned_status: Optional[str] = None
+    received_by_signature_name: Optional[str] = None
+    received_by_print_name: Optional[str] = None
+    receiving_signature_present: Optional[bool] = None
+
+
+@dataclass(slots=True)
+class IssuingPartyDetails:
+    issued_by_name: Optional[str] = None
+    issued_by_address: Optional[str] = None
+    issued_by_city_region: Optional[str] = None
+    issued_by_country: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ShipmentDocument:
+    document_type: Optional[str] = None
+    document_number: Optional[str] = None
+    date_of_issue: Optional[date] = None
+    consignor_sender: Optional[ConsignorSender] = None
+    consignee_recipient: Optional[ConsigneeRecipient] = None
+    carrier: Optional[Carrier] = None
+    delivery_information: Optional[DeliveryInformation] = None
+    goods_description: Optional[GoodsDescription] = None
+    transport_details: Optional[TransportDetails] = None
+    payment_instructions: Optional[PaymentInstructions] = None
+    remarks_observations: Optional[RemarksObservations] = None
+    reception_confirmation: Optional[ReceptionConfirmation] = None
+    issuing_party_details: Optional[IssuingPartyDetails] = None
+    handwritten_extras: list[Any] = field(default_factory=list)
+
+
+# -------------------- SCALAR COERCION --------------------
+class FieldError(ValueError):
+    pass
+
+
+# Schema placeholders the model sometimes echoes back instead of null
+_EMPTY = {"", "null", "none", "n/a", "na", "-", "string", "number", "boolean", "unknown"}
+_NUMBER = re.compile(r"[-+]?\d[\d.,\s]*")
+_YMD = re.compile(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})")
+# European documents: day first (02-09-2025, 2.9.25, 02/09/2025)
+_DMY = re.compile(r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{4}|\d{2})")
+_TRUE = {"true", "yes", "y", "ja", "j", "x", "1", "present", "signed"}
+_FALSE = {"false", "no", "n", "nee", "0", "absent", "not signed"}
+
+
+def _is_empty(value) -> bool:
+    return value is None or (isinstance(value, str) and value.strip().lower() in _EMPTY)
+
+
+def coerce_text(value):
+    if isinstance(value, (dict, list)):
+        raise FieldError("expected text")
+    return str(value).strip()
+
+
+def _single_separator(token: str, separator: str) -> str:
+    """
+    Only one kind of separator: groups of exactly three digits after a non-zero head are
+    thousands ('1.234', '12,500', '1.234.567'), anything else is the decimal point ('30.84', '0,500').
+    """
+    head, _, tail = token.rpartition(separator)
+    if token.count(separator) > 1 or (len(tail) == 3 and head.strip("-+").lstrip("0")):
+        return token.replace(separator, "")
+    return head + "." + tail
+
+
+def parse_number(text: str):
+    """Parse '30.84', '1,00', '1.234', '1.234,56', '130 kg' or '-1 CASE'; European decimal commas allowed."""
+    found = _NUMBER.search(text)
+    if not found:
+        raise FieldError("not a number")
+    token = re.sub(r"\s", "", found.group()).rstrip(".,")
+    if "," in token and "." in token:
+        # Whichever separator comes last is the decimal point
+        if token.rfind(",") > token.rfind("."):
+            token = token.replace(".", "").replace(",", ".")
+        else:
+            token = token.replace(",", "")
+    else:
+        for separator in ",.":
+            if separator in token:
+                token = _single_separator(token, separator)
+    number = float(token)
+    return int(number) if number.is_integer() else number
+
+
+def coerce_number(value):
+    if isinstance(value, bool):
+        raise FieldError("expected a number, got a boolean")
+    if isinstance(value, (int, float)):
+        return int(value) if isinstance(value, float) and value.is_integer() else value
+    if isinstance(value, str):
+        return parse_number(value)
+    raise FieldError("expected a number")
+
+
+def coerce_number_or_text(value):
+    if isinstance(value, str):
+        # Keep the text when a unit is embedded ('1,00 Europallet'), otherwise normalize it
+        text = value.strip()
+        try:
+            return parse_number(text) if _NUMBER.fullmatch(text) else text
+        except (FieldError, ValueError):
+            return text
+    return coerce_number(value)
+
+
+def coerce_date(value):
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, str):
+        raise FieldError("expected a date")
+    text = value.strip()
+    found = _YMD.fullmatch(text)
+    if found:
+        year, month, day = found.groups()
+    else:
+        found = _DMY.fullmatch(text)
+        if not found:
+            raise FieldError("unrecognized date format")
+        day, month, year = found.groups()
+        if len(year) == 2:
+            year = "20" + year
+    try:
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        raise FieldError("invalid calendar date")
+
+
+def coerce_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise FieldError("expected a boolean")
+
+
+# -------------------- FIELD PATHS --------------------
+def get_path(shipment: dict, path: str):
+    """Value at a dotted path ("reception_confirmation.pallets_in") of a plain shipment dict, or None."""
+    value = shipment
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def set_path(shipment: dict, path: str, value):
+    """Set a dotted path, creating (or replacing non-dict) parents on the way."""
+    *parents, leaf = path.split(".")
+    for key in parents:
+        if not isinstance(shipment.get(key), dict):
+            shipment[key] = {}
+        shipment = shipment[key]
+    shipment[leaf] = value
+
+
+# -------------------- DECODER --------------------
+_decoders = {}
+
+
+def _coercer_for(hint):
+    """Return (function, nested). Nested decoders take (value, path, errors); scalar coercers take the value."""
+    if get_origin(hint) is Union:
+        args = [a for a in get_args(hint) if a is not type(None)]
+        if set(args) == {int, float, str}:
+            return coerce_number_or_text, False
+        if set(args) == {int, float}:
+            return coerce_number, False
+        hint = args[0]
+    if hint is str:
+        return coerce_text, False
+    if hint is date:
+        return coerce_date, False
+    if hint is bool:
+        return coerce_bool, False
+    if get_origin(hint) is list:
+        (item,) = get_args(hint)
+        if item is Any:
+            return (lambda value, path, errors: value if isinstance(value, list) else [value]), True
+        decode_item = _decoder_for(item)
+
+        def decode_list(value, path, errors):
+            if not isinstance(value, list):
+                errors.append({'field': path, 'error': 'expected a list', 'value': value})
+                return []
+            return [decode_item(v, f"{path}[{i}]", errors) for i, v in enumerate(value)]
+        return decode_list, True
+    return _decoder_for(hint), True
+
+
+def _decoder_for(cls):
+    """Build (once) a decode(raw, path, errors) function for a dataclass."""
+    if cls in _decoders:
+        return _decoders[cls]
+
+    hints = get_type_hints(cls)
+    plan = [(f.name, *_coercer_for(hints[f.name])) for f in fields(cls)]
+    known = {name for name, _, _ in plan}
+
+    def decode(raw, path, errors):
+        if not isinstance(raw, dict):
+            errors.append({'field': path, 'error': 'expected an object', 'value': raw})
+            return cls()
+        values = {}
+        for name, coercer, nested in plan:
+            value = raw.get(name)
+            if nested:
+                if value is not None:
+                    values[name] = coercer(value, f"{path}.{name}", errors)
+                continue
+            if _is_empty(value):
+                continue
+            try:
+                values[name] = coercer(value)
+            except (FieldError, ValueError) as e:
+                errors.append({'field': f"{path}.{name}", 'error': str(e) or "invalid value", 'value': value})
+        for name in raw.keys() - known:
+            errors.append({'field': f"{path}.{name}", 'error': 'unexpected field', 'value': raw[name]})
+        return cls(**values)
+
+    _decoders[cls] = decode
+    return decode
+
+
+def decode_shipment(output: dict):
+    """
+    Decode merge-stage output ({"corrected_schema": {"shipment_document": {...}}}, or the
+    shipment_document object itself). Returns (ShipmentDocument or None, [field errors]).
+    """
+    errors = []
+    if not isinstance(output, dict):
+        return None, [{'field': '', 'error': 'expected an object', 'value': output}]
+    schema = output.get('corrected_schema', output)
+    if isinstance(schema, dict) and 'shipment_document' in schema:
+        raw = schema['shipment_document'] if schema['shipment_document'] is not None else {}
+        # The merge prompt asks for extras at either level
+        if isinstance(raw, dict) and 'handwritten_extras' in schema:
+            raw = {**raw}
+            raw.setdefault('handwritten_extras', schema['handwritten_extras'])
+    else:
+        raw = schema
+    if not isinstance(raw, dict):
+        return None, [{'field': 'shipment_document', 'error': 'expected an object', 'value': raw}]
+    return _decoder_for(ShipmentDocument)(raw, 'shipment_document', errors), errors
+
+
+# -------------------- ENCODER --------------------
+def to_dict(obj):
+    """Dataclass tree -> plain JSON-ready dict (dates as ISO strings)."""
+    if isinstance(obj, list):
+        return [to_dict(v) for v in obj]
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if hasattr(obj, "__dataclass_fields__"):
+        return {name: to_dict(getattr(obj, name)) for name in obj.__dataclass_fields__}
+    return obj
+
+
+def encode(obj) -> str:
+    """Compact JSON for JSONB columns."""
+    return json.dumps(obj if isinstance(obj, (dict, list)) else to_dict(obj), separators=(",", ":"), ensure_ascii=False, default=str)
@@ -0,0 +1,139 @@
+"""
+Local stand-in for the Gemini and Azure Document Intelligence REST endpoints, for load tests.
+
+Responses are canned, but latency, rate limiting (429 above a concurrency cap and at random),
+and timeouts are simulated so the adaptive limiters and retries behave as they would in production.
+
+    python -m app.services.stub_model_server --port 8090 --latency-ms 1500 --rate-429 0.02
+
+Point the service at it with GEMINI_BASE_URL=http://127.0.0.1:8090 and endpoint=http://127.0.0.1:8090/.
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import argparse
+import asyncio
+import itertools
+import json
+import random
+
+STRUCTURED_PAGE = {
+    "text": "CMR\nNo. 237029\nConsignee: Lidl GB - Exeter ROC\nPallets 52",
+    "shipment_document": {"document_type": "CMR", "document_number": "237029"}
+}
+SHIPMENT = {"shipment_document": {"document_type": "CMR", "document_number": "237029"}}
+
+
+def canned_text(prompt: str) -> str:
+    if '"text": all visible text' in prompt:
+        return json.dumps(STRUCTURED_PAGE)
+    if "plain text" in prompt:
+        return STRUCTURED_PAGE["text"]
+    if "corrected_schema" in prompt:
+        return json.dumps({"corrected_schema": SHIPMENT})
+    return json.dumps(SHIPMENT)
+
+
+def create_app(latency_ms: float = 1500, jitter: float = 0.3, rate_429: float = 0.0,
+               rate_timeout: float = 0.0, timeout_seconds: float = 60, max_concurrency: int = 0) -> FastAPI:
+    """
+    latency_ms / jitter: lognormal-ish latency around the mean; rate_429 / rate_timeout: random
+    failure shares; max_concurrency: requests beyond this many in flight get 429 (0 = no cap).
+    """
+    app = FastAPI()
+    stats = {"requests": 0, "ok": 0, "throttled": 0, "timeouts": 0, "in_flight": 0, "peak_in_flight": 0}
+    operations = {}
+    operation_ids = itertools.count(1)
+
+    async def simulate():
+        """Returns an error response, or None to answer normally."""
+        stats["requests"] += 1
+        if (max_concurrency and stats["in_flight"] >= max_concurrency) or random.random() < rate_429:
+            stats["throttled"] += 1
+            return JSONResponse(
+                {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"}},
+                status_code=429
+            )
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        try:
+            if random.random() < rate_timeout:
+                stats["timeouts"] += 1
+                await asyncio.sleep(timeout_seconds)
+                return JSONResponse({"error": {"code": 504, "message": "Deadline exceeded", "status": "DEADLINE_EXCEEDED"}}, status_code=504)
+            await asyncio.sleep(max(0.0, random.lognormvariate(0, jitter)) * latency_ms / 1000)
+        finally:
+            stats["in_flight"] -= 1
+        stats["ok"] += 1
+        return None
+
+    @app.post("/{version}/models/{model_action}")
+    async def generate_content(version: str, model_action: str, request: Request):
+        body = await request.json()
+        error = await simulate()
+        if error:
+            return error
+        prompt = " ".join(
+            part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])
+        )
+        text = canned_text(prompt)
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {
+                "promptTokenCount": len(prompt) // 4 + 258 * sum(
+                    1 for content in body.get("contents", []) for part in content.get("parts", []) if "inlineData" in part
+                ),
+                "candidatesTokenCount": len(text) // 4,
+                "totalTokenCount": len(prompt) // 4 + len(text) // 4
+            },
+            "modelVersion": model_action.split(":")[0]
+        }
+
+    @app.post("/documentintelligence/documentModels/{model_action}")
+    async def analyze(model_action: str, request: Request):
+        await request.body()
+        error = await simulate()
+        if error:
+            return error
+        model_id = model_action.split(":")[0]
+        operation_id = str(next(operation_ids))
+        operations[operation_id] = model_id
+        location = f"{request.base_url}documentintelligence/documentModels/{model_id}/analyzeResults/{operation_id}?api-version=2024-07-31-preview"
+        return JSONResponse({}, status_code=202, headers={"Operation-Location": location, "Retry-After": "0"})
+
+    @app.get("/documentintelligence/documentModels/{model_id}/analyzeResults/{operation_id}")
+    async def analyze_result(model_id: str, operation_id: str):
+        return {
+            "status": "succeeded",
+            "analyzeResult": {
+                "apiVersion": "2024-07-31-preview",
+                "modelId": operations.pop(operation_id, model_id),
+                "content": STRUCTURED_PAGE["text"],
+                "pages": [{"pageNumber": 1, "spans": [{"offset": 0, "length": len(STRUCTURED_PAGE["text"])}]}]
+            }
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stand-in Gemini / Azure endpoints for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=1500)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-timeout", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=60)
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Requests beyond this many in flight get 429 (0 = no cap)")
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(args.latency_ms, args.jitter, args.rate_429, args.rate_timeout, args.timeout_seconds, args.max_concurrency),
+        host=args.host, port=args.port, log_level="warning"
+    )
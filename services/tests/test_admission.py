@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.services import admission
+from app.services.admission import AdmissionController, check_admissible
+from app.services.worker import is_permanent_failure
+
+
+def cost(memory_mb=100, pages=2, heavy=False, size=1024):
+    return {'bytes': size, 'pages': pages, 'megapixels': 3.7, 'memory_mb': memory_mb, 'heavy': heavy}
+
+
+def controller(**overrides):
+    options = dict(light_concurrency=2, heavy_concurrency=1, memory_budget_mb=1000, page_budget=20, queue_timeout=0.1)
+    return AdmissionController(**{**options, **overrides})
+
+
+def test_idle_controller_admits_anything_within_its_lane():
+    assert controller()._fits(cost(memory_mb=5000, pages=50))
+
+
+def test_lane_concurrency():
+    ctl = controller()
+    ctl.running = {False: 2, True: 0}
+    assert not ctl._fits(cost())
+    assert ctl._fits(cost(heavy=True))
+    ctl.running = {False: 0, True: 1}
+    assert not ctl._fits(cost(heavy=True))
+
+
+def test_shared_memory_and_page_budgets():
+    ctl = controller()
+    ctl.running = {False: 0, True: 1}
+    ctl.memory_mb, ctl.pages = 900, 10
+    assert ctl._fits(cost(memory_mb=100, pages=10))
+    assert not ctl._fits(cost(memory_mb=101))
+    assert not ctl._fits(cost(pages=11))
+
+
+def test_queue_timeout_is_a_503():
+    ctl = controller(light_concurrency=1)
+
+    async def main():
+        async with ctl.admit(cost()):
+            with pytest.raises(HTTPException) as raised:
+                async with ctl.admit(cost()):
+                    pass
+        return raised.value
+
+    error = asyncio.run(main())
+    assert error.status_code == 503
+    assert ctl.snapshot() == {'light_running': 0, 'heavy_running': 0, 'waiting': 0, 'memory_mb': 0.0, 'pages': 0}
+
+
+def test_hard_limits_are_a_413(monkeypatch):
+    monkeypatch.setattr(admission.settings, "ADMISSION_MAX_PAGES", 10)
+    check_admissible(cost(pages=10))
+    with pytest.raises(HTTPException) as raised:
+        check_admissible(cost(pages=11))
+    assert raised.value.status_code == 413
+
+
+def test_nested_admission_passes_through(monkeypatch):
+    ctl = controller(light_concurrency=1)
+    monkeypatch.setattr(admission, "controller", lambda: ctl)
+    monkeypatch.setattr(admission, "estimate_cost", lambda file_path: cost())
+
+    async def main():
+        async with admission.admit("bundle.pdf") as outer:
+            # A part of the bundle would otherwise wait for the bundle's own slot and time out
+            async with admission.admit("bundle_part1.pdf") as inner:
+                return outer, inner, ctl.snapshot()['light_running']
+
+    outer, inner, running = asyncio.run(main())
+    assert outer == cost() and inner is None and running == 1
+
+
+def test_only_client_errors_are_permanent():
+    assert is_permanent_failure(HTTPException(status_code=413, detail="too large"))
+    assert not is_permanent_failure(HTTPException(status_code=503, detail="busy"))
+    assert not is_permanent_failure(RuntimeError("model timeout"))
@@ -0,0 +1,121 @@
+import json
+from types import SimpleNamespace
+
+from app.services import batch, clients
+from app.services.batch import (
+    FAILED, RUNNING, SUCCEEDED, GeminiBatchService, LocalBatchService, apply_results, submit_backlog, wait_for_batches
+)
+
+BATCH = {'id': 7, 'model': 'gemini-2.5-flash', 'merge_version': 'abc123def456'}
+
+
+def stored(document_id: str) -> dict:
+    return {
+        'id': document_id,
+        'properties': {'merge_version': 'old'},
+        'state': {'ocr_completed': True, 'gpt_extraction_completed': True, 'processing_completed': True},
+        'extracted_data': {'gpt_extraction_output': {'corrected_schema': {'shipment_document': {'document_number': '1'}}}}
+    }
+
+
+def answer(prompt: str) -> str:
+    if "BROKEN" in prompt:
+        return "not json"
+    return json.dumps({'corrected_schema': {'shipment_document': {'document_number': '237029', 'date_of_issue': '02-09-2025'}}})
+
+
+def run_local(service, prompts):
+    name = service.submit(BATCH['model'], prompts, "merge-test")
+    states = [service.state(name)]
+    while states[-1] == RUNNING:
+        states.append(service.state(name))
+    return name, states
+
+
+def test_local_service_reports_running_until_done():
+    service = LocalBatchService(answer, polls_until_done=3)
+    name, states = run_local(service, ["a", "b"])
+    assert states == [RUNNING, RUNNING, SUCCEEDED]
+    assert len(service.results(name)) == 2
+    assert service.state("local-batches/unknown") == FAILED
+
+
+def test_local_service_without_responder_is_a_dry_run():
+    assert LocalBatchService().dry_run
+    assert not LocalBatchService(answer).dry_run
+    assert not GeminiBatchService.dry_run
+
+
+def test_apply_results_writes_typed_output_in_order():
+    service = LocalBatchService(answer)
+    name, _ = run_local(service, ["merge a", "merge BROKEN b"])
+    items = {0: "ds/a.pdf", 1: "ds/b.pdf"}
+    documents = {d: stored(d) for d in items.values()}
+
+    updated, errors, usages = apply_results(BATCH, items, service.results(name), documents)
+
+    first, second = updated
+    assert first['properties']['merge_version'] == BATCH['merge_version']
+    assert first['properties']['batch_id'] == 7
+    shipment = first['extracted_data']['gpt_extraction_output']['corrected_schema']['shipment_document']
+    assert shipment['date_of_issue'] == "2025-09-02"
+    # An unparseable answer keeps the stored extraction and version, so the row is selected again
+    assert second['properties']['merge_version'] == 'old'
+    assert second['properties']['reextract_error']
+    assert second['extracted_data']['gpt_extraction_output'] == stored("ds/b.pdf")['extracted_data']['gpt_extraction_output']
+    assert errors == {1: second['properties']['reextract_error']}
+    assert set(usages) == set(items.values())
+
+
+def test_apply_results_replaces_merge_state_of_a_local_merge():
+    service = LocalBatchService(answer)
+    name, _ = run_local(service, ["merge a"])
+    data = stored("ds/a.pdf")
+    data['properties']['merge_mode'] = "local"
+    data['extracted_data'].update(merge_conflicts=[], verified_fields=[{'field': 'document_number'}])
+
+    (updated,), errors, _ = apply_results(BATCH, {0: "ds/a.pdf"}, service.results(name), {"ds/a.pdf": data})
+
+    assert errors == {}
+    assert updated['properties']['merge_mode'] == "llm"
+    assert updated['extracted_data']['merge_conflicts'] is None
+    assert updated['extracted_data']['verified_fields'] == []
+
+
+def test_dry_run_writes_no_batch_rows(monkeypatch):
+    def no_database():
+        raise AssertionError("dry run touched the database")
+
+    monkeypatch.setattr(batch, "get_db_connection", no_database)
+    monkeypatch.setattr(batch, "pending_in_batches", lambda service, ids: set())
+    monkeypatch.setattr(batch, "load_ocr_texts", lambda ids, kind: {d: "text" for d in ids})
+    monkeypatch.setattr(batch, "load_printed_fields", lambda ids: {})
+    monkeypatch.setattr(batch, "fetch_documents", lambda ids: {d: stored(d) for d in ids})
+    monkeypatch.setattr(batch, "save_documents", lambda documents: no_database())
+
+    service = LocalBatchService()
+    assert submit_backlog(service, ["ds/a.pdf", "ds/b.pdf", "ds/c.pdf"], batch_size=2) == [1, 2]
+    wait_for_batches(service, interval=0)
+    assert {record['status'] for record in service.batches.values()} == {SUCCEEDED}
+
+
+def test_apply_results_reports_missing_items():
+    def failing(prompt):
+        raise RuntimeError("provider error")
+
+    service = LocalBatchService(failing)
+    name, _ = run_local(service, ["merge a"])
+    items = {0: "ds/a.pdf", 1: "ds/b.pdf", 2: "ds/gone.pdf"}
+    updated, errors, _ = apply_results(BATCH, items, service.results(name), {"ds/b.pdf": stored("ds/b.pdf")})
+
+    assert updated == []
+    assert errors == {0: "provider error", 1: "no response returned", 2: "no response returned"}
+
+
+def test_gemini_results_without_inlined_responses(monkeypatch):
+    job = SimpleNamespace(dest=SimpleNamespace(inlined_responses=None))
+    fake = SimpleNamespace(batches=SimpleNamespace(get=lambda name: job))
+    monkeypatch.setattr(clients, "gemini_client", lambda: fake)
+    assert GeminiBatchService().results("batches/1") == []
+    job.dest = None
+    assert GeminiBatchService().results("batches/1") == []
@@ -0,0 +1,23 @@
+from app.services.bench_import import direct_imports
+
+# -X importtime order: children before their parent, two more spaces per level
+IMPORTS = [
+    (900, " site"),
+    (40, " app"),
+    (60, " app.services"),
+    (300, "     google.protobuf"),
+    (5000, "   app.services.clients"),
+    (700, "   app.services.settings"),
+    (8000, " app.services.process"),
+]
+
+
+def test_direct_imports_of_the_target_module():
+    assert direct_imports(IMPORTS, "app.services.process") == [
+        (5000, "app.services.clients"), (700, "app.services.settings")
+    ]
+
+
+def test_direct_imports_of_a_nested_module():
+    assert direct_imports(IMPORTS, "app.services.clients") == [(300, "google.protobuf")]
+    assert direct_imports(IMPORTS, "json") == []
@@ -0,0 +1,123 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import pytest
+
+from app.services.concurrency import AdaptiveLimiter, is_throttle_error, to_model_thread
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        super().__init__(f"{code} error")
+        self.code = code
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class Response:
+    status_code = 429
+
+
+class HTTPStatusError(Exception):
+    response = Response()
+
+
+def test_throttle_errors_by_status_or_type():
+    assert is_throttle_error(APIError(429))
+    assert is_throttle_error(ResourceExhausted("quota"))
+    assert is_throttle_error(HTTPStatusError())
+    assert not is_throttle_error(APIError(500))
+    # A 429 somewhere in the message (an order number, a page count) is not a throttle
+    assert not is_throttle_error(ValueError("order 4290 not found"))
+
+
+def test_ok_calls_grow_the_limit_additively():
+    limiter = AdaptiveLimiter("test", initial=2, max_limit=4)
+    # About one more slot per limit's worth (two) of completions
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release(0.1, "ok")
+    assert 2.8 < limiter.limit < 3
+    for _ in range(50):
+        limiter.acquire()
+        limiter.release(0.1, "ok")
+    assert limiter.limit == 4
+
+
+def test_throttle_halves_the_limit_once_per_congestion_window():
+    limiter = AdaptiveLimiter("test", initial=8, min_limit=1)
+    limiter.acquire()
+    limiter.release(0.1, "ok")
+    limiter.acquire()
+    limiter.release(0.1, "throttled")
+    assert limiter.limit == pytest.approx(4.06, abs=0.01)
+    # A second 429 from the same burst is not counted again
+    limiter.acquire()
+    limiter.release(0.1, "throttled")
+    assert limiter.decreases == 1
+
+
+def test_limit_never_drops_below_the_minimum():
+    limiter = AdaptiveLimiter("test", initial=2, min_limit=1)
+    for _ in range(5):
+        limiter._last_decrease = 0
+        limiter.acquire()
+        limiter.release(0.1, "throttled")
+    assert limiter.limit == 1
+
+
+def test_slot_blocks_beyond_the_limit():
+    limiter = AdaptiveLimiter("test", initial=1, max_limit=1)
+    limiter.acquire()
+    entered = threading.Event()
+
+    def second():
+        with limiter.slot():
+            entered.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not entered.wait(0.1)
+    limiter.release(0.1, "ok")
+    assert entered.wait(1)
+    thread.join()
+    assert limiter.snapshot()['in_flight'] == 0
+
+
+def test_slot_reports_the_outcome():
+    limiter = AdaptiveLimiter("test", initial=4)
+    with pytest.raises(ResourceExhausted):
+        with limiter.slot():
+            raise ResourceExhausted()
+    with pytest.raises(ValueError):
+        with limiter.slot():
+            raise ValueError()
+    snapshot = limiter.snapshot()
+    assert (snapshot['throttled'], snapshot['errors'], snapshot['in_flight']) == (1, 1, 0)
+
+
+def test_waiting_model_calls_leave_the_default_executor_free():
+    limiter = AdaptiveLimiter("test", initial=1, max_limit=1)
+    limiter.acquire()
+    stage = contextvars.ContextVar("stage")
+
+    def blocked_call():
+        with limiter.slot():
+            return stage.get()
+
+    async def main():
+        stage.set("merge")
+        waiting = [asyncio.ensure_future(to_model_thread(blocked_call)) for _ in range(40)]
+        await asyncio.sleep(0.05)
+        # The default executor still runs (a DB save, a heartbeat) while 40 calls wait for the limiter
+        started = time.monotonic()
+        await asyncio.wait_for(asyncio.to_thread(time.sleep, 0), 1)
+        assert time.monotonic() - started < 1
+        limiter.release(0.1, "ok")
+        return await asyncio.gather(*waiting)
+
+    assert asyncio.run(main()) == ["merge"] * 40
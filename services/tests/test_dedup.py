@@ -0,0 +1,67 @@
+import random
+
+from PIL import Image, ImageDraw
+
+from app.services.dedup import FINE_HASH_SIZE, HASH_BANDS, _to_signed, band_neighbours, dhash, hamming, hash_bands
+
+
+def page(shift: int = 0, mark: bool = False):
+    img = Image.new("L", (400, 560), 255)
+    draw = ImageDraw.Draw(img)
+    for row in range(8):
+        draw.rectangle((40 + shift, 60 + row * 60, 300 + shift, 80 + row * 60), fill=0)
+    if mark:
+        draw.rectangle((200, 300, 380, 540), fill=0)
+    return img
+
+
+def test_hamming():
+    assert hamming(0, 0) == 0
+    assert hamming(0b1011, 0b0001) == 2
+    assert hamming(0, (1 << 64) - 1) == 64
+
+
+def test_hamming_accepts_stored_signed_values():
+    value = (1 << 63) | 5
+    assert hamming(_to_signed(value), value) == 0
+    assert hamming(_to_signed(value), value ^ 1) == 1
+
+
+def test_hamming_wider_hashes():
+    assert hamming(0, (1 << 256) - 1, bits=256) == 256
+    assert hamming(0, (1 << 256) - 1) == 64
+
+
+def test_dhash_is_stable_under_rescaling():
+    original = page()
+    assert hamming(dhash(original), dhash(original.resize((200, 280)))) <= 4
+
+
+def test_dhash_separates_different_pages():
+    assert hamming(dhash(page()), dhash(page(mark=True))) > 8
+
+
+def test_fine_hash_size():
+    fine = dhash(page(), FINE_HASH_SIZE)
+    assert fine < 1 << (FINE_HASH_SIZE * FINE_HASH_SIZE)
+    assert hamming(fine, dhash(page(mark=True), FINE_HASH_SIZE), bits=256) > 16
+
+
+def test_band_neighbours():
+    assert band_neighbours(5, 0) == [5]
+    assert len(band_neighbours(5, 2)) == 1 + 16 + 120
+    assert all(hamming(5, value, 16) <= 2 for value in band_neighbours(5, 2))
+
+
+def test_close_hashes_share_a_band_lookup():
+    rng = random.Random(7)
+    for max_distance in (4, 8, 12):
+        radius = max_distance // HASH_BANDS
+        for _ in range(200):
+            value = rng.getrandbits(64)
+            other = value
+            for bit in rng.sample(range(64), max_distance):
+                other ^= 1 << bit
+            assert any(
+                band in band_neighbours(stored, radius) for band, stored in zip(hash_bands(value), hash_bands(other))
+            )
@@ -0,0 +1,72 @@
+from app.services.field_verification import (
+    SNIPPET_MAX_LINES, build_verify_prompt, find_suspect_fields, inconsistent_fields, relevant_lines
+)
+
+
+def output(shipment: dict) -> dict:
+    return {'corrected_schema': {'shipment_document': shipment}}
+
+
+COMPLETE = {'document_number': '237029', 'date_of_issue': '2025-09-02'}
+
+
+def test_pallet_counts_above_the_stated_total():
+    shipment = {
+        'goods_description': {'total_pallets_stated': 26},
+        'reception_confirmation': {'pallets_in': 62, 'pallets_out': 26}
+    }
+    assert inconsistent_fields(shipment) == {
+        'reception_confirmation.pallets_in': "more than total_pallets_stated (26)"
+    }
+    # Without a stated total there is nothing to compare against
+    assert inconsistent_fields({'reception_confirmation': {'pallets_in': 62}}) == {}
+
+
+def test_names_and_numbers_that_contradict_each_other():
+    shipment = {
+        'document_number': '4410',
+        'delivery_information': {'order_number': '4410'},
+        'reception_confirmation': {'received_by_print_name': 'J. Witczak', 'received_by_signature_name': 'Smith'}
+    }
+    assert set(inconsistent_fields(shipment)) == {'document_number', 'reception_confirmation.received_by_print_name'}
+    shipment['reception_confirmation']['received_by_signature_name'] = 'Witczak'
+    assert set(inconsistent_fields(shipment)) == {'document_number'}
+
+
+def test_only_required_fields_are_asked_again_when_empty():
+    assert find_suspect_fields(output({'document_number': None}), []) == {
+        'document_number': "missing", 'date_of_issue': "missing"
+    }
+    # Optional key fields may stay blank
+    assert find_suspect_fields(output({**COMPLETE, 'delivery_information': {'order_number': None}}), []) == {}
+
+
+def test_validation_errors_on_key_fields_are_suspect():
+    errors = [
+        {'field': 'shipment_document.reception_confirmation.pallets_in', 'error': 'not a number'},
+        {'field': 'shipment_document.carrier.name', 'error': 'unexpected field'}
+    ]
+    assert find_suspect_fields(output(COMPLETE), errors) == {
+        'reception_confirmation.pallets_in': "invalid: not a number"
+    }
+
+
+def test_relevant_lines_keeps_matches_with_context():
+    text = "Sender\nLidl GB\n\nPallets received: 24\nSignature\nStamp\nNotes"
+    assert relevant_lines(text, [r"pallet"]) == "Lidl GB\nPallets received: 24\nSignature"
+    assert relevant_lines(text, []) == ""
+    many = "\n".join(f"pallet {i}" for i in range(100))
+    assert len(relevant_lines(many, [r"pallet"]).splitlines()) == SNIPPET_MAX_LINES
+
+
+def test_build_verify_prompt_sends_excerpts_around_labels_and_value():
+    computerized = "Carrier: DHL\nCMR No. 237029\nWeight 1200 kg\nOrder 55120"
+    handwritten = "Received 24 pallets\nTrailer 3815803\nremark 237O29 smudged"
+    prompt = build_verify_prompt(
+        {'document_number': "missing"}, computerized, handwritten, {'document_number': '237O29'}
+    )
+    assert '"document_number"' in prompt
+    assert "CMR No. 237029" in prompt
+    # The line holding the current (misread) value is sent too, unrelated lines are not
+    assert "remark 237O29 smudged" in prompt
+    assert "Received 24 pallets" not in prompt
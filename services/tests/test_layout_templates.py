@@ -0,0 +1,87 @@
+import random
+
+import cv2
+import numpy as np
+import pytest
+
+from app.services import layout_templates
+from app.services.layout_templates import CMR_AVC_2009, align_to_template, crop_regions, ruled_cells
+
+WIDTH, HEIGHT = 1240, 1754
+
+
+def printed_box(box):
+    """Where a nominal box lands on this print run: wider margins than the template assumes."""
+    x0, y0, x1, y1 = box
+    def x(v): return 0.08 + (v - 0.05) * 0.84 / 0.90
+    def y(v): return 0.06 + (v - 0.04) * 0.88 / 0.92
+    return x(x0), y(y0), x(x1), y(y1)
+
+
+def pixels(box):
+    x0, y0, x1, y1 = box
+    return int(x0 * WIDTH), int(y0 * HEIGHT), int(x1 * WIDTH), int(y1 * HEIGHT)
+
+
+def blank_form():
+    """Ruled CMR-like form with box titles and printed filler, so ORB has something to match."""
+    rng = random.Random(3)
+    img = np.full((HEIGHT, WIDTH), 255, np.uint8)
+    for region in CMR_AVC_2009["regions"]:
+        x0, y0, x1, y1 = pixels(printed_box(region["box"]))
+        cv2.rectangle(img, (x0, y0), (x1, y1), 0, 3)
+        cv2.putText(img, region["name"][:14], (x0 + 8, y0 + 24), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 2)
+        for line in range(1, max(2, (y1 - y0) // 40)):
+            filler = "".join(rng.choice("ABCDEFGHKLMNPRSTUVWXYZ0123456789") for _ in range(rng.randint(5, 12)))
+            cv2.putText(img, filler, (x0 + 12, y0 + 30 + line * 32), cv2.FONT_HERSHEY_PLAIN, 1.4, 0, 2)
+    return img
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = str(tmp_path / "cmr_reference.png")
+    cv2.imwrite(path, blank_form())
+    template = {**CMR_AVC_2009, "name": "cmr_synthetic", "reference_image": path}
+    yield template
+    layout_templates._reference_features.pop("cmr_synthetic", None)
+
+
+def test_ruled_cells_find_the_printed_boxes():
+    cells = ruled_cells(blank_form())
+    expected = printed_box(CMR_AVC_2009["regions"][0]["box"])
+    assert any(np.allclose(cell, expected, atol=0.01) for cell in cells)
+
+
+def test_photographed_page_is_aligned_and_cropped_by_region(template):
+    page = cv2.cvtColor(blank_form(), cv2.COLOR_GRAY2BGR)
+    boxes = {region["name"]: region["box"] for region in CMR_AVC_2009["regions"]}
+    x0, y0, x1, y1 = pixels(printed_box(boxes["box_24_goods_received"]))
+    # A "signature" in box 24 of the filled form
+    cv2.circle(page, ((x0 + x1) // 2, (y0 + y1) // 2 + 20), 50, (0, 0, 0), -1)
+
+    # Photographed: smaller, turned and in perspective on a darker table
+    corners = np.float32([[0, 0], [WIDTH, 0], [WIDTH, HEIGHT], [0, HEIGHT]])
+    target = np.float32([[120, 90], [1040, 140], [1010, 1460], [90, 1420]])
+    photo = cv2.warpPerspective(
+        page, cv2.getPerspectiveTransform(corners, target), (1150, 1560), borderValue=(90, 80, 70)
+    )
+
+    aligned, inliers = align_to_template(photo, template)
+    assert aligned is not None and inliers >= layout_templates.MIN_INLIERS
+
+    crops = crop_regions(aligned, template, handwritten=True)
+    assert set(crops) == {r["name"] for r in CMR_AVC_2009["regions"] if r["handwritten"]}
+
+    def ink(crop):
+        # Ignore the box's own ruling along the edges
+        inner = crop[8:-8, 8:-8]
+        return float((cv2.cvtColor(inner, cv2.COLOR_BGR2GRAY) < 128).mean())
+
+    # Only box 24 holds the signature on top of its printed filler
+    assert ink(crops["box_24_goods_received"]) > ink(crops["box_23_carrier_signature"]) + 0.1
+    # The crop is the printed box, not the nominal one
+    h, w = aligned.shape[:2]
+    expected = printed_box(boxes["box_24_goods_received"])
+    crop_h, crop_w = crops["box_24_goods_received"].shape[:2]
+    assert abs(crop_w / w - (expected[2] - expected[0])) < 0.01
+    assert abs(crop_h / h - (expected[3] - expected[1])) < 0.01
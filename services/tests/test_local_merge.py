@@ -0,0 +1,98 @@
+from app.services.batch import merge_locally
+from app.services.local_merge import combine_pages, merge_fields
+from app.services.process import LOCAL_MERGE_VERSION, MERGE_VERSION, merge_version_for
+
+
+def test_one_sided_values_are_taken_as_is():
+    merged, extras, conflicts = merge_fields(
+        {'document_number': '237029'},
+        {'reception_confirmation': {'pallets_in': '26'}}
+    )
+    assert merged['document_number'] == '237029'
+    assert merged['reception_confirmation']['pallets_in'] == '26'
+    assert (extras, conflicts) == ([], {})
+
+
+def test_equal_values_keep_the_printed_spelling():
+    merged, _, conflicts = merge_fields(
+        {'date_of_issue': '2025-09-02', 'consignee_recipient': {'name': 'Lidl GB - Exeter'}},
+        {'date_of_issue': '02.09.2025', 'consignee_recipient': {'name': 'LIDL GB Exeter'}}
+    )
+    assert merged['date_of_issue'] == '2025-09-02'
+    assert merged['consignee_recipient']['name'] == 'Lidl GB - Exeter'
+    assert conflicts == {}
+
+
+def test_handwritten_sections_override_printed_values():
+    merged, _, conflicts = merge_fields(
+        {'reception_confirmation': {'pallets_in': 26}},
+        {'reception_confirmation': {'pallets_in': 24}}
+    )
+    assert merged['reception_confirmation']['pallets_in'] == 24
+    assert conflicts == {}
+
+
+def test_printed_parties_win_and_handwriting_becomes_an_extra():
+    merged, extras, conflicts = merge_fields(
+        {'document_number': '237029'},
+        {'document_number': '237028', 'handwritten_extras': ['see remarks']}
+    )
+    assert merged['document_number'] == '237029'
+    assert extras == [{'field': 'document_number', 'handwritten': '237028'}, 'see remarks']
+    assert conflicts == {}
+
+
+def test_truncated_reading_keeps_the_longer_value():
+    merged, _, conflicts = merge_fields(
+        {'delivery_information': {'place_of_taking_over_goods': 'Venlo'}},
+        {'delivery_information': {'place_of_taking_over_goods': 'Venlo NL warehouse 3'}}
+    )
+    assert merged['delivery_information']['place_of_taking_over_goods'] == 'Venlo NL warehouse 3'
+    assert conflicts == {}
+
+
+def test_undecidable_values_are_conflicts():
+    merged, _, conflicts = merge_fields(
+        {'delivery_information': {'order_number': '5501234'}},
+        {'delivery_information': {'order_number': '7700001'}}
+    )
+    assert conflicts == {'delivery_information.order_number': ('5501234', '7700001')}
+    assert merged['delivery_information']['order_number'] == '5501234'
+
+
+def test_combine_pages_first_value_wins_and_items_append():
+    combined = combine_pages([
+        {'document_number': '237029', 'goods_description': {'items': [{'marks': 'A'}]}},
+        None,
+        {'document_number': '999', 'date_of_issue': '2025-09-02', 'goods_description': {'items': [{'marks': 'B'}]}},
+    ])
+    assert combined['document_number'] == '237029'
+    assert combined['date_of_issue'] == '2025-09-02'
+    assert combined['goods_description']['items'] == [{'marks': 'A'}, {'marks': 'B'}]
+
+
+def test_local_merges_have_their_own_version():
+    assert LOCAL_MERGE_VERSION != MERGE_VERSION
+    assert merge_version_for("local") == merge_version_for("local+llm") == LOCAL_MERGE_VERSION
+    assert merge_version_for("llm") == MERGE_VERSION
+
+
+def test_batch_merges_conflict_free_documents_locally():
+    handwritten = {
+        'ds/a.pdf': '{"shipment_document": {"reception_confirmation": {"pallets_in": 24}}}',
+        'ds/b.pdf': '{"shipment_document": {"delivery_information": {"order_number": "7700001"}}}',
+        'ds/c.pdf': 'not json',
+        'ds/d.pdf': '{"shipment_document": {}}',
+    }
+    printed_fields = {
+        'ds/a.pdf': [{'document_number': '237029'}],
+        'ds/b.pdf': [{'delivery_information': {'order_number': '5501234'}}],
+        'ds/c.pdf': [{'document_number': '1'}],
+        'ds/d.pdf': [None],
+    }
+    merged = merge_locally(list(handwritten), handwritten, printed_fields)
+
+    assert list(merged) == ['ds/a.pdf']
+    shipment = merged['ds/a.pdf']['corrected_schema']['shipment_document']
+    assert shipment['document_number'] == '237029'
+    assert shipment['reception_confirmation']['pallets_in'] == 24
@@ -0,0 +1,15 @@
+from app.services.ocr_store import HANDWRITTEN, PRINTED, PRINTED_FIELDS, search_text
+
+
+def test_handwritten_json_indexes_values_only():
+    text = '```json\n{"reception_confirmation": {"pallets_in": 24, "remarks": null, "signed": true}, "driver": "Witczak", "seals": ["3815803", ""]}\n```'
+    assert search_text(HANDWRITTEN, text).split("\n") == ["24", "Witczak", "3815803"]
+
+
+def test_handwritten_text_that_is_not_json_is_kept():
+    assert search_text(HANDWRITTEN, "pallets 24 {damaged") == "pallets 24 {damaged"
+
+
+def test_printed_text_is_kept_and_printed_fields_are_not_searched():
+    assert search_text(PRINTED, "CMR No. 237029") == "CMR No. 237029"
+    assert search_text(PRINTED_FIELDS, '{"document_number": "237029"}') == ""
@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.services.preprocessing import deskew, detect_document_quad, is_clean_page
+
+# Where the synthetic page lands in the synthetic photo (top-left, top-right, bottom-right, bottom-left)
+PHOTO_CORNERS = np.float32([[180, 120], [1020, 170], [990, 1300], [140, 1240]])
+
+
+def page():
+    """White page with twelve 600 px wide black bars standing in for text lines."""
+    img = np.full((1000, 800), 255, np.uint8)
+    for row in range(12):
+        cv2.rectangle(img, (100, 100 + row * 60), (700, 120 + row * 60), 0, -1)
+    return img
+
+
+def rotate(img, angle: float):
+    h, w = img.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, matrix, (w, h), borderValue=255)
+
+
+def longest_ink_row(img) -> int:
+    return int((img < 128).sum(axis=1).max())
+
+
+@pytest.mark.parametrize("angle", [-8, -5, 5, 8])
+def test_deskew_straightens_both_directions(angle):
+    skewed = rotate(page(), angle)
+    assert longest_ink_row(skewed) < 400
+    # Level again: one row runs along a whole bar
+    assert longest_ink_row(deskew(skewed)) >= 590
+
+
+def test_deskew_leaves_straight_and_steep_pages():
+    straight = page()
+    assert deskew(straight) is straight
+    steep = rotate(page(), 20)
+    assert deskew(steep) is steep
+
+
+def test_detect_document_quad_finds_the_paper_in_a_photo():
+    source = np.float32([[0, 0], [799, 0], [799, 999], [0, 999]])
+    matrix = cv2.getPerspectiveTransform(source, PHOTO_CORNERS)
+    photo = cv2.warpPerspective(
+        cv2.cvtColor(page(), cv2.COLOR_GRAY2BGR), matrix, (1200, 1400), borderValue=(60, 50, 40)
+    )
+    quad = detect_document_quad(photo)
+    assert quad is not None
+    assert np.abs(quad - PHOTO_CORNERS).max() < 15
+
+
+def test_detect_document_quad_keeps_a_scan():
+    assert detect_document_quad(cv2.cvtColor(page(), cv2.COLOR_GRAY2BGR)) is None
+
+
+def test_is_clean_page():
+    assert is_clean_page(page())
+    # Grey paper, faint ink: a dim photo that still needs enhancement
+    assert not is_clean_page((page() * 0.25 + 110).astype(np.uint8))
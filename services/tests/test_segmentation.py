@@ -0,0 +1,58 @@
+import pytest
+
+from app.services.segmentation import find_boundaries, form_number
+
+LETTERHEAD = 0x0F0F0F0F0F0F0F0F
+OTHER = ~LETTERHEAD & 0xFFFFFFFFFFFFFFFF
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("CMR #237029", "237029"),
+    ("CMR No: 5201019", "5201019"),
+    ("Delivery Note Nr. 1006", "1006"),
+    ("Lieferschein-Nr. 88812", "88812"),
+    ("VRACHTBRIEF 4410", "4410"),
+    ("International consignment note\nCMR\nNo. 2024-117-", "2024-117"),
+])
+def test_form_number(text, expected):
+    assert form_number(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Tel. No 0031 113 123456",
+    "Nr. 1006",
+    "Order number 5501234",
+    "",
+    None,
+])
+def test_form_number_needs_a_form_label(text):
+    assert form_number(text) is None
+
+
+def page(header_hash, number=None):
+    return {'header_hash': header_hash, 'form_number': number}
+
+
+def test_no_pages():
+    assert find_boundaries([]) == []
+
+
+def test_differing_numbers_split():
+    assert find_boundaries([page(LETTERHEAD, "1001"), page(LETTERHEAD, "1002"), page(OTHER, "1003")]) == [0, 1, 2]
+
+
+def test_repeated_number_never_splits():
+    assert find_boundaries([page(LETTERHEAD, "1001"), page(LETTERHEAD, "1001")]) == [0]
+
+
+def test_continuation_pages_sharing_the_letterhead_stay_together():
+    assert find_boundaries([page(LETTERHEAD, "1001"), page(LETTERHEAD), page(LETTERHEAD)]) == [0]
+
+
+def test_number_appearing_on_a_matching_header_splits():
+    assert find_boundaries([page(LETTERHEAD), page(OTHER), page(LETTERHEAD, "1002")]) == [0, 2]
+
+
+def test_number_on_a_continuation_page_is_adopted():
+    # The first page's number was unreadable; page 2 shows it, page 3 is the next form
+    assert find_boundaries([page(LETTERHEAD), page(OTHER, "1001"), page(LETTERHEAD, "1002")]) == [0, 2]
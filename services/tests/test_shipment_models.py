@@ -0,0 +1,83 @@
+from datetime import date
+
+import pytest
+
+from app.services.process import validate_output
+from app.services.shipment_models import FieldError, coerce_date, decode_shipment, parse_number
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("30.84", 30.84),
+    ("1,00", 1),
+    ("1.234", 1234),
+    ("1.234.567", 1234567),
+    ("12,500", 12500),
+    ("1,234,567", 1234567),
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("0,500", 0.5),
+    ("0.500", 0.5),
+    ("130 kg", 130),
+    ("-1 CASE", -1),
+    ("-1.234", -1234),
+])
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
+
+
+def test_parse_number_rejects_text():
+    with pytest.raises(FieldError):
+        parse_number("Europallet")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2025-09-02", date(2025, 9, 2)),
+    ("2025/9/2", date(2025, 9, 2)),
+    ("02-09-2025", date(2025, 9, 2)),
+    ("2.9.25", date(2025, 9, 2)),
+    ("02/09/2025", date(2025, 9, 2)),
+])
+def test_coerce_date(text, expected):
+    assert coerce_date(text) == expected
+
+
+@pytest.mark.parametrize("text", ["31-02-2025", "next tuesday", "2025-13-01"])
+def test_coerce_date_rejects(text):
+    with pytest.raises(FieldError):
+        coerce_date(text)
+
+
+def test_decode_collects_errors_instead_of_raising():
+    shipment, errors = decode_shipment({'corrected_schema': {'shipment_document': {
+        'document_number': 237029,
+        'date_of_issue': 'yesterday',
+        'colour': 'blue'
+    }}})
+    assert shipment.document_number == "237029"
+    assert shipment.date_of_issue is None
+    assert {e['field'] for e in errors} == {'shipment_document.date_of_issue', 'shipment_document.colour'}
+
+
+@pytest.mark.parametrize("value", ["x", [1, 2], 237029])
+def test_decode_rejects_a_shipment_document_that_is_not_an_object(value):
+    output = {'corrected_schema': {'shipment_document': value, 'handwritten_extras': []}}
+    shipment, errors = decode_shipment(output)
+    assert shipment is None
+    assert errors == [{'field': 'shipment_document', 'error': 'expected an object', 'value': value}]
+    assert validate_output(output) == (output, errors)
+
+
+def test_validate_output_keeps_dropped_values():
+    raw = {'shipment_document': {'date_of_issue': 'yesterday', 'colour': 'blue'}}
+    normalized, errors = validate_output({'corrected_schema': raw})
+    assert errors
+    assert normalized['raw_schema'] == raw
+    # Re-validating (after field verification) keeps the first raw output
+    again, _ = validate_output(normalized)
+    assert again['raw_schema'] == raw
+
+
+def test_validate_output_without_errors_adds_nothing():
+    normalized, errors = validate_output({'corrected_schema': {'shipment_document': {'document_number': '237029'}}})
+    assert errors == []
+    assert 'raw_schema' not in normalized
@@ -0,0 +1,54 @@
+import asyncio
+
+from app.services import worker
+
+JOB = {'id': 3, 'file_path': "a.pdf", 'dataset_name': "ds", 'original_filename': "a.pdf",
+       'document_id': "ds/a.pdf", 'attempts': 1, 'max_attempts': 3}
+
+
+def setup(monkeypatch, lease_held: bool, seconds: float):
+    calls = []
+
+    async def process_bundle(*args, **kwargs):
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            calls.append("cancelled")
+            raise
+
+    monkeypatch.setattr(worker, "HEARTBEAT_SECONDS", 0.01)
+    monkeypatch.setattr(worker, "process_bundle", process_bundle)
+    monkeypatch.setattr(worker, "heartbeat", lambda job_id, worker_id: lease_held)
+    monkeypatch.setattr(worker, "complete_job", lambda job_id, worker_id: calls.append("complete"))
+    monkeypatch.setattr(worker, "fail_job", lambda *args: calls.append("fail"))
+    return calls
+
+
+def test_lost_lease_cancels_the_job(monkeypatch):
+    calls = setup(monkeypatch, lease_held=False, seconds=5)
+    asyncio.run(asyncio.wait_for(worker.run_job(JOB, "w/0"), 2))
+    # Neither completed nor failed: the worker that took the job over owns it now
+    assert calls == ["cancelled"]
+
+
+def test_held_lease_lets_the_job_finish(monkeypatch):
+    calls = setup(monkeypatch, lease_held=True, seconds=0.05)
+    asyncio.run(worker.run_job(JOB, "w/0"))
+    assert calls == ["complete"]
+
+
+def test_shutdown_cancellation_propagates(monkeypatch):
+    calls = setup(monkeypatch, lease_held=True, seconds=5)
+
+    async def main():
+        task = asyncio.create_task(worker.run_job(JOB, "w/0"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(main())
+    assert calls == ["cancelled"]
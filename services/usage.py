@@ -0,0 +1,213 @@
+"""
+Token and cost accounting for model calls.
+
+Backends call record_usage() after each Gemini response; the tokens land on the tracker of the
+document currently being processed (a context variable, so concurrent documents do not mix).
+process_file stores the per-stage totals in the document properties and in the token_usage table,
+which also backs the per-dataset monthly budgets and the aggregate report:
+
+    python -m app.services.usage [--since 2025-09-01] [--dataset NAME]
+"""
+from app.core.db import get_db_connection
+from contextlib import contextmanager
+import argparse
+import contextvars
+import threading
+
+# USD per 1M tokens (list prices); cached input is billed at the cached rate
+PRICES = {
+    "gemini-2.0-flash": {"input": 0.10, "output": 0.40, "cached": 0.025},
+    "gemini-2.0-flash-lite": {"input": 0.075, "output": 0.30, "cached": 0.01875},
+    "gemini-2.5-flash": {"input": 0.30, "output": 2.50, "cached": 0.075},
+    "gemini-2.5-flash-lite": {"input": 0.10, "output": 0.40, "cached": 0.025},
+}
+
+# Used instead of the defaults once a dataset is over budget
+CHEAP_MERGE_MODEL = "gemini-2.5-flash-lite"
+
+_tracker = contextvars.ContextVar("usage_tracker", default=None)
+_schema_ready = False
+
+
+def cost_usd(model: str, input_tokens: int, output_tokens: int, cached_tokens: int) -> float:
+    price = PRICES.get(model)
+    if not price:
+        return 0.0
+    billed_input = max(input_tokens - cached_tokens, 0)
+    return (billed_input * price["input"] + cached_tokens * price["cached"] + output_tokens * price["output"]) / 1_000_000
+
+
+class UsageTracker:
+    """Token counts per stage for one document."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, model: str, input_tokens: int, output_tokens: int, cached_tokens: int,
+            price_factor: float = 1.0):
+        with self._lock:
+            entry = self.stages.setdefault((stage, model), {
+                'stage': stage, 'model': model, 'calls': 0,
+                'input_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0, 'cost_usd': 0.0
+            })
+            entry['calls'] += 1
+            entry['input_tokens'] += input_tokens
+            entry['output_tokens'] += output_tokens
+            entry['cached_tokens'] += cached_tokens
+            entry['cost_usd'] += cost_usd(model, input_tokens, output_tokens, cached_tokens) * price_factor
+
+    def summary(self) -> dict:
+        with self._lock:
+            stages = [dict(entry, cost_usd=round(entry['cost_usd'], 6)) for entry in self.stages.values()]
+        total = {key: sum(s[key] for s in stages) for key in ('calls', 'input_tokens', 'output_tokens', 'cached_tokens')}
+        total['cost_usd'] = round(sum(s['cost_usd'] for s in stages), 6)
+        return {'stages': stages, 'total': total}
+
+
+@contextmanager
+def track_usage():
+    """Collect usage of every model call made in this context (including asyncio.to_thread calls)."""
+    tracker = UsageTracker()
+    token = _tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _tracker.reset(token)
+
+
+def record_usage(stage: str, model: str, response, price_factor: float = 1.0):
+    """
+    Record `usage_metadata` of a google-genai / google-generativeai response, if tracking.
+    `price_factor` scales the list price (0.5 for Batch API requests).
+    """
+    tracker = _tracker.get()
+    metadata = getattr(response, "usage_metadata", None)
+    if tracker is None or metadata is None:
+        return
+    # Thinking tokens of 2.5 models are billed as output
+    output_tokens = (getattr(metadata, "candidates_token_count", 0) or 0) + (getattr(metadata, "thoughts_token_count", 0) or 0)
+    tracker.add(
+        stage,
+        model,
+        getattr(metadata, "prompt_token_count", 0) or 0,
+        output_tokens,
+        getattr(metadata, "cached_content_token_count", 0) or 0,
+        price_factor
+    )
+
+
+# -------------------- STORAGE AND BUDGETS --------------------
+def ensure_usage_table(cur):
+    global _schema_ready
+    if _schema_ready:
+        return
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS token_usage (
+            id BIGSERIAL PRIMARY KEY,
+            document_id TEXT NOT NULL,
+            dataset TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            model TEXT NOT NULL,
+            calls INTEGER NOT NULL,
+            input_tokens BIGINT NOT NULL,
+            output_tokens BIGINT NOT NULL,
+            cached_tokens BIGINT NOT NULL,
+            cost_usd NUMERIC(12, 6) NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS token_usage_dataset_idx ON token_usage (dataset, created_at)")
+    _schema_ready = True
+
+
+def save_usage(document_id: str, dataset_name: str, summary: dict):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_usage_table(cur)
+            for s in summary['stages']:
+                cur.execute(
+                    """
+                    INSERT INTO token_usage
+                        (document_id, dataset, stage, model, calls, input_tokens, output_tokens, cached_tokens, cost_usd)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (document_id, dataset_name, s['stage'], s['model'], s['calls'],
+                     s['input_tokens'], s['output_tokens'], s['cached_tokens'], s['cost_usd'])
+                )
+            conn.commit()
+
+
+def month_to_date(dataset_name: str) -> tuple[int, float]:
+    """(tokens, cost_usd) spent by a dataset in the current calendar month."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_usage_table(cur)
+            conn.commit()
+            cur.execute(
+                """
+                SELECT COALESCE(SUM(input_tokens + output_tokens), 0), COALESCE(SUM(cost_usd), 0)
+                FROM token_usage
+                WHERE dataset = %s AND created_at >= date_trunc('month', now())
+                """,
+                (dataset_name,)
+            )
+            tokens, cost = cur.fetchone()
+    return int(tokens), float(cost)
+
+
+def over_budget(dataset_name: str, config: dict) -> bool:
+    """
+    Budgets live in the configuration row per dataset:
+    {"<dataset>": {"monthly_budget_usd": 50, "monthly_token_budget": 20000000}}
+    """
+    dataset_config = config.get(dataset_name, {}) if isinstance(config, dict) else {}
+    budget_usd = dataset_config.get("monthly_budget_usd")
+    budget_tokens = dataset_config.get("monthly_token_budget")
+    if budget_usd is None and budget_tokens is None:
+        return False
+    tokens, cost = month_to_date(dataset_name)
+    return (budget_usd is not None and cost >= budget_usd) or (budget_tokens is not None and tokens >= budget_tokens)
+
+
+def usage_report(since=None, dataset_name: str = None) -> list[dict]:
+    """Token and cost totals grouped by dataset, stage and model."""
+    clauses, params = [], []
+    if since:
+        clauses.append("created_at >= %s")
+        params.append(since)
+    if dataset_name:
+        clauses.append("dataset = %s")
+        params.append(dataset_name)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            ensure_usage_table(cur)
+            conn.commit()
+            cur.execute(
+                f"""
+                SELECT dataset, stage, model, COUNT(DISTINCT document_id), SUM(calls),
+                       SUM(input_tokens), SUM(output_tokens), SUM(cached_tokens), SUM(cost_usd)
+                FROM token_usage {where}
+                GROUP BY dataset, stage, model
+                ORDER BY SUM(cost_usd) DESC
+                """,
+                params
+            )
+            rows = cur.fetchall()
+    keys = ('dataset', 'stage', 'model', 'documents', 'calls', 'input_tokens', 'output_tokens', 'cached_tokens', 'cost_usd')
+    return [dict(zip(keys, row)) for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Token and cost report per dataset, stage and model.")
+    parser.add_argument("--since", help="ISO date, e.g. 2025-09-01")
+    parser.add_argument("--dataset")
+    args = parser.parse_args()
+
+    print(f"{'dataset':20} {'stage':18} {'model':24} {'docs':>7} {'input':>12} {'output':>12} {'cached':>10} {'USD':>10} {'USD/doc':>9}")
+    for row in usage_report(args.since, args.dataset):
+        per_doc = float(row['cost_usd']) / row['documents'] if row['documents'] else 0.0
+        print(f"{row['dataset']:20} {row['stage']:18} {row['model']:24} {row['documents']:>7} "
+              f"{row['input_tokens']:>12} {row['output_tokens']:>12} {row['cached_tokens']:>10} "
+              f"{float(row['cost_usd']):>10.4f} {per_doc:>9.5f}")
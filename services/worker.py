@@ -0,0 +1,117 @@
+"""
+Job worker: claims queued documents from the `jobs` table and runs process_bundle on them
+(which splits multi-document PDFs and processes each part with process_file).
+Run any number of these on any number of nodes:
+
+    python -m app.services.worker --concurrency 2
+"""
+from app.services.jobs import claim_job, complete_job, fail_job, heartbeat, requeue_stale_jobs
+from app.services.document_store import mark_stage
+from app.services.process import process_bundle
+from app.services.settings import WORKER_HEARTBEAT_SECONDS as HEARTBEAT_SECONDS
+from app.services.settings import WORKER_POLL_INTERVAL_SECONDS as POLL_INTERVAL_SECONDS
+from app.services.settings import WORKER_REAP_INTERVAL_SECONDS as REAP_INTERVAL_SECONDS
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import traceback
+
+
+async def keep_alive(job_id: int, worker_id: str, work: asyncio.Task):
+    """Extend the lease while `work` runs. A lost lease means another worker has the job: stop ours."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        if not await asyncio.to_thread(heartbeat, job_id, worker_id):
+            print(f"⚠️ Lost lease on job {job_id}, cancelling it")
+            work.cancel()
+            return
+
+
+def is_permanent_failure(e: Exception) -> bool:
+    """
+    Client errors raised as HTTP exceptions (413: over the admission limits) fail the same way on
+    every attempt. A 503 (admission queue full) and everything else is worth retrying.
+    """
+    status = getattr(e, "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500
+
+
+async def run_job(job: dict, worker_id: str):
+    work = asyncio.create_task(process_bundle(
+        job['file_path'],
+        job['dataset_name'],
+        job['original_filename'],
+        on_stage=lambda flag: mark_stage(job['document_id'], flag)
+    ))
+    pulse = asyncio.create_task(keep_alive(job['id'], worker_id, work))
+    try:
+        await work
+        await asyncio.to_thread(complete_job, job['id'], worker_id)
+        print(f"✅ Job {job['id']} done: {job['document_id']}")
+    except asyncio.CancelledError:
+        # Shutting down (this task was cancelled) vs. cancelled by keep_alive after a lost lease
+        if asyncio.current_task().cancelling() or not work.cancelled():
+            raise
+        # The job belongs to another worker now; completing or failing it is up to that worker
+        print(f"⏹️ Job {job['id']} stopped: lease taken over by another worker")
+    except Exception as e:
+        traceback.print_exc()
+        permanent = is_permanent_failure(e)
+        await asyncio.to_thread(fail_job, job['id'], worker_id, str(e), permanent)
+        if permanent:
+            print(f"❌ Job {job['id']} failed permanently: {e}")
+        else:
+            print(f"❌ Job {job['id']} failed (attempt {job['attempts']}/{job['max_attempts']}): {e}")
+    finally:
+        pulse.cancel()
+
+
+async def claim_loop(worker_id: str, stopping: asyncio.Event):
+    while not stopping.is_set():
+        job = await asyncio.to_thread(claim_job, worker_id)
+        if job is None:
+            try:
+                await asyncio.wait_for(stopping.wait(), POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(job, worker_id)
+
+
+async def reap_loop(stopping: asyncio.Event):
+    while not stopping.is_set():
+        requeued = await asyncio.to_thread(requeue_stale_jobs)
+        if requeued:
+            print(f"🔁 Requeued {requeued} stale jobs")
+        try:
+            await asyncio.wait_for(stopping.wait(), REAP_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_worker(concurrency: int = 2):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = asyncio.Event()
+
+    # Finish in-flight jobs on SIGTERM/SIGINT, but stop claiming new ones
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            pass
+
+    print(f"🛠️ Worker {worker_id} started with {concurrency} slots")
+    await asyncio.gather(
+        reap_loop(stopping),
+        *(claim_loop(f"{worker_id}/{slot}", stopping) for slot in range(concurrency))
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process queued documents.")
+    parser.add_argument("--concurrency", type=int, default=2, help="Jobs processed at once by this worker")
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.concurrency))